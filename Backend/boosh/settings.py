@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'drf_yasg',
@@ -182,6 +183,27 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024   # 10MB
 
 ALLOWED_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
 
+# Scraper
+SCRAPER_CACHE_DIR = os.path.join(BASE_DIR, 'scraper_cache')
+SCRAPER_ARCHIVE_DIR = os.path.join(BASE_DIR, 'scraper_archive')
+
+# Prometheus metrics: only these addresses or networks may read /metrics
+METRICS_ALLOWED_NETWORKS = [
+    network.strip()
+    for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',')
+    if network.strip()
+]
+
+# Celery
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'cache+memory://')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '') == '1'
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Book, Genre
+from .models import Book, BookHistory, Genre
 
 admin.site.register(Book)
-admin.site.register(Genre)
\ No newline at end of file
+admin.site.register(Genre)
+admin.site.register(BookHistory)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def archive_dir(log_id):
+    return os.path.join(settings.SCRAPER_ARCHIVE_DIR, str(log_id))
+
+
+def build_record(url, content, fetched_at):
+    # A WARC "resource" record: the page body without the HTTP headers
+    header = (
+        'WARC/1.0\r\n'
+        'WARC-Type: resource\r\n'
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n'
+        f'WARC-Date: {fetched_at}\r\n'
+        f'WARC-Target-URI: {url}\r\n'
+        'Content-Type: text/html\r\n'
+        f'Content-Length: {len(content)}\r\n'
+        '\r\n'
+    )
+    return header.encode('utf-8') + content + b'\r\n\r\n'
+
+
+def parse_record(record):
+    header, _, body = record.partition(b'\r\n\r\n')
+    fields = dict(
+        line.split(': ', 1) for line in header.decode('utf-8').split('\r\n')[1:] if ': ' in line
+    )
+    return body[:int(fields['Content-Length'])]
+
+
+class PageArchive:
+    KINDS = ('listing', 'detail')
+
+    def __init__(self, log_id, segment_size=SEGMENT_SIZE):
+        self.directory = archive_dir(log_id)
+        self.segment_size = segment_size
+        # Shard processes and resumed runs archive into the same directory,
+        # each writer appends to its own segments and index
+        self.writer_id = uuid.uuid4().hex[:12]
+        self.lock = threading.Lock()
+        self.segment_number = 0
+        self.segment = None
+        self.index = None
+        self.pages = 0
+
+    def _open_segment(self):
+        if self.segment:
+            self.segment.close()
+        self.segment_number += 1
+        name = f'{self.writer_id}-{self.segment_number:05d}.warc.gz'
+        self.segment = open(os.path.join(self.directory, name), 'ab')
+        self.segment_name = name
+
+    def write(self, url, kind, content):
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        # Every record is a gzip member of its own, so it can be read back from its offset
+        record = gzip.compress(build_record(url, content, fetched_at), compresslevel=6)
+
+        with self.lock:
+            if self.index is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.index = open(os.path.join(self.directory, f'{self.writer_id}.idx'), 'a', encoding='utf-8')
+            if self.segment is None or self.segment.tell() + len(record) > self.segment_size:
+                self._open_segment()
+
+            offset = self.segment.tell()
+            self.segment.write(record)
+            self.segment.flush()
+            self.index.write(json.dumps({
+                'url': url,
+                'kind': kind,
+                'segment': self.segment_name,
+                'offset': offset,
+                'length': len(record),
+                'fetched_at': fetched_at,
+            }) + '\n')
+            self.index.flush()
+            self.pages += 1
+
+    def close(self):
+        with self.lock:
+            for handle in (self.segment, self.index):
+                if handle:
+                    handle.close()
+            self.segment = self.index = None
+
+
+class ArchiveReader:
+    def __init__(self, log_id):
+        self.directory = archive_dir(log_id)
+
+    def exists(self):
+        return os.path.isdir(self.directory) and any(name.endswith('.idx') for name in os.listdir(self.directory))
+
+    def entries(self, kind=None):
+        latest = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.idx'):
+                continue
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of a writer that was killed mid-write
+                        continue
+                    if kind and entry['kind'] != kind:
+                        continue
+                    # A page fetched again by a resumed run replaces the older copy
+                    current = latest.get(entry['url'])
+                    if current is None or entry['fetched_at'] >= current['fetched_at']:
+                        latest[entry['url']] = entry
+        return list(latest.values())
+
+    def read(self, entry):
+        with open(os.path.join(self.directory, entry['segment']), 'rb') as segment:
+            segment.seek(entry['offset'])
+            return parse_record(gzip.decompress(segment.read(entry['length'])))
+
+    def iter_pages(self, kind=None):
+        by_segment = defaultdict(list)
+        for entry in self.entries(kind):
+            by_segment[entry['segment']].append(entry)
+
+        # Records are read in file order, one segment at a time
+        for name in sorted(by_segment):
+            with open(os.path.join(self.directory, name), 'rb') as segment:
+                for entry in sorted(by_segment[name], key=lambda entry: entry['offset']):
+                    segment.seek(entry['offset'])
+                    yield entry, parse_record(gzip.decompress(segment.read(entry['length'])))
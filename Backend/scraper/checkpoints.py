@@ -0,0 +1,89 @@
+import threading
+
+from django.db import transaction
+
+from .frontier import url_key
+from .models import CrawlUrl
+
+
+class CrawlCheckpoint:
+    def __init__(self, scraping_log):
+        self.scraping_log = scraping_log
+        self.lock = threading.Lock()
+        self.new_rows = {}
+        self.done_keys = set()
+
+    def _add(self, url, kind, parent_url=''):
+        key = url_key(url)
+        self.new_rows.setdefault(key, CrawlUrl(
+            scraping_log=self.scraping_log,
+            url=url,
+            url_hash=key,
+            kind=kind,
+            parent_url=parent_url
+        ))
+
+    def _mark_done(self, url):
+        self.done_keys.add(url_key(url))
+
+    def pages_found(self, urls):
+        with self.lock:
+            for url in urls:
+                self._add(url, 'listing')
+
+    def listing_done(self, page_url, detail_urls):
+        with self.lock:
+            for url in detail_urls:
+                self._add(url, 'detail')
+            self._mark_done(page_url)
+
+    def details_done(self, urls):
+        with self.lock:
+            for url in urls:
+                self._mark_done(url)
+
+    def image_pending(self, book_url, image_url):
+        with self.lock:
+            self._add(image_url, 'image', parent_url=book_url)
+
+    def images_done(self, image_urls):
+        self.details_done(image_urls)
+
+    def flush(self):
+        with self.lock:
+            new_rows, self.new_rows = list(self.new_rows.values()), {}
+            done_keys, self.done_keys = list(self.done_keys), set()
+
+        if not new_rows and not done_keys:
+            return
+
+        with transaction.atomic():
+            CrawlUrl.objects.bulk_create(new_rows, ignore_conflicts=True)
+            if done_keys:
+                CrawlUrl.objects.filter(
+                    scraping_log=self.scraping_log,
+                    url_hash__in=done_keys
+                ).update(status='done')
+
+    def restore(self, frontier):
+        rows = CrawlUrl.objects.filter(scraping_log=self.scraping_log).values_list(
+            'url', 'kind', 'status', 'parent_url'
+        )
+
+        pending_images = []
+        pending = []
+        for url, kind, status, parent_url in rows.iterator():
+            if status == 'done':
+                frontier.mark_seen(url, is_page=kind == 'listing')
+            elif kind == 'image':
+                pending_images.append((parent_url, url))
+            else:
+                pending.append((url, kind))
+
+        for url, kind in pending:
+            if kind == 'listing':
+                frontier.add_page(url)
+            else:
+                frontier.add_detail(url)
+
+        return pending_images
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.core.files.base import ContentFile
+
+from .imaging import DERIVATIVE_FORMATS, render_derivatives
+from .models import Book
+from .pools import process_pool
+
+logger = logging.getLogger(__name__)
+
+COVERS_DIR = 'book_covers'
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class CoverStore:
+    def __init__(self, storage=None):
+        self.storage = storage or Book._meta.get_field('image').storage
+
+    def name_for(self, digest, extension, size=None):
+        suffix = f"_{size}" if size else ''
+        return f"{COVERS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{suffix}{extension.lower()}"
+
+    def _write(self, name, content):
+        if not self.storage.exists(name):
+            saved_name = self.storage.save(name, ContentFile(content))
+            if saved_name != name:
+                # Another writer stored the same content between exists() and save()
+                self.storage.delete(saved_name)
+
+    def save(self, content, filename, digest=None):
+        digest = digest or content_hash(content)
+        extension = os.path.splitext(filename)[1] or '.jpg'
+        name = self.name_for(digest, extension)
+        self._write(name, content)
+        return name, digest
+
+    def save_derivatives(self, digest, rendered):
+        derivatives = {}
+        for size, image_format, width, height, content in rendered:
+            name = self.name_for(digest, DERIVATIVE_FORMATS[image_format][1], size=size)
+            self._write(name, content)
+            derivatives.setdefault(size, {'width': width, 'height': height})[image_format] = name
+        return derivatives
+
+    def iter_files(self, directory=COVERS_DIR):
+        try:
+            directories, files = self.storage.listdir(directory)
+        except FileNotFoundError:
+            return
+
+        for filename in files:
+            yield f"{directory}/{filename}"
+        for subdirectory in directories:
+            yield from self.iter_files(f"{directory}/{subdirectory}")
+
+
+class DerivativeBuilder:
+    def __init__(self, store=None, workers=None, max_pending=None):
+        self.store = store or CoverStore()
+        self.workers = workers
+        # Every pending render holds a whole cover in the pool's call queue
+        self.max_pending = max_pending or 2 * (workers or os.cpu_count() or 1)
+        self.executor = None
+        self.pending = {}
+        self.finished = {}
+
+    def submit(self, digest, content):
+        if digest in self.pending or digest in self.finished:
+            return
+        if self.executor is None:
+            self.executor = process_pool(self.workers)
+        while len(self.pending) >= self.max_pending:
+            wait(self.pending.values(), return_when=FIRST_COMPLETED)
+            self.store_done()
+        self.pending[digest] = self.executor.submit(render_derivatives, content)
+
+    def store_done(self, block=False):
+        for digest, future in list(self.pending.items()):
+            if not block and not future.done():
+                continue
+
+            del self.pending[digest]
+            try:
+                self.finished[digest] = self.store.save_derivatives(digest, future.result())
+            except Exception as e:
+                logger.warning(f"Couldn't build derivatives for cover {digest}: {e}")
+
+    def collect(self, wait=False):
+        self.store_done(block=wait)
+        finished, self.finished = self.finished, {}
+        if wait:
+            self.close()
+        return finished
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class Subscription:
+    def __init__(self, bus, scraping_log_id, max_events=1000):
+        self.bus = bus
+        self.scraping_log_id = scraping_log_id
+        self.condition = threading.Condition()
+        # A slow client loses the oldest events instead of growing memory
+        self.buffer = deque(maxlen=max_events)
+
+    def put(self, event):
+        with self.condition:
+            self.buffer.append(event)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        # None when nothing arrived within the timeout
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.buffer, timeout):
+                return None
+            return self.buffer.popleft()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, scraping_log_id):
+        subscription = Subscription(self, scraping_log_id)
+        with self.lock:
+            self.subscribers[scraping_log_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.scraping_log_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[subscription.scraping_log_id]
+
+    def has_subscribers(self, scraping_log_id):
+        return scraping_log_id in self.subscribers
+
+    def publish(self, scraping_log_id, event, **data):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(scraping_log_id, ()))
+        if not subscriptions:
+            return
+
+        message = {'event': event, 'scraping_id': scraping_log_id, 'time': time.time(), **data}
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+def format_event(message):
+    return f"event: {message['event']}\ndata: {json.dumps(message, cls=DjangoJSONEncoder)}\n\n"
+
+
+bus = EventBus()
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import deque
+from urllib.parse import urldefrag
+
+
+def url_key(url):
+    # 64-bit digest instead of the URL string keeps the seen set small;
+    # signed so it also fits a BigIntegerField
+    digest = hashlib.blake2b(urldefrag(url)[0].encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class CrawlFrontier:
+    def __init__(self, seeds=(), max_pages=None, follow_links=True, follow_categories=False):
+        self.max_pages = max_pages
+        self.follow_links = follow_links
+        self.follow_categories = follow_categories
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.details = deque()
+        self.seen = set()
+        self.pages_added = 0
+        self.pages_done = 0
+
+        for url in seeds:
+            self.add_page(url)
+
+    def add_page(self, url):
+        key = url_key(url)
+        with self.lock:
+            if key in self.seen:
+                return False
+            if self.max_pages is not None and self.pages_added >= self.max_pages:
+                return False
+
+            self.seen.add(key)
+            self.queue.append(url)
+            self.pages_added += 1
+            return True
+
+    def add_links(self, next_url=None, category_urls=()):
+        if not self.follow_links:
+            return []
+
+        candidates = [next_url] if next_url else []
+        if self.follow_categories:
+            candidates.extend(category_urls)
+        return [url for url in candidates if self.add_page(url)]
+
+    def add_detail(self, url):
+        if self.claim(url):
+            with self.lock:
+                self.details.append(url)
+
+    def pop_detail(self):
+        with self.lock:
+            if self.details:
+                return self.details.popleft()
+            return None
+
+    def mark_seen(self, url, is_page=False):
+        with self.lock:
+            self.seen.add(url_key(url))
+            if is_page:
+                self.pages_added += 1
+
+    def pop_page(self):
+        with self.lock:
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+    def page_done(self):
+        with self.lock:
+            self.pages_done += 1
+
+    def claim(self, url):
+        key = url_key(url)
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            return True
+
+    @property
+    def state(self):
+        with self.lock:
+            return {
+                'pending_pages': len(self.queue),
+                'pending_details': len(self.details),
+                'pages_added': self.pages_added,
+                'pages_done': self.pages_done,
+                'urls_seen': len(self.seen),
+            }
+
+    def __len__(self):
+        with self.lock:
+            return len(self.queue)
@@ -0,0 +1,114 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import BookHistory, Genre
+
+TRACKED_FIELDS = ('price', 'rating', 'in_stock')
+
+
+def normalize(field, value):
+    if field == 'price' and value is not None:
+        # Parsers return floats, the database a Decimal
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    return value
+
+
+def history_entry(book_id, previous, current, recorded_at):
+    # previous is None for a new book, which records all of its values once
+    changes = {
+        field: normalize(field, current[field])
+        for field in TRACKED_FIELDS
+        if previous is None or normalize(field, previous[field]) != normalize(field, current[field])
+    }
+    if not changes:
+        return None
+    return BookHistory(book_id=book_id, recorded_at=recorded_at, **changes)
+
+
+def tracked_values(book):
+    return {field: getattr(book, field) for field in TRACKED_FIELDS}
+
+
+def record_book_change(book, previous=None):
+    entry = history_entry(book.id, previous, tracked_values(book), timezone.now())
+    if entry:
+        entry.save()
+    return entry
+
+
+def period_start(day, period):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+AVERAGE_PRICES_SQL = """
+WITH books AS ({books}),
+periods AS (
+    SELECT start AT TIME ZONE %s AS starts, (start + %s::interval) AT TIME ZONE %s AS ends
+    FROM generate_series(%s::timestamp, %s::timestamp, %s::interval) AS start
+),
+changes AS (
+    SELECT periods.starts, books.genre_id, COUNT(*) AS price_changes
+    FROM periods
+    JOIN {history} history ON history.recorded_at >= periods.starts AND history.recorded_at < periods.ends
+    JOIN books ON books.id = history.book_id
+    WHERE history.price IS NOT NULL
+    GROUP BY periods.starts, books.genre_id
+)
+SELECT
+    periods.starts,
+    genre.name,
+    ROUND(AVG(last_price.price), 2),
+    COUNT(*),
+    COALESCE(MAX(changes.price_changes), 0)
+FROM periods
+CROSS JOIN books
+CROSS JOIN LATERAL (
+    SELECT history.price
+    FROM {history} history
+    WHERE history.book_id = books.id AND history.price IS NOT NULL AND history.recorded_at < periods.ends
+    ORDER BY history.recorded_at DESC
+    LIMIT 1
+) last_price
+LEFT JOIN {genre} genre ON genre.id = books.genre_id
+LEFT JOIN changes ON changes.starts = periods.starts AND changes.genre_id IS NOT DISTINCT FROM books.genre_id
+GROUP BY periods.starts, books.genre_id, genre.name
+ORDER BY periods.starts, genre.name NULLS FIRST
+"""
+
+PERIOD_INTERVALS = {'day': '1 day', 'week': '7 days', 'month': '1 month'}
+
+
+def average_prices(books, since, period):
+    # Every book counts with its last price at or before the end of each
+    # period, so periods without changes keep their average and one repricing
+    # is one book among many. Each lookup is a seek on bookhistory_price_idx.
+    books_sql, books_params = books.order_by().values('id', 'genre_id').query.sql_with_params()
+    sql = AVERAGE_PRICES_SQL.format(
+        books=books_sql,
+        history=connection.ops.quote_name(BookHistory._meta.db_table),
+        genre=connection.ops.quote_name(Genre._meta.db_table),
+    )
+    interval = PERIOD_INTERVALS[period]
+    tz = timezone.get_current_timezone_name()
+    first = datetime.combine(period_start(timezone.localtime(since).date(), period), time.min)
+    last = datetime.combine(period_start(timezone.localdate(), period), time.min)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*books_params, tz, interval, tz, first, last, interval])
+        return [
+            {
+                'period': timezone.localtime(period_started),
+                'genre': genre,
+                'average_price': average_price,
+                'books': count,
+                'price_changes': price_changes,
+            }
+            for period_started, genre, average_price, count, price_changes in cursor.fetchall()
+        ]
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import requests
+
+
+class ResponseCache:
+    STORED_HEADERS = ('ETag', 'Last-Modified', 'Content-Type')
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return f"{base}.json", f"{base}.body"
+
+    def _read_meta(self, url):
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def conditional_headers(self, url):
+        meta = self._read_meta(url)
+        if not meta:
+            return {}
+
+        headers = {}
+        if meta.get('ETag'):
+            headers['If-None-Match'] = meta['ETag']
+        if meta.get('Last-Modified'):
+            headers['If-Modified-Since'] = meta['Last-Modified']
+        return headers
+
+    def store(self, url, response):
+        if not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            return
+
+        meta = {
+            header: response.headers[header]
+            for header in self.STORED_HEADERS
+            if response.headers.get(header)
+        }
+        meta['url'] = url
+
+        meta_path, body_path = self._paths(url)
+        self._write_atomic(body_path, response.content)
+        self._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def replay(self, url, not_modified_response):
+        meta = self._read_meta(url)
+        _, body_path = self._paths(url)
+        try:
+            with open(body_path, 'rb') as body_file:
+                content = body_file.read()
+        except OSError:
+            return None
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = content
+        response.headers.update({
+            header: meta[header]
+            for header in self.STORED_HEADERS
+            if meta and meta.get(header)
+        })
+        response.headers.update(not_modified_response.headers)
+        response.request = not_modified_response.request
+        response.not_modified = True
+        return response
@@ -0,0 +1,30 @@
+import io
+
+from PIL import Image
+
+# Target widths; None keeps the original size
+DERIVATIVE_WIDTHS = {'thumb': 120, 'card': 320, 'full': None}
+DERIVATIVE_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+}
+
+
+def render_derivatives(content):
+    # Runs in pool processes, so this module must not import Django
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    rendered = []
+    for size, width in DERIVATIVE_WIDTHS.items():
+        resized = image
+        if width and image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+        for image_format, (pil_format, _, options) in DERIVATIVE_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            rendered.append((size, image_format, resized.width, resized.height, buffer.getvalue()))
+    return rendered
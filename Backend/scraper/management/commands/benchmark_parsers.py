@@ -0,0 +1,73 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.parsers import PARSERS
+from scraper.replay import SNAPSHOT_DIR
+
+SNAPSHOT_BASE_URL = 'https://books.toscrape.com/'
+
+
+class Command(BaseCommand):
+    help = 'Compare listing/detail page parsing throughput of the available HTML parsers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages-dir',
+            default=str(SNAPSHOT_DIR),
+            help='Directory with saved pages laid out like the site (catalogue/page-N.html, catalogue/<book>/index.html)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='How many times every page is parsed'
+        )
+
+    def handle(self, *args, **options):
+        pages_dir = Path(options['pages_dir'])
+        listing_pages = self._load(pages_dir, 'catalogue/page-*.html')
+        detail_pages = self._load(pages_dir, 'catalogue/*/index.html')
+
+        if not listing_pages and not detail_pages:
+            raise CommandError(f'No saved pages found in {pages_dir}')
+
+        self.stdout.write(
+            f'Pages: {len(listing_pages)} listing, {len(detail_pages)} detail, '
+            f'{options["iterations"]} iterations'
+        )
+
+        outputs = {}
+        for name, parser_class in PARSERS.items():
+            parser = parser_class()
+            listing_rate, listing_output = self._run(parser.parse_listing, listing_pages, options['iterations'])
+            detail_rate, detail_output = self._run(parser.parse_book, detail_pages, options['iterations'])
+            outputs[name] = (listing_output, detail_output)
+
+            self.stdout.write(
+                f'{name:<12} listing: {listing_rate:9.1f} pages/sec   detail: {detail_rate:9.1f} pages/sec'
+            )
+
+        reference_name = next(iter(outputs))
+        for name, output in outputs.items():
+            if output != outputs[reference_name]:
+                self.stdout.write(
+                    self.style.WARNING(f'{name} output differs from {reference_name}')
+                )
+
+    def _load(self, pages_dir, pattern):
+        return [
+            (SNAPSHOT_BASE_URL + path.relative_to(pages_dir).as_posix(), path.read_bytes())
+            for path in sorted(pages_dir.glob(pattern))
+        ]
+
+    def _run(self, parse, pages, iterations):
+        output = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            output = [parse(content, url) for url, content in pages]
+        elapsed = time.perf_counter() - started
+
+        rate = len(pages) * iterations / elapsed if elapsed else 0.0
+        return rate, output
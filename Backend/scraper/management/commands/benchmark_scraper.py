@@ -0,0 +1,251 @@
+import io
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from scraper.models import ScrapingLog
+from scraper.replay import SNAPSHOT_DIR, ReplayServer
+
+
+class Rollback(Exception):
+    pass
+
+
+def max_rss_mb():
+    # Peak resident set size of this process so far; Linux reports KiB, macOS bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / 1024 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def descendant_pids(pid):
+    if not os.path.isdir('/proc'):
+        return []
+
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    found = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+class WorkerMemory(threading.Thread):
+    # Parse and cover pools start their workers from a forkserver, so they are not
+    # children of this process and RUSAGE_CHILDREN never sees them: their peak RSS
+    # (VmHWM) is read from /proc while the run goes on
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peaks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        for pid in descendant_pids(os.getpid()):
+            try:
+                with open(f'/proc/{pid}/status') as status:
+                    for line in status:
+                        if line.startswith('VmHWM:'):
+                            self.peaks[pid] = max(self.peaks.get(pid, 0), int(line.split()[1]))
+            except (OSError, ValueError):
+                continue
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        # Largest single worker, in MiB
+        return max(self.peaks.values(), default=0) / 1024
+
+
+class Command(BaseCommand):
+    help = 'Run scrape_books end to end against a local replay of a saved snapshot and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot',
+            default=str(SNAPSHOT_DIR),
+            help='Directory laid out like the site, e.g. written by record_snapshot'
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=3,
+            help='Number of runs'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0,
+            help='Added latency per request, in milliseconds'
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0,
+            help='Random extra latency per request, up to this many milliseconds'
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=0,
+            help='Share of requests answered with an injected 503 (0-1)'
+        )
+        parser.add_argument(
+            '--retry-after',
+            type=int,
+            default=None,
+            help='Send Retry-After with injected errors, in seconds'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for latency jitter and error injection'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Passed to scrape_books'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Passed to scrape_books (default: no rate limit)'
+        )
+        parser.add_argument(
+            '--parser',
+            default=None,
+            help='Passed to scrape_books'
+        )
+        parser.add_argument(
+            '--parse-workers',
+            type=int,
+            default=0,
+            help='Passed to scrape_books'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Passed to scrape_books'
+        )
+        parser.add_argument(
+            '--warm-cache',
+            action='store_true',
+            help='Keep the HTTP cache between runs so later runs revalidate instead of downloading'
+        )
+
+    def handle(self, *args, **options):
+        snapshot = Path(options['snapshot'])
+        if not (snapshot / 'catalogue' / 'page-1.html').exists():
+            raise CommandError(f'{snapshot} does not contain catalogue/page-1.html')
+
+        results = []
+        # Covers and cached responses go to a scratch directory, database rows are rolled back
+        with tempfile.TemporaryDirectory() as workdir, override_settings(
+            MEDIA_ROOT=str(Path(workdir) / 'media'),
+            SCRAPER_CACHE_DIR=str(Path(workdir) / 'cache')
+        ):
+            with ReplayServer(
+                snapshot,
+                latency=options['latency'] / 1000,
+                jitter=options['jitter'] / 1000,
+                error_rate=options['error_rate'],
+                retry_after=options['retry_after'],
+                seed=options['seed']
+            ) as server:
+                self.stdout.write(f'Replaying {snapshot} at {server.base_url}')
+                for run in range(1, options['runs'] + 1):
+                    result = self.run_once(server, options)
+                    results.append(result)
+                    self.stdout.write(
+                        f"run {run}: {result['pages']} pages, {result['books']} books in {result['seconds']:.2f}s | "
+                        f"{result['pages_per_second']:.1f} pages/sec, {result['books_per_second']:.1f} books/sec | "
+                        f"max RSS {result['max_rss_mb']:.1f} MiB, workers {result['workers_max_rss_mb']:.1f} MiB | "
+                        f"{result['queries']} queries | "
+                        f"{result['requests']} requests, {result['injected_errors']} injected errors"
+                    )
+
+        if len(results) > 1:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"median: {statistics.median(r['pages_per_second'] for r in results):.1f} pages/sec, "
+                    f"{statistics.median(r['books_per_second'] for r in results):.1f} books/sec, "
+                    f"max RSS {results[-1]['max_rss_mb']:.1f} MiB, "
+                    f"workers {max(r['workers_max_rss_mb'] for r in results):.1f} MiB, "
+                    f"{statistics.median(r['queries'] for r in results):.0f} queries"
+                )
+            )
+
+    def run_once(self, server, options):
+        requests_before, errors_before = server.requests, server.errors
+        result = {}
+
+        # Memory comes from the kernel: tracing allocations would slow the run
+        # down and miss the worker processes
+        worker_memory = WorkerMemory()
+        worker_memory.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                with transaction.atomic():
+                    scraping_log = ScrapingLog.objects.create()
+                    call_command(
+                        'scrape_books',
+                        log_id=scraping_log.id,
+                        base_url=server.base_url,
+                        concurrency=options['concurrency'],
+                        rate=options['rate'],
+                        parser=options['parser'],
+                        parse_workers=options['parse_workers'],
+                        batch_size=options['batch_size'],
+                        no_cache=not options['warm_cache'],
+                        stdout=io.StringIO()
+                    )
+                    scraping_log.refresh_from_db()
+                    result['pages'] = scraping_log.pages_done
+                    result['books'] = scraping_log.books_processed
+                    raise Rollback()
+            except Rollback:
+                pass
+        elapsed = time.perf_counter() - started
+        workers_max_rss_mb = worker_memory.stop()
+
+        result.update(
+            seconds=elapsed,
+            pages_per_second=result['pages'] / elapsed,
+            books_per_second=result['books'] / elapsed,
+            max_rss_mb=max_rss_mb(),
+            workers_max_rss_mb=workers_max_rss_mb,
+            queries=len(queries.captured_queries),
+            requests=server.requests - requests_before,
+            injected_errors=server.errors - errors_before
+        )
+        return result
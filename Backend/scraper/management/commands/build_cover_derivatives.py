@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from scraper.covers import CoverStore, DerivativeBuilder, content_hash
+from scraper.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Build resized JPEG/WebP covers for books that only have the original'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild derivatives for every book with a cover'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of worker processes (default: CPU count)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of covers resized before results are written'
+        )
+
+    def handle(self, *args, **options):
+        store = CoverStore()
+        builder = DerivativeBuilder(store, workers=options['workers'])
+
+        books = Book.objects.exclude(image__isnull=True).exclude(image='')
+        if not options['all']:
+            books = books.filter(image_derivatives={})
+
+        names = {}
+        built = 0
+        covers = books.order_by().values_list('image', 'image_hash').distinct()
+        for name, digest in covers.iterator():
+            try:
+                with store.storage.open(name, 'rb') as cover:
+                    content = cover.read()
+            except FileNotFoundError:
+                self.stdout.write(self.style.WARNING(f'Missing cover file {name}'))
+                continue
+
+            # Covers stored before image_hash existed get their hash filled in here
+            digest = digest or content_hash(content)
+            names[digest] = name
+            builder.submit(digest, content)
+            if len(names) >= options['batch_size']:
+                built += self.store(builder, names)
+
+        built += self.store(builder, names)
+        self.stdout.write(self.style.SUCCESS(f'Built derivatives for {built} covers'))
+
+    def store(self, builder, names):
+        finished = builder.collect(wait=True)
+        digests = {names[digest]: digest for digest in finished}
+        books = list(Book.objects.filter(image__in=digests.keys()).only('id', 'image'))
+        for book in books:
+            book.image_hash = digests[book.image.name]
+            book.image_derivatives = finished[book.image_hash]
+        Book.objects.bulk_update(books, ['image_hash', 'image_derivatives'])
+        names.clear()
+        return len(finished)
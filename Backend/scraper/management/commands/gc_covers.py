@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from scraper.covers import CoverStore
+from scraper.imaging import DERIVATIVE_FORMATS
+from scraper.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Delete cover files in book_covers/ that are not referenced by any book'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list orphaned files'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Keep files younger than this many minutes (they may belong to a running scrape)'
+        )
+
+    def handle(self, *args, **options):
+        store = CoverStore()
+        referenced = set()
+        covers = Book.objects.exclude(image__isnull=True).exclude(image='').values_list('image', 'image_derivatives')
+        for image, derivatives in covers.iterator():
+            referenced.add(image)
+            for derivative in derivatives.values():
+                referenced.update(derivative.get(image_format) for image_format in DERIVATIVE_FORMATS)
+        cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+
+        orphaned = 0
+        freed_bytes = 0
+        for name in store.iter_files():
+            if name in referenced:
+                continue
+            if store.storage.get_modified_time(name) > cutoff:
+                continue
+
+            orphaned += 1
+            freed_bytes += store.storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                store.storage.delete(name)
+
+        action = 'Found' if options['dry_run'] else 'Deleted'
+        self.stdout.write(
+            self.style.SUCCESS(f'{action} {orphaned} orphaned cover files ({freed_bytes} bytes)')
+        )
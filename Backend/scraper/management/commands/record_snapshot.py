@@ -0,0 +1,98 @@
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.frontier import CrawlFrontier
+from scraper.management.commands.scrape_books import BookScraper
+
+
+class Command(BaseCommand):
+    help = 'Save listing pages, book pages and covers of the site into a directory the replay server can serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            required=True,
+            help='Directory to write the snapshot to'
+        )
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=2,
+            help='Number of listing pages to record'
+        )
+        parser.add_argument(
+            '--base-url',
+            default=BookScraper.BASE_URL,
+            help='Site to record'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Maximum number of parallel requests'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Maximum requests per second'
+        )
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        saved = 0
+
+        with BookScraper(
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+            base_url=options['base_url']
+        ) as scraper:
+            frontier = CrawlFrontier(
+                [f"{scraper.base_url}catalogue/page-1.html"],
+                max_pages=options['pages']
+            )
+            while (page_url := frontier.pop_page()) is not None:
+                response = scraper.get_page(page_url, kind='listing')
+                if not response:
+                    raise CommandError(f"Couldn't get the page {page_url}")
+                saved += self.save(output, scraper.base_url, page_url, response.content)
+
+                listing = scraper.parser.parse_listing(response.content, page_url)
+                frontier.add_links(listing['next_url'])
+                image_urls = {item['thumbnail_url'] for item in listing['items'] if item['thumbnail_url']}
+
+                book_urls = [item['url'] for item in listing['items']]
+                for book_url, book_response in zip(book_urls, scraper.executor.map(scraper.get_page, book_urls)):
+                    if not book_response:
+                        self.stdout.write(self.style.WARNING(f'Skipped {book_url}'))
+                        continue
+                    saved += self.save(output, scraper.base_url, book_url, book_response.content)
+                    book_data = scraper.parser.parse_book(book_response.content, book_url)
+                    if book_data['image_url']:
+                        image_urls.add(book_data['image_url'])
+
+                image_urls = sorted(image_urls)
+                for image_url, (content, _) in zip(image_urls, scraper.executor.map(scraper.download_image, image_urls)):
+                    if content:
+                        saved += self.save(output, scraper.base_url, image_url, content)
+
+                self.stdout.write(f'Recorded {page_url}: {len(book_urls)} books, {len(image_urls)} images')
+
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved} files to {output}'))
+
+    def save(self, output, base_url, url, content):
+        base_path = urlparse(base_url).path
+        path = urlparse(url).path
+        if not url.startswith(base_url) or not path.startswith(base_path):
+            return 0
+
+        relative_path = path[len(base_path):]
+        if not relative_path or relative_path.endswith('/'):
+            relative_path += 'index.html'
+
+        target = output / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+        return 1
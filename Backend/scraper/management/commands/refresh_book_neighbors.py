@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.models import Book
+from scraper.recommendations import DEFAULT_NEIGHBORS, refresh_neighbors
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar books of books whose favorites changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute the similar books of every book, not only the changed ones'
+        )
+        parser.add_argument(
+            '--neighbors',
+            type=int,
+            default=DEFAULT_NEIGHBORS,
+            help='Number of similar books kept per book'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of books whose similar books are replaced per transaction'
+        )
+
+    def handle(self, *args, **options):
+        if options['neighbors'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--neighbors and --chunk-size must be positive')
+
+        changed_ids = None
+        if not options['full']:
+            changed_ids = list(Book.objects.filter(neighbors_stale_since__isnull=False).values_list('id', flat=True))
+            if not changed_ids:
+                self.stdout.write('No favorites changed since the last refresh')
+                return
+
+        started = time.perf_counter()
+        books, rows = refresh_neighbors(changed_ids, k=options['neighbors'], chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f'Refreshed similar books of {books} books in {elapsed:.2f}s, {rows} rows written')
+        )
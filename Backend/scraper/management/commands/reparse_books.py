@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.archive import ArchiveReader
+from scraper.management.commands.scrape_books import BookWriter, iter_batches
+from scraper.models import ScrapingLog
+from scraper.parsers import DEFAULT_PARSER, PARSERS, get_parser, parse_in_process
+from scraper.pools import process_pool
+
+
+class Command(BaseCommand):
+    help = 'Parse the pages archived by a scrape_books --archive run again and update the books, without fetching anything'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-archive',
+            type=int,
+            required=True,
+            metavar='LOG_ID',
+            help='Scraping run whose archive is reparsed'
+        )
+        parser.add_argument(
+            '--parser',
+            choices=sorted(PARSERS),
+            default=DEFAULT_PARSER,
+            help='HTML parser used for listing and detail pages'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Parse pages in N worker processes (default: 0, parse in this process)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of books committed to the database per transaction'
+        )
+
+    def handle(self, *args, **options):
+        log_id = options['from_archive']
+        if not ScrapingLog.objects.filter(id=log_id).exists():
+            raise CommandError(f'Scraping log {log_id} does not exist')
+
+        reader = ArchiveReader(log_id)
+        if not reader.exists():
+            raise CommandError(f'Scraping #{log_id} has no archive in {reader.directory}')
+
+        self.parser = get_parser(options['parser'])
+        self.pool = process_pool(options['workers']) if options['workers'] else None
+        self.pages = 0
+        self.errors = 0
+        writer = BookWriter()
+        started = time.perf_counter()
+
+        try:
+            # Listing pages are not reparsed: their fingerprints describe prices
+            # that may be out of date, fast refresh fetches those books in full
+            created = updated = 0
+            for batch in iter_batches(reader.iter_pages('detail'), options['batch_size']):
+                books = self.parse_batch('parse_book', batch)
+                # Covers are not archived, the stored ones are kept; so are price, rating
+                # and stock, which may have changed since the page was archived
+                created_count, updated_count = writer.save(books, skip_images=True, reparse=True)
+                created += created_count
+                updated += updated_count
+                self.stdout.write(f'Saved {created + updated} books...')
+        finally:
+            if self.pool:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Reparsed {self.pages} pages of scraping #{log_id} in {elapsed:.2f}s ({self.pages / elapsed:.1f} pages/sec). '
+                f'Created: {created}, updated: {updated}, errors: {self.errors}'
+            )
+        )
+
+    def parse_batch(self, method, batch):
+        futures = []
+        if self.pool:
+            futures = [
+                self.pool.submit(parse_in_process, self.parser.name, method, content, entry['url'])
+                for entry, content in batch
+            ]
+
+        parsed = []
+        for index, (entry, content) in enumerate(batch):
+            self.pages += 1
+            try:
+                if futures:
+                    parsed.append(futures[index].result())
+                else:
+                    parsed.append(getattr(self.parser, method)(content, entry['url']))
+            except Exception as e:
+                self.errors += 1
+                self.stderr.write(f"Couldn't parse {entry['url']}: {e}")
+        return parsed
@@ -1,209 +1,716 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
-from django.core.files.base import ContentFile
-from scraper.models import Book, Genre, ScrapingLog
+from scraper.models import Book, BookHistory, Genre, ScrapingLog
+from scraper.history import TRACKED_FIELDS, history_entry
+from scraper.sampling import bump_catalogue_version
+from scraper.throttling import HostLimiter
+from scraper.http_cache import ResponseCache
+from scraper.parsers import get_parser, parse_in_process, PARSERS, DEFAULT_PARSER
+from scraper.pools import process_pool
+from scraper.covers import CoverStore, DerivativeBuilder, content_hash
+from scraper.frontier import CrawlFrontier
+from scraper.checkpoints import CrawlCheckpoint
+from scraper.archive import PageArchive
+from scraper.progress import CancellationToken, ProgressReporter, ScrapeCancelled
+from scraper.events import bus
+from scraper import metrics
+from scraper.transport import CircuitBreaker, RETRYABLE_STATUSES, backoff_delay, make_session, retry_after_seconds
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import requests
-from bs4 import BeautifulSoup
 import time
 import logging
 from urllib.parse import urljoin, urlparse
-import re
 import os
-from pathlib import Path
-import hashlib
+import threading
+from collections import deque
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class BookScraper:
-    def __init__(self):
-        self.base_url = "https://books.toscrape.com/"
-        self.session = requests.Session()
+    BASE_URL = "https://books.toscrape.com/"
+    DEFAULT_CONCURRENCY = 4
+    DEFAULT_RATE = 4.0
+
+    def __init__(self, concurrency=None, rate=None, cache_dir=None, revalidate=True, parser=None, base_url=None,
+                 parse_workers=0):
+        self.base_url = base_url or self.BASE_URL
+        self.parser = get_parser(parser)
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.revalidate = revalidate
+        self.checkpoint = None
+        self.archive = None
+        self.cancel_token = CancellationToken()
+        self.progress = None
+        self.not_modified_count = 0
+        self.errors_count = 0
+        self.stats_lock = threading.Lock()
+        self.concurrency = concurrency or self.DEFAULT_CONCURRENCY
+        self.rate = self.DEFAULT_RATE if rate is None else rate
+        self.limiter = HostLimiter(self.concurrency, self.rate)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix='book-scraper'
+        )
+        # Parsing is CPU-bound: with parse workers it leaves the fetch threads and the GIL
+        self.parse_pool = process_pool(parse_workers) if parse_workers else None
+        self.session = make_session(self.concurrency)
+        self.breaker = CircuitBreaker(on_open=lambda host: metrics.CIRCUIT_OPENED.labels(host).inc())
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.parse_pool:
+            self.parse_pool.shutdown(wait=True, cancel_futures=True)
+        if self.archive:
+            self.archive.close()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def report(self, **counts):
+        if self.progress:
+            self.progress.add(**counts)
+    
+    def publish(self, event, **data):
+        if self.progress:
+            self.progress.publish(event, **data)
+    
+    def check_cancelled(self):
+        self.cancel_token.poll()
+        if self.progress:
+            self.progress.flush()
+        self.cancel_token.raise_if_cancelled()
+    
+    def timed_get(self, url, timeout, kind, headers=None):
+        started = time.perf_counter()
+        response = self.session.get(url, timeout=timeout, headers=headers)
+        size = len(response.content)
+        metrics.HTTP_REQUEST_SECONDS.labels(kind).observe(time.perf_counter() - started)
+        metrics.DOWNLOADED_BYTES.labels(kind).inc(size)
+        self.report(bytes_fetched=size)
+        return response
+    
+    def fetch(self, url, timeout, revalidate=True, kind='page', defer_store=False):
+        self.cancel_token.raise_if_cancelled()
+        headers = {}
+        if self.cache and self.revalidate and revalidate:
+            headers = self.cache.conditional_headers(url)
+        
+        with self.limiter.slot(url):
+            self.cancel_token.raise_if_cancelled()
+            response = self.timed_get(url, timeout, kind, headers=headers)
+        
+        if self.cache:
+            if response.status_code == 304:
+                cached_response = self.cache.replay(url, response)
+                if cached_response is not None:
+                    return cached_response
+                
+                with self.limiter.slot(url):
+                    response = self.timed_get(url, timeout, kind)
+            
+            if response.ok and not defer_store:
+                self.cache.store(url, response)
+        
+        response.not_modified = False
+        return response
+    
+    def store_validators(self, books):
+        # Detail pages are only marked as seen once their rows are committed, a 304
+        # for a book that never reached the database would skip it for good
+        if not self.cache:
+            return
+        for book_data in books:
+            response = book_data.pop('response', None)
+            if response is not None and not response.not_modified:
+                self.cache.store(book_data['url'], response)
         
-    def get_page(self, url, retries=3):
+    def wait_for_host(self, host):
+        while (delay := self.breaker.acquire(host)) > 0:
+            self.cancel_token.sleep(delay)
+    
+    def get_page(self, url, retries=3, revalidate=True, kind='detail', timeout=10, defer_store=False):
+        host = urlparse(url).netloc
         for attempt in range(retries):
+            self.wait_for_host(host)
             try:
-                response = self.session.get(url, timeout=10)
-                response.raise_for_status()
-                return response
+                response = self.fetch(url, timeout=timeout, revalidate=revalidate, kind=kind, defer_store=defer_store)
             except requests.RequestException as e:
-                logger.warning(f"Attempt {attempt + 1} wasn't successfull for {url}: {e}")
-                if attempt < retries - 1:
-                    time.sleep(2 ** attempt)  
-                else:
-                    logger.error(f"Couldn't get the page {url}")
+                self.breaker.record_failure(host)
+                error = e
+            else:
+                if response.ok:
+                    self.breaker.record_success(host)
+                    if self.archive and kind in self.archive.KINDS:
+                        self.archive.write(url, kind, response.content)
+                    return response
+                if response.status_code not in RETRYABLE_STATUSES:
+                    # The host answered, only a server error counts against it
+                    if response.status_code >= 500:
+                        self.breaker.record_failure(host)
+                    else:
+                        self.breaker.record_success(host)
+                    logger.error(f"Couldn't get the page {url}: HTTP {response.status_code}")
                     return None
+                # Retry-After pauses every worker talking to the host, not just this one
+                self.breaker.record_failure(host, retry_after_seconds(response))
+                error = f"HTTP {response.status_code}"
+            finally:
+                self.breaker.release(host)
+            
+            logger.warning(f"Attempt {attempt + 1} wasn't successfull for {url}: {error}")
+            if attempt < retries - 1:
+                metrics.HTTP_RETRIES.labels(kind).inc()
+                self.cancel_token.sleep(backoff_delay(attempt))
+        
+        logger.error(f"Couldn't get the page {url}")
+        return None
     
     def download_image(self, image_url, retries=3):
-        for attempt in range(retries):
-            try:
-                response = self.session.get(image_url, timeout=15)
-                response.raise_for_status()
-                parsed_url = urlparse(image_url)
-                original_filename = os.path.basename(parsed_url.path)
-                
-                if not os.path.splitext(original_filename)[1]:
-                    content_type = response.headers.get('content-type', '')
-                    if 'jpeg' in content_type or 'jpg' in content_type:
-                        original_filename += '.jpg'
-                    elif 'png' in content_type:
-                        original_filename += '.png'
-                    elif 'gif' in content_type:
-                        original_filename += '.gif'
-                    else:
-                        original_filename += '.jpg'  
-                
-                content_hash = hashlib.md5(response.content).hexdigest()[:8]
-                name, ext = os.path.splitext(original_filename)
-                filename = f"{name}_{content_hash}{ext}"
-                
-                return response.content, filename
-                
-            except requests.RequestException as e:
-                logger.warning(f"Image download attempt {attempt + 1} failed for {image_url}: {e}")
-                if attempt < retries - 1:
-                    time.sleep(2 ** attempt)
-                else:
-                    logger.error(f"Couldn't download image {image_url}")
-                    return None, None
-    
-    def parse_price(self, price_text):
-        if not price_text:
-            return 0.0
-
-        price_clean = re.sub(r'[£$€]', '', price_text.strip())
-        try:
-            return float(price_clean)
-        except ValueError:
-            return 0.0
+        response = self.get_page(image_url, retries=retries, kind='image', timeout=15)
+        if not response:
+            logger.error(f"Couldn't download image {image_url}")
+            return None, None
+        
+        original_filename = os.path.basename(urlparse(image_url).path)
+        if not os.path.splitext(original_filename)[1]:
+            content_type = response.headers.get('content-type', '')
+            if 'jpeg' in content_type or 'jpg' in content_type:
+                original_filename += '.jpg'
+            elif 'png' in content_type:
+                original_filename += '.png'
+            elif 'gif' in content_type:
+                original_filename += '.gif'
+            else:
+                original_filename += '.jpg'  
+        
+        return response.content, original_filename
     
-    def parse_rating(self, rating_class):
-        rating_map = {
-            'One': 1, 'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5
-        }
-        for word, rating in rating_map.items():
-            if word in rating_class:
-                return rating
-        return 0
+    def parse(self, method, content, url):
+        if self.parse_pool is None:
+            return getattr(self.parser, method)(content, url)
+        return self.parse_pool.submit(parse_in_process, self.parser.name, method, content, url).result()
     
-    def scrape_book_details(self, book_url):
-        response = self.get_page(book_url)
+    def count_error(self, url='', message=''):
+        with self.stats_lock:
+            self.errors_count += 1
+        self.report(errors_count=1)
+        self.publish('error', url=url, message=message)
+    
+    def scrape_book_details(self, book_url, revalidate=True):
+        response = self.get_page(book_url, revalidate=revalidate, defer_store=True)
         if not response:
+            self.count_error(book_url, "Couldn't get the page")
+            return None
+        
+        if response.not_modified:
+            with self.stats_lock:
+                self.not_modified_count += 1
+            if self.checkpoint:
+                self.checkpoint.details_done([book_url])
+            logger.info(f"Book page not modified, skipping: {book_url}")
+            return None
+        
+        try:
+            with metrics.PARSE_SECONDS.labels('detail').time():
+                book_data = self.parse('parse_book', response.content, book_url)
+        except Exception as e:
+            logger.error(f"Parsing book error {book_url}: {e}")
+            self.count_error(book_url, str(e))
+            return None
+        
+        image_content = None
+        image_filename = None
+        if book_data['image_url']:
+            logger.info(f"Downloading image: {book_data['image_url']}")
+            image_content, image_filename = self.download_image(book_data['image_url'])
+            if image_content:
+                logger.info(f"Image downloaded successfully: {image_filename}")
+            else:
+                logger.warning(f"Failed to download image for {book_data['title']}")
+        
+        book_data['image_content'] = image_content
+        book_data['image_filename'] = image_filename
+        book_data['response'] = response
+        return book_data
+    
+    def get_listing(self, page_url):
+        response = self.get_page(page_url, kind='listing')
+        if not response:
+            self.count_error(page_url, "Couldn't get the page")
             return None
-            
-        soup = BeautifulSoup(response.content, 'html.parser')
         
         try:
-            title = soup.find('h1').text.strip()
-            product_info = {}
-            table = soup.find('table', class_='table table-striped')
-            if table:
-                for row in table.find_all('tr'):
-                    cells = row.find_all('td')
-                    if len(cells) == 2:
-                        key = cells[0].text.strip()
-                        value = cells[1].text.strip()
-                        product_info[key] = value
+            with metrics.PARSE_SECONDS.labels('listing').time():
+                return self.parse('parse_listing', response.content, page_url)
+        except Exception as e:
+            logger.error(f"Listing parsing error {page_url}: {e}")
+            self.count_error(page_url, str(e))
+            return None
+    
+    def discover_listings(self, frontier):
+        # (page url, items) of every listing page, items is None where the page couldn't be read
+        listings = []
+        running = deque()
+        while True:
+            while len(running) < self.concurrency and (page_url := frontier.pop_page()) is not None:
+                running.append((page_url, self.executor.submit(self.get_listing, page_url)))
+            if not running:
+                break
             
-            price_elem = soup.find('p', class_='price_color')
-            price = self.parse_price(price_elem.text if price_elem else '0')
-            rating_elem = soup.find('p', class_='star-rating')
-            rating = 0
-
-            if rating_elem:
-                rating_class = ' '.join(rating_elem.get('class', []))
-                rating = self.parse_rating(rating_class)
+            page_url, listing_future = running.popleft()
+            listing = self.wait_result(listing_future)
+            if listing:
+                frontier.add_links(listing['next_url'], listing['category_urls'])
+            listings.append((page_url, listing['items'] if listing else None))
+        return listings
+    
+    def wait_result(self, future):
+        # Workers may be waiting out an open circuit, keep noticing stop requests meanwhile
+        while True:
+            try:
+                return future.result(timeout=self.cancel_token.poll_interval)
+            except FutureTimeoutError:
+                self.check_cancelled()
+    
+    def iter_books(self, frontier, max_pending=None, select_items=None, listings=()):
+        max_pending = max_pending or self.concurrency * 2
+        running = deque()
+        pending = deque()
+        
+        def schedule(book_url, listing_fingerprint='', revalidate=True):
+            pending.append(self.executor.submit(
+                self._scrape_book_safe, book_url, listing_fingerprint, revalidate
+            ))
+            while len(pending) >= max_pending:
+                self.check_cancelled()
+                book_data = self.wait_result(pending.popleft())
+                if book_data:
+                    yield book_data
+        
+        def listing_done(page_url, items):
+            frontier.page_done()
+            self.report(pages_done=1)
+            items = [item for item in items if frontier.claim(item['url'])]
+            if select_items:
+                items = select_items(items)
             
-            description_elem = soup.find('div', id='product_description')
-            description = ''
-            if description_elem:
-                desc_p = description_elem.find_next_sibling('p')
-                if desc_p:
-                    description = desc_p.text.strip()
+            if self.checkpoint:
+                self.checkpoint.listing_done(page_url, [item['url'] for item in items])
+            self.publish('page', url=page_url, books=len(items))
+            return items
+        
+        # Details left over from an interrupted run are refetched in full: their
+        # cached copy may be newer than what made it into the database.
+        while (book_url := frontier.pop_detail()) is not None:
+            yield from schedule(book_url, revalidate=False)
+        
+        # Listings already read elsewhere, e.g. by the task that split a sharded run
+        for page_url, items in listings:
+            self.check_cancelled()
+            for item in listing_done(page_url, items):
+                yield from schedule(item['url'], item['fingerprint'], item.get('revalidate', True))
+        
+        while True:
+            self.check_cancelled()
+            while len(running) < self.concurrency:
+                page_url = frontier.pop_page()
+                if page_url is None:
+                    break
+                running.append((page_url, self.executor.submit(self.get_listing, page_url)))
             
-            availability_elem = soup.find('p', class_='instock availability')
-            in_stock = availability_elem is not None
+            if not running:
+                break
             
-            breadcrumb = soup.find('ul', class_='breadcrumb')
-            genre = 'General'
-            if breadcrumb:
-                links = breadcrumb.find_all('a')
-                if len(links) >= 3: 
-                    genre = links[2].text.strip()
+            page_url, listing_future = running.popleft()
+            listing = self.wait_result(listing_future)
+            if not listing:
+                frontier.page_done()
+                self.report(pages_done=1)
+                continue
             
-            image_url = None
-            image_elem = soup.find('div', class_='item active')
-            if image_elem:
-                img_tag = image_elem.find('img')
-                if img_tag and img_tag.get('src'):
-                    image_url = urljoin(book_url, img_tag['src'])
+            new_pages = frontier.add_links(listing['next_url'], listing['category_urls'])
+            if self.checkpoint:
+                self.checkpoint.pages_found(new_pages)
+            for item in listing_done(page_url, listing['items']):
+                yield from schedule(item['url'], item['fingerprint'], item.get('revalidate', True))
+        
+        while pending:
+            self.check_cancelled()
+            book_data = self.wait_result(pending.popleft())
+            if book_data:
+                yield book_data
+    
+    def scrape_books_from_page(self, page_url):
+        return list(self.iter_books(CrawlFrontier([page_url], follow_links=False)))
+    
+    def _scrape_book_safe(self, book_url, listing_fingerprint='', revalidate=True):
+        logger.info(f"Book processing: {book_url}")
+        try:
+            book_data = self.scrape_book_details(book_url, revalidate=revalidate)
+            if book_data:
+                book_data['listing_fingerprint'] = listing_fingerprint
+                logger.info(f"Book's data gathered: {book_data['title']}")
+            return book_data
+        except ScrapeCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Book processing error {book_url}: {e}")
+            self.count_error(book_url, str(e))
+            return None
+        finally:
+            self.report(books_processed=1)
+
+
+class BookWriter:
+    UPDATE_FIELDS = [
+        'title', 'isbn', 'genre', 'price', 'rating', 'description',
+        'in_stock', 'availability', 'listing_fingerprint', 'last_scraped', 'updated_at'
+    ]
+    LISTING_FIELDS = ['price', 'rating', 'in_stock', 'last_scraped', 'updated_at']
+    # An archived page may be older than the row: reparsing only applies what the
+    # parser derives, not the values listing refreshes keep current
+    REPARSE_FIELDS = ['title', 'isbn', 'genre', 'description', 'updated_at']
+    STORED_FIELDS = ['image_hash', 'price', 'rating', 'in_stock']
+    
+    def __init__(self):
+        self.genre_ids = {}
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.images_stored = 0
+        self.images_unchanged = 0
+        self.listing_refreshed = 0
+        self.listing_unchanged = 0
+        self.cover_store = CoverStore()
+        self.derivatives = DerivativeBuilder(self.cover_store)
+        self.derivatives_built = 0
+        self.history_recorded = 0
+    
+    @property
+    def rows_per_second(self):
+        if not self.write_seconds:
+            return 0.0
+        return self.rows_written / self.write_seconds
+    
+    def resolve_genres(self, names):
+        missing = set(names) - self.genre_ids.keys()
+        if missing:
+            Genre.objects.bulk_create(
+                [Genre(name=name) for name in missing],
+                ignore_conflicts=True
+            )
+            self.genre_ids.update(
+                Genre.objects.filter(name__in=missing).values_list('name', 'id')
+            )
+        return self.genre_ids
+    
+    def follow_moved_books(self, books_by_url, stored, now):
+        # The UPC identifies a book even when the site serves it under a new URL:
+        # move the stored row to that URL so the upsert below updates it in place
+        urls_by_isbn = {
+            book_data['isbn']: url
+            for url, book_data in books_by_url.items()
+            if book_data['isbn']
+        }
+        if not urls_by_isbn:
+            return
+        
+        moved = []
+        stale = []
+        for book_id, isbn, source_url, *values in (
+            Book.objects.filter(isbn__in=urls_by_isbn.keys())
+            .exclude(source_url__in=books_by_url.keys())
+            .values_list('id', 'isbn', 'source_url', *self.STORED_FIELDS)
+        ):
+            url = urls_by_isbn[isbn]
+            if url in stored:
+                # The new URL already has its own row, which takes over the UPC
+                stale.append(Book(id=book_id, isbn=None, updated_at=now))
+                continue
+            logger.info(f"Book {isbn} moved from {source_url} to {url}")
+            moved.append(Book(id=book_id, source_url=url, updated_at=now))
+            stored[url] = dict(zip(self.STORED_FIELDS, values), id=book_id)
+        
+        if stale:
+            Book.objects.bulk_update(stale, ['isbn', 'updated_at'])
+        if moved:
+            Book.objects.bulk_update(moved, ['source_url', 'updated_at'])
+    
+    def save(self, books_data, skip_images=False, reparse=False):
+        books_by_url = {}
+        urls_by_isbn = {}
+        for book_data in books_data:
+            isbn = book_data['isbn'] or None
+            if isbn in urls_by_isbn:
+                # Same UPC listed twice in one batch: keep a single row
+                books_by_url.pop(urls_by_isbn[isbn])
+            if isbn:
+                urls_by_isbn[isbn] = book_data['url']
+            books_by_url[book_data['url']] = dict(book_data, isbn=isbn)
+        if not books_by_url:
+            return 0, 0
+        
+        started = time.perf_counter()
+        now = timezone.now()
+        
+        with transaction.atomic():
+            genre_ids = self.resolve_genres(book_data['genre'] for book_data in books_by_url.values())
+            stored = {
+                row['source_url']: row
+                for row in Book.objects.filter(source_url__in=books_by_url.keys()).values(
+                    'source_url', 'id', *self.STORED_FIELDS
+                )
+            }
+            self.follow_moved_books(books_by_url, stored, now)
             
-            image_content = None
-            image_filename = None
-            if image_url:
-                logger.info(f"Downloading image: {image_url}")
-                image_content, image_filename = self.download_image(image_url)
-                if image_content:
-                    logger.info(f"Image downloaded successfully: {image_filename}")
-                else:
-                    logger.warning(f"Failed to download image for {title}")
+            books = []
+            books_with_images = []
+            for url, book_data in books_by_url.items():
+                book = Book(
+                    title=book_data['title'],
+                    isbn=book_data['isbn'],
+                    genre_id=genre_ids[book_data['genre']],
+                    price=book_data['price'],
+                    rating=book_data['rating'],
+                    description=book_data['description'],
+                    in_stock=book_data['in_stock'],
+                    availability=book_data['availability'],
+                    source_url=url,
+                    listing_fingerprint=book_data.get('listing_fingerprint', ''),
+                    last_scraped=now
+                )
+                
+                image_content = book_data.get('image_content')
+                if skip_images or not image_content or not book_data.get('image_filename'):
+                    books.append(book)
+                    continue
+                
+                digest = content_hash(image_content)
+                if url in stored and stored[url]['image_hash'] == digest:
+                    self.images_unchanged += 1
+                    books.append(book)
+                    continue
+                
+                book.image, book.image_hash = self.cover_store.save(
+                    image_content, book_data['image_filename'], digest=digest
+                )
+                self.derivatives.submit(digest, image_content)
+                self.images_stored += 1
+                books_with_images.append(book)
             
-            return {
-                'title': title,
-                'isbn': product_info.get('ISBN', ''),
-                'genre': genre,
-                'price': price,
-                'rating': rating,
-                'description': description,
-                'in_stock': in_stock,
-                'availability': product_info.get('Availability', ''),
-                'url': book_url,
-                'image_url': image_url,
-                'image_content': image_content,
-                'image_filename': image_filename
-            }
+            for rows, update_fields in (
+                (books, self.REPARSE_FIELDS if reparse else self.UPDATE_FIELDS),
+                (books_with_images, self.UPDATE_FIELDS + ['image', 'image_hash']),
+            ):
+                if rows:
+                    Book.objects.bulk_create(
+                        rows,
+                        update_conflicts=True,
+                        unique_fields=['source_url'],
+                        update_fields=update_fields
+                    )
             
-        except Exception as e:
-            logger.error(f"Parsing book error {book_url}: {e}")
-            return None
+            self.record_history(books_by_url, stored, now, reparse=reparse)
+        
+        bump_catalogue_version()
+        elapsed = time.perf_counter() - started
+        self.rows_written += len(books_by_url)
+        self.write_seconds += elapsed
+        metrics.DB_WRITE_SECONDS.observe(elapsed)
+        metrics.DB_WRITE_ROWS.inc(len(books_by_url))
+        
+        created_count = len(books_by_url.keys() - stored.keys())
+        return created_count, len(books_by_url) - created_count
     
-    def scrape_books_from_page(self, page_url):
-        response = self.get_page(page_url)
-        if not response:
-            return []
+    def record_history(self, books_by_url, stored, now, reparse=False):
+        new_urls = books_by_url.keys() - stored.keys()
+        book_ids = {}
+        if new_urls:
+            book_ids = dict(Book.objects.filter(source_url__in=new_urls).values_list('source_url', 'id'))
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        entries = []
+        for url, book_data in books_by_url.items():
+            if url in stored:
+                if reparse:
+                    # Price, rating and stock were not written, so they have not changed
+                    book_data = dict(book_data, **{field: stored[url][field] for field in TRACKED_FIELDS})
+                entry = history_entry(stored[url]['id'], stored[url], book_data, now)
+            else:
+                entry = history_entry(book_ids[url], None, book_data, now)
+            if entry:
+                entries.append(entry)
+        
+        if entries:
+            BookHistory.objects.bulk_create(entries)
+            self.history_recorded += len(entries)
+    
+    def attach_covers(self, covers):
+        book_ids = dict(
+            Book.objects.filter(source_url__in=[book_url for book_url, _, _ in covers]).values_list('source_url', 'id')
+        )
+        
+        now = timezone.now()
         books = []
+        for book_url, content, filename in covers:
+            if book_url not in book_ids:
+                continue
+            image, image_hash = self.cover_store.save(content, filename)
+            self.derivatives.submit(image_hash, content)
+            books.append(Book(id=book_ids[book_url], image=image, image_hash=image_hash, updated_at=now))
+            self.images_stored += 1
+        
+        if books:
+            Book.objects.bulk_update(books, ['image', 'image_hash', 'updated_at'])
+            bump_catalogue_version()
+        self.store_derivatives(wait=True)
+    
+    def store_derivatives(self, wait=False):
+        finished = self.derivatives.collect(wait=wait)
+        if finished:
+            books = list(Book.objects.filter(image_hash__in=finished.keys()).only('id', 'image_hash'))
+            for book in books:
+                book.image_derivatives = finished[book.image_hash]
+            Book.objects.bulk_update(books, ['image_derivatives'])
+        self.derivatives_built += len(finished)
+        return len(finished)
+    
+    def mark_missing(self, items):
+        # Books without a row are fetched in full, a 304 would leave them unwritten
+        known = set(
+            Book.objects.filter(source_url__in=[item['url'] for item in items]).values_list('source_url', flat=True)
+        )
+        return [item if item['url'] in known else dict(item, revalidate=False) for item in items]
+    
+    def refresh_from_listing(self, items):
+        items_by_url = {item['url']: item for item in items}
+        stored = {
+            row[0]: row[1:]
+            for row in Book.objects.filter(source_url__in=items_by_url.keys()).values_list(
+                'source_url', 'id', 'listing_fingerprint', 'price', 'rating', 'in_stock'
+            )
+        }
+        
+        now = timezone.now()
+        needs_details = []
+        refreshed = []
+        entries = []
+        for url, item in items_by_url.items():
+            if url not in stored or stored[url][1] != item['fingerprint']:
+                # Fetched in full: a 304 would skip the write and the fingerprint would never be stored
+                needs_details.append(dict(item, revalidate=False))
+                continue
+            
+            book_id, _, price, rating, in_stock = stored[url]
+            if (float(price), rating, in_stock) == (item['price'], item['rating'], item['in_stock']):
+                self.listing_unchanged += 1
+                continue
+            
+            refreshed.append(Book(
+                id=book_id,
+                price=item['price'],
+                rating=item['rating'],
+                in_stock=item['in_stock'],
+                last_scraped=now,
+                updated_at=now
+            ))
+            entry = history_entry(book_id, dict(price=price, rating=rating, in_stock=in_stock), item, now)
+            if entry:
+                entries.append(entry)
         
-        book_elements = soup.find_all('article', class_='product_pod')
+        if refreshed:
+            with transaction.atomic():
+                Book.objects.bulk_update(refreshed, self.LISTING_FIELDS)
+                BookHistory.objects.bulk_create(entries)
+            self.listing_refreshed += len(refreshed)
+            self.history_recorded += len(entries)
         
-        for book_elem in book_elements:
+        return needs_details
+
+
+def iter_batches(iterable, size):
+    batch = []
+    try:
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    except ScrapeCancelled:
+        # Hand out what was already fetched so it gets saved before stopping
+        if batch:
+            yield batch
+        raise
+    
+    if batch:
+        yield batch
+
+
+def run_crawl(scraper, writer, frontier, checkpoint=None, batch_size=50,
+              skip_images=False, fast_refresh=False, stats=None, on_batch=None, listings=()):
+    stats = stats or {'total_books_found': 0, 'books_created': 0, 'books_updated': 0, 'errors_count': 0}
+    started = time.perf_counter()
+    
+    books = scraper.iter_books(
+        frontier,
+        select_items=writer.refresh_from_listing if fast_refresh else writer.mark_missing,
+        listings=listings
+    )
+    try:
+        for batch in iter_batches(books, batch_size):
             try:
-                link_elem = book_elem.find('h3').find('a')
-                if link_elem:
-                    href = link_elem['href']
-                    if not href.startswith('catalogue/'):
-                        href = 'catalogue/' + href
-                    book_url = urljoin(self.base_url, href)
-                    
-                    logger.info(f"Book processing: {book_url}")
-                    
-                    book_data = self.scrape_book_details(book_url)
-                    if book_data:
-                        books.append(book_data)
-                        logger.info(f"Book's data gathered: {book_data['title']}")
-                    
-                    time.sleep(1)
-                    
+                created_count, updated_count = writer.save(batch, skip_images=skip_images)
             except Exception as e:
-                logger.error(f"Book processing error: {e}")
+                logger.error(f"Saving error for batch of {len(batch)} books: {e}")
+                stats['errors_count'] += len(batch)
+                scraper.report(errors_count=len(batch))
+                scraper.publish('error', message=f'Saving error for batch of {len(batch)} books: {e}')
                 continue
-        
-        return books
+            
+            scraper.store_validators(batch)
+            for book_data in batch:
+                scraper.publish('book', url=book_data['url'], title=book_data['title'])
+            
+            stats['total_books_found'] += len(batch)
+            stats['books_created'] += created_count
+            stats['books_updated'] += updated_count
+            
+            if checkpoint:
+                checkpoint.details_done([book_data['url'] for book_data in batch])
+                if not skip_images:
+                    for book_data in batch:
+                        if book_data['image_url'] and not book_data['image_content']:
+                            checkpoint.image_pending(book_data['url'], book_data['image_url'])
+                checkpoint.flush()
+            
+            writer.store_derivatives()
+            if on_batch:
+                on_batch(batch, stats)
+            
+            # Whatever was already fetched is saved before stopping
+            scraper.check_cancelled()
+    finally:
+        writer.store_derivatives(wait=True)
+        if checkpoint:
+            checkpoint.flush()
+        if scraper.progress:
+            scraper.progress.flush(force=True)
+    
+    stats['books_updated'] += writer.listing_refreshed
+    stats['errors_count'] += scraper.errors_count
+    stats['not_modified'] = scraper.not_modified_count
+    stats['pages_done'] = frontier.state['pages_done']
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
 
 
 class Command(BaseCommand):
@@ -214,7 +721,12 @@ class Command(BaseCommand):
             '--pages',
             type=int,
             default=None,
-            help='Number of pages to scrape (by default - all)'
+            help='Maximum number of listing pages to scrape (by default - all discovered pages)'
+        )
+        parser.add_argument(
+            '--categories',
+            action='store_true',
+            help='Also discover listing pages through category links'
         )
         parser.add_argument(
             '--verbose',
@@ -226,127 +738,288 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip downloading images'
         )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=BookScraper.DEFAULT_CONCURRENCY,
+            help='Maximum number of parallel requests per host'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=BookScraper.DEFAULT_RATE,
+            help='Maximum requests per second per host (0 - unlimited)'
+        )
+        parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            help='Ignore stored ETag/Last-Modified validators and download every page in full'
+        )
+        parser.add_argument(
+            '--parser',
+            choices=sorted(PARSERS),
+            default=DEFAULT_PARSER,
+            help='HTML parser used for listing and detail pages'
+        )
+        parser.add_argument(
+            '--fast-refresh',
+            action='store_true',
+            help='Update price, rating and stock from listing pages; fetch detail pages only for new or changed books'
+        )
+        parser.add_argument(
+            '--resume',
+            type=int,
+            default=None,
+            metavar='LOG_ID',
+            help='Continue an interrupted or failed run, skipping URLs it already completed'
+        )
+        parser.add_argument(
+            '--log-id',
+            type=int,
+            default=None,
+            help='Record progress in an existing ScrapingLog instead of creating a new one'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of books committed to the database per transaction'
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=1,
+            help='Split listing pages into N shards and scrape them as Celery tasks'
+        )
+        parser.add_argument(
+            '--parse-workers',
+            type=int,
+            default=0,
+            help='Parse pages in N worker processes instead of the fetch threads (default: 0, parse in threads)'
+        )
+        parser.add_argument(
+            '--base-url',
+            default=None,
+            help=f'Site to scrape (default: {BookScraper.BASE_URL}), e.g. a local replay server'
+        )
+        parser.add_argument(
+            '--archive',
+            action='store_true',
+            help='Keep the fetched HTML pages in a compressed archive of this run for reparse_books'
+        )
     
     def handle(self, *args, **options):
-        scraping_log = ScrapingLog.objects.create(status='running')
+        if options['shards'] > 1:
+            if options['resume']:
+                raise CommandError('--resume is not supported for sharded scraping')
+            from scraper.tasks import check_shard_backend
+            
+            try:
+                check_shard_backend(allow_eager=True)
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+        
+        scraping_log = self.get_scraping_log(options)
+        if options['shards'] > 1:
+            return self.handle_sharded(scraping_log, options)
+        
+        self.writer = BookWriter()
+        checkpoint = CrawlCheckpoint(scraping_log)
         
         try:
-            scraper = BookScraper()
+            scraper = BookScraper(
+                concurrency=options['concurrency'],
+                rate=options['rate'],
+                cache_dir=settings.SCRAPER_CACHE_DIR,
+                revalidate=not options['no_cache'],
+                parser=options['parser'],
+                base_url=options['base_url'],
+                parse_workers=options['parse_workers']
+            )
+            scraper.checkpoint = checkpoint
+            scraper.cancel_token = CancellationToken(scraping_log.id)
+            scraper.progress = ProgressReporter(scraping_log.id)
+            if options['archive']:
+                scraper.archive = PageArchive(scraping_log.id)
             
             if options['verbose']:
                 self.stdout.write('Starting scraping...')
                 if options['skip_images']:
                     self.stdout.write('Image downloading is disabled')
             
-            if options['pages']:
-                books = []
-                for page_num in range(1, options['pages'] + 1):
-                    if options['verbose']:
-                        self.stdout.write(f'Page processing {page_num}...')
-                    
-                    page_url = f"{scraper.base_url}catalogue/page-{page_num}.html"
-                    books_on_page = scraper.scrape_books_from_page(page_url)
-                    books.extend(books_on_page)
-                    time.sleep(2)  
+            frontier = CrawlFrontier(
+                max_pages=options['pages'],
+                follow_categories=options['categories']
+            )
+            if options['resume']:
+                pending_images = checkpoint.restore(frontier)
+                self.stdout.write(f'Resuming scraping #{scraping_log.id}: {frontier.state}')
             else:
-                books = []
-                for page_num in range(1, 6):
-                    if options['verbose']:
-                        self.stdout.write(f'Page processing {page_num}...')
-                    
-                    page_url = f"{scraper.base_url}catalogue/page-{page_num}.html"
-                    books_on_page = scraper.scrape_books_from_page(page_url)
-                    books.extend(books_on_page)
-                    time.sleep(2)
+                pending_images = []
+                seed = f"{scraper.base_url}catalogue/page-1.html"
+                frontier.add_page(seed)
+                checkpoint.pages_found([seed])
+                checkpoint.flush()
             
-            created_count, updated_count = self.save_books_to_db(
-                books, 
-                options['verbose'], 
-                skip_images=options['skip_images']
-            )
+            def on_batch(batch, stats):
+                scraping_log.total_books_found = stats['total_books_found']
+                scraping_log.books_created = stats['books_created']
+                scraping_log.books_updated = stats['books_updated']
+                scraping_log.save(update_fields=['total_books_found', 'books_created', 'books_updated'])
+                
+                if options['verbose']:
+                    self.stdout.write(
+                        f"Committed {stats['total_books_found']} books "
+                        f"({self.writer.rows_per_second:.1f} rows/sec)... frontier: {frontier.state}"
+                    )
             
-            scraping_log.status = 'completed'
-            scraping_log.finished_at = timezone.now()
-            scraping_log.total_books_found = len(books)
-            scraping_log.books_created = created_count
-            scraping_log.books_updated = updated_count
-            scraping_log.save()
+            with scraper:
+                if pending_images and not options['skip_images']:
+                    self.retry_images(scraper, checkpoint, pending_images)
+                
+                stats = run_crawl(
+                    scraper,
+                    self.writer,
+                    frontier,
+                    checkpoint=checkpoint,
+                    batch_size=options['batch_size'],
+                    skip_images=options['skip_images'],
+                    fast_refresh=options['fast_refresh'],
+                    stats={
+                        'total_books_found': scraping_log.total_books_found,
+                        'books_created': scraping_log.books_created,
+                        'books_updated': scraping_log.books_updated,
+                        'errors_count': scraping_log.errors_count,
+                    },
+                    on_batch=on_batch
+                )
+            
+            # A stop request that raced the last batch still wins
+            ScrapingLog.objects.filter(id=scraping_log.id, status='running').update(
+                total_books_found=stats['total_books_found'],
+                books_created=stats['books_created'],
+                books_updated=stats['books_updated'],
+                errors_count=stats['errors_count'],
+                status='completed',
+                finished_at=timezone.now()
+            )
+            bus.publish(
+                scraping_log.id,
+                'finished',
+                status='completed',
+                **{key: stats[key] for key in ('total_books_found', 'books_created', 'books_updated', 'errors_count')}
+            )
             
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Scraping is finished Created: {created_count}, updated: {updated_count}'
+                    f"Scraping is finished Created: {stats['books_created']}, updated: {stats['books_updated']}, "
+                    f"not modified: {stats['not_modified']}, errors: {stats['errors_count']}"
                 )
             )
+            if self.writer.rows_written:
+                self.stdout.write(
+                    f'Database writes: {self.writer.rows_written} rows in {self.writer.write_seconds:.2f}s '
+                    f'({self.writer.rows_per_second:.1f} rows/sec), covers stored: {self.writer.images_stored}, '
+                    f'unchanged: {self.writer.images_unchanged}, resized: {self.writer.derivatives_built}, '
+                    f'history entries: {self.writer.history_recorded}'
+                )
+            if options['fast_refresh']:
+                self.stdout.write(
+                    f'Refreshed from listings: {self.writer.listing_refreshed}, '
+                    f'unchanged: {self.writer.listing_unchanged}'
+                )
+            if scraper.archive:
+                self.stdout.write(f'Archived {scraper.archive.pages} pages to {scraper.archive.directory}')
             
+        except ScrapeCancelled:
+            ScrapingLog.objects.filter(id=scraping_log.id, finished_at__isnull=True).update(
+                finished_at=timezone.now()
+            )
+            bus.publish(scraping_log.id, 'finished', status='interrupted')
+            self.stdout.write(self.style.WARNING(f'Scraping #{scraping_log.id} was stopped'))
         except KeyboardInterrupt:
+            checkpoint.flush()
             scraping_log.status = 'interrupted'
             scraping_log.finished_at = timezone.now()
-            scraping_log.save()
+            scraping_log.save(update_fields=['status', 'finished_at'])
+            bus.publish(scraping_log.id, 'finished', status='interrupted')
             self.stdout.write(self.style.WARNING('Scraping was interupted by user'))
         except Exception as e:
             scraping_log.status = 'failed'
             scraping_log.error_message = str(e)
             scraping_log.finished_at = timezone.now()
-            scraping_log.save()
+            scraping_log.save(update_fields=['status', 'error_message', 'finished_at'])
+            bus.publish(scraping_log.id, 'finished', status='failed', error=str(e))
             self.stdout.write(self.style.ERROR(f'Error: {e}'))
     
-    def save_books_to_db(self, books_data, verbose=False, skip_images=False):
-        created_count = 0
-        updated_count = 0
+    def handle_sharded(self, scraping_log, options):
+        from scraper.tasks import start_sharded_scrape
         
-        with transaction.atomic():
-            for book_data in books_data:
-                try:
-                    genre, _ = Genre.objects.get_or_create(
-                        name=book_data['genre']
-                    )
-                    
-                    defaults = {
-                        'isbn': book_data['isbn'],
-                        'genre': genre,
-                        'price': book_data['price'],
-                        'rating': book_data['rating'],
-                        'description': book_data['description'],
-                        'in_stock': book_data['in_stock'],
-                        'source_url': book_data['url']
-                    }
-                    
-                    book, created = Book.objects.update_or_create(
-                        title=book_data['title'],
-                        defaults=defaults
-                    )
-                    
-                    if not skip_images and book_data['image_content'] and book_data['image_filename']:
-                        try:
-                            image_file = ContentFile(
-                                book_data['image_content'], 
-                                name=book_data['image_filename']
-                            )
-                            
-                            book.image.save(book_data['image_filename'], image_file, save=True)
-                            
-                            if verbose:
-                                self.stdout.write(f"Image saved for: {book.title}")
-                                
-                        except Exception as img_error:
-                            logger.error(f"Image saving error for {book.title}: {img_error}")
-                            if verbose:
-                                self.stdout.write(
-                                    self.style.WARNING(f"Image save failed for {book.title}: {img_error}")
-                                )
-                    
-                    if created:
-                        created_count += 1
-                        if verbose:
-                            self.stdout.write(f"Created: {book.title}")
-                    else:
-                        updated_count += 1
-                        if verbose:
-                            self.stdout.write(f"Updated: {book.title}")
-                            
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(f"Saving error {book_data['title']}: {e}")
-                    )
+        shard_options = {
+            key: options[key]
+            for key in (
+                'pages', 'categories', 'skip_images', 'concurrency', 'rate', 'no_cache', 'parser', 'batch_size', 'base_url',
+                'parse_workers', 'archive'
+            )
+        }
+        try:
+            result = start_sharded_scrape(scraping_log, options['shards'], shard_options)
+        except Exception as e:
+            scraping_log.status = 'failed'
+            scraping_log.error_message = str(e)
+            scraping_log.finished_at = timezone.now()
+            scraping_log.save(update_fields=['status', 'error_message', 'finished_at'])
+            self.stdout.write(self.style.ERROR(f'Error: {e}'))
+            return
+        
+        scraping_log.refresh_from_db()
+        if scraping_log.status == 'running':
+            self.stdout.write(f'Scraping #{scraping_log.id} dispatched to workers as {result.id}')
+            return
+        
+        for shard in scraping_log.shard_stats:
+            self.stdout.write(
+                f"Shard {shard['shard']}: {shard['pages']} pages, {shard.get('total_books_found', 0)} books, "
+                f"{shard.get('errors_count', 0)} errors in {shard.get('seconds', 0)}s ({shard['status']})"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Scraping is finished Created: {scraping_log.books_created}, updated: {scraping_log.books_updated}, '
+                f'errors: {scraping_log.errors_count}'
+            )
+        )
+    
+    def get_scraping_log(self, options):
+        log_id = options['resume'] or options['log_id']
+        if not log_id:
+            return ScrapingLog.objects.create(status='running')
+        
+        try:
+            scraping_log = ScrapingLog.objects.get(id=log_id)
+        except ScrapingLog.DoesNotExist:
+            raise CommandError(f'Scraping log {log_id} does not exist')
+        
+        if options['resume'] and scraping_log.status == 'completed':
+            raise CommandError(f'Scraping #{log_id} has already completed')
+        
+        scraping_log.status = 'running'
+        scraping_log.finished_at = None
+        scraping_log.error_message = None
+        scraping_log.save(update_fields=['status', 'finished_at', 'error_message'])
+        return scraping_log
+    
+    def retry_images(self, scraper, checkpoint, pending_images):
+        image_urls = [image_url for _, image_url in pending_images]
+        covers = []
+        done = []
+        for (book_url, image_url), (content, filename) in zip(
+            pending_images, scraper.executor.map(scraper.download_image, image_urls)
+        ):
+            if content:
+                covers.append((book_url, content, filename))
+                done.append(image_url)
         
-        return created_count, updated_count
\ No newline at end of file
+        self.writer.attach_covers(covers)
+        checkpoint.images_done(done)
+        checkpoint.flush()
+        self.stdout.write(f'Recovered {len(done)} of {len(pending_images)} pending covers')
@@ -0,0 +1,111 @@
+import ipaddress
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'scraper_http_request_seconds',
+    'Latency of scraper HTTP requests',
+    ['kind'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+HTTP_RETRIES = Counter(
+    'scraper_http_retries_total',
+    'Scraper HTTP requests retried after a failure',
+    ['kind']
+)
+DOWNLOADED_BYTES = Counter(
+    'scraper_downloaded_bytes_total',
+    'Response bytes downloaded by the scraper',
+    ['kind']
+)
+CIRCUIT_OPENED = Counter(
+    'scraper_circuit_opened_total',
+    'Times the scraper paused requests to an overloaded host',
+    ['host']
+)
+PARSE_SECONDS = Histogram(
+    'scraper_parse_seconds',
+    'Time spent parsing scraped pages',
+    ['kind'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+DB_WRITE_SECONDS = Histogram(
+    'scraper_db_batch_write_seconds',
+    'Time spent writing one batch of scraped books',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_WRITE_ROWS = Counter(
+    'scraper_db_rows_written_total',
+    'Book rows upserted by the scraper'
+)
+API_REQUEST_SECONDS = Histogram(
+    'api_request_seconds',
+    'API view latency',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+API_SQL_QUERIES = Histogram(
+    'api_sql_queries',
+    'SQL queries executed per API request',
+    ['view', 'method'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+
+
+class MetricsMixin:
+    def dispatch(self, request, *args, **kwargs):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        view = self.__class__.__name__
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = super().dispatch(request, *args, **kwargs)
+
+        API_REQUEST_SECONDS.labels(view, request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        API_SQL_QUERIES.labels(view, request.method).observe(queries[0])
+        return response
+
+
+def metrics_allowed(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    # REMOTE_ADDR only: a forwarded-for header is set by the client
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+def metrics_view(request):
+    if not metrics_allowed(request.META.get('REMOTE_ADDR', '')):
+        return HttpResponseForbidden()
+
+    # Gunicorn or Celery workers each keep their own counters; with
+    # PROMETHEUS_MULTIPROC_DIR set they are merged from the shared directory
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
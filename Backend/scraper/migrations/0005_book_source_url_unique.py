@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-18 06:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_source_urls(apps, schema_editor):
+    Book = apps.get_model('scraper', 'Book')
+    Favorite = apps.get_model('scraper', 'Favorite')
+
+    Book.objects.filter(source_url='').update(source_url=None)
+
+    duplicated_urls = (
+        Book.objects.exclude(source_url__isnull=True)
+        .values('source_url')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .values_list('source_url', flat=True)
+    )
+
+    for source_url in duplicated_urls:
+        book_ids = list(
+            Book.objects.filter(source_url=source_url)
+            .order_by('-updated_at', '-id')
+            .values_list('id', flat=True)
+        )
+        keeper_id, duplicate_ids = book_ids[0], book_ids[1:]
+
+        for duplicate_id in duplicate_ids:
+            users_with_keeper = list(
+                Favorite.objects.filter(book_id=keeper_id).values_list('user_id', flat=True)
+            )
+            Favorite.objects.filter(book_id=duplicate_id).exclude(
+                user_id__in=users_with_keeper
+            ).update(book_id=keeper_id)
+        Book.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0004_favorite'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_source_urls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='book',
+            name='source_url',
+            field=models.URLField(blank=True, null=True, unique=True, verbose_name='URL sources'),
+        ),
+    ]
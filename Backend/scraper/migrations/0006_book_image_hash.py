@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0005_book_source_url_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Image SHA-256'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0006_book_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='listing_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='Listing fingerprint'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 06:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0007_book_listing_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlUrl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500)),
+                ('url_hash', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('listing', 'Listing page'), ('detail', 'Book page'), ('image', 'Cover image')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done')], default='pending', max_length=10)),
+                ('parent_url', models.URLField(blank=True, default='', max_length=500)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('scraping_log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crawl_urls', to='scraper.scrapinglog')),
+            ],
+            options={
+                'verbose_name': 'Crawl URL',
+                'verbose_name_plural': 'Crawl URLs',
+                'indexes': [models.Index(fields=['scraping_log', 'status'], name='scraper_cra_scrapin_34927c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scraping_log', 'url_hash'), name='unique_crawl_url_per_log')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0008_crawlurl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapinglog',
+            name='shard_stats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
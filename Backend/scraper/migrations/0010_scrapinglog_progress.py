@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0009_scrapinglog_shard_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapinglog',
+            name='books_processed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapinglog',
+            name='bytes_fetched',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapinglog',
+            name='pages_done',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0010_scrapinglog_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Resized covers'),
+        ),
+    ]
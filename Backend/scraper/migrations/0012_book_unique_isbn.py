@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 06:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_isbns(apps, schema_editor):
+    Book = apps.get_model('scraper', 'Book')
+    Favorite = apps.get_model('scraper', 'Favorite')
+
+    Book.objects.filter(isbn='').update(isbn=None)
+
+    duplicated_isbns = (
+        Book.objects.exclude(isbn__isnull=True)
+        .values('isbn')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .values_list('isbn', flat=True)
+    )
+
+    for isbn in duplicated_isbns:
+        book_ids = list(
+            Book.objects.filter(isbn=isbn)
+            .order_by('-updated_at', '-id')
+            .values_list('id', flat=True)
+        )
+        keeper_id, duplicate_ids = book_ids[0], book_ids[1:]
+
+        for duplicate_id in duplicate_ids:
+            users_with_keeper = list(
+                Favorite.objects.filter(book_id=keeper_id).values_list('user_id', flat=True)
+            )
+            Favorite.objects.filter(book_id=duplicate_id).exclude(
+                user_id__in=users_with_keeper
+            ).update(book_id=keeper_id)
+        Book.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0011_book_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_isbns, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(condition=models.Q(('isbn__isnull', False), models.Q(('isbn', ''), _negated=True)), fields=('isbn',), name='unique_book_isbn'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 06:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_current_values(apps, schema_editor):
+    Book = apps.get_model('scraper', 'Book')
+    BookHistory = apps.get_model('scraper', 'BookHistory')
+
+    entries = []
+    for book in Book.objects.only('id', 'price', 'rating', 'in_stock', 'last_scraped', 'updated_at').iterator(chunk_size=2000):
+        entries.append(BookHistory(
+            book_id=book.id,
+            recorded_at=book.last_scraped or book.updated_at,
+            price=book.price,
+            rating=book.rating,
+            in_stock=book.in_stock
+        ))
+        if len(entries) >= 2000:
+            BookHistory.objects.bulk_create(entries)
+            entries = []
+    BookHistory.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0012_book_unique_isbn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField(verbose_name='Recorded')),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Price')),
+                ('rating', models.IntegerField(blank=True, null=True, verbose_name='Rating')),
+                ('in_stock', models.BooleanField(blank=True, null=True, verbose_name='In stock')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='scraper.book', verbose_name='Book')),
+            ],
+            options={
+                'verbose_name': 'Book history entry',
+                'verbose_name_plural': 'Book history',
+                'ordering': ['book', 'recorded_at'],
+                'indexes': [models.Index(fields=['book', 'recorded_at'], name='scraper_boo_book_id_f94b50_idx'), models.Index(fields=['recorded_at'], name='scraper_boo_recorde_2fb0c5_idx'), models.Index(condition=models.Q(('in_stock', False)), fields=['recorded_at'], name='bookhistory_stock_out_idx')],
+            },
+        ),
+        migrations.RunPython(record_current_values, migrations.RunPython.noop),
+    ]
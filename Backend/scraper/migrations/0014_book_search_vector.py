@@ -0,0 +1,70 @@
+# Generated by Django 5.2 on 2026-10-18 06:38
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Title outranks description, which outranks the genre name. The config has to
+# match SEARCH_CONFIG in scraper/search.py.
+CREATE_SEARCH_VECTOR_SQL = """
+CREATE FUNCTION scraper_book_search_vector(title text, description text, genre_id bigint)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('english', coalesce($1, '')), 'A')
+        || setweight(to_tsvector('english', coalesce($2, '')), 'B')
+        || setweight(to_tsvector('english', coalesce((SELECT name FROM scraper_genre WHERE id = $3), '')), 'C')
+$$ LANGUAGE sql STABLE;
+
+CREATE FUNCTION scraper_book_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := scraper_book_search_vector(NEW.title, NEW.description, NEW.genre_id);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER scraper_book_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, description, genre_id, search_vector ON scraper_book
+    FOR EACH ROW EXECUTE FUNCTION scraper_book_search_vector_trigger();
+
+CREATE FUNCTION scraper_genre_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    -- The book trigger recomputes the vector with the new name
+    UPDATE scraper_book SET search_vector = NULL WHERE genre_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER scraper_genre_search_vector_update
+    AFTER UPDATE OF name ON scraper_genre
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION scraper_genre_search_vector_trigger();
+
+UPDATE scraper_book SET search_vector = scraper_book_search_vector(title, description, genre_id);
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP TRIGGER IF EXISTS scraper_genre_search_vector_update ON scraper_genre;
+DROP FUNCTION IF EXISTS scraper_genre_search_vector_trigger();
+DROP TRIGGER IF EXISTS scraper_book_search_vector_update ON scraper_book;
+DROP FUNCTION IF EXISTS scraper_book_search_vector_trigger();
+DROP FUNCTION IF EXISTS scraper_book_search_vector(text, text, bigint);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0013_bookhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_SEARCH_VECTOR_SQL, DROP_SEARCH_VECTOR_SQL),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_gin'),
+        ),
+    ]
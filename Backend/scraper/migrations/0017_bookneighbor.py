@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 06:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_favorited_books_stale(apps, schema_editor):
+    Book = apps.get_model('scraper', 'Book')
+    Favorite = apps.get_model('scraper', 'Favorite')
+    Book.objects.filter(id__in=Favorite.objects.values('book_id')).update(neighbors_stale_since=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0016_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Cosine similarity')),
+            ],
+            options={
+                'verbose_name': 'Similar book',
+                'verbose_name_plural': 'Similar books',
+                'ordering': ['book', '-score'],
+            },
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='neighbors_stale_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('neighbors_stale_since__isnull', False)), fields=['neighbors_stale_since'], name='book_neighbors_stale_idx'),
+        ),
+        migrations.AddField(
+            model_name='bookneighbor',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='scraper.book', verbose_name='Book'),
+        ),
+        migrations.AddField(
+            model_name='bookneighbor',
+            name='neighbor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='scraper.book', verbose_name='Similar book'),
+        ),
+        migrations.AddIndex(
+            model_name='bookneighbor',
+            index=models.Index(fields=['book', '-score'], name='scraper_boo_book_id_ab2856_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookneighbor',
+            unique_together={('book', 'neighbor')},
+        ),
+        migrations.RunPython(mark_favorited_books_stale, migrations.RunPython.noop),
+    ]
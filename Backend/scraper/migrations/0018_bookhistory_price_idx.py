@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0017_bookneighbor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookhistory',
+            index=models.Index(condition=models.Q(('price__isnull', False)), fields=['book', 'recorded_at'], name='bookhistory_price_idx'),
+        ),
+    ]
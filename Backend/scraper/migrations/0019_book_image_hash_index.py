@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0018_bookhistory_price_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['image_hash'], name='scraper_boo_image_h_285ba7_idx'),
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 class Favorite(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='User')
@@ -18,6 +20,7 @@ class Favorite(models.Model):
         indexes = [
             models.Index(fields=['user']),
             models.Index(fields=['book']),
+            models.Index(fields=['user', 'created_at', 'id']),
         ]
     
     def __str__(self):
@@ -33,6 +36,9 @@ class Genre(models.Model):
         ordering = ['name']
         verbose_name = 'Genre'
         verbose_name_plural = 'Genres'
+        indexes = [
+            GinIndex(fields=['name'], name='genre_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
     
     def __str__(self):
         return self.name
@@ -49,6 +55,8 @@ class Book(models.Model):
     title = models.CharField(max_length=255, verbose_name='title')
     isbn = models.CharField(max_length=20, blank=True, null=True, verbose_name='ISBN')
     image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
+    image_hash = models.CharField(max_length=64, blank=True, default='', verbose_name='Image SHA-256')
+    image_derivatives = models.JSONField(default=dict, blank=True, verbose_name='Resized covers')
     genre = models.ForeignKey(
         Genre, 
         on_delete=models.SET_NULL, 
@@ -72,8 +80,13 @@ class Book(models.Model):
     in_stock = models.BooleanField(default=True, verbose_name='In stock')
     availability = models.CharField(max_length=100, blank=True, verbose_name='Available')
     
-    source_url = models.URLField(blank=True, null=True, verbose_name='URL sources')
+    source_url = models.URLField(blank=True, null=True, unique=True, verbose_name='URL sources')
     last_scraped = models.DateTimeField(blank=True, null=True, verbose_name='Last update')
+    listing_fingerprint = models.CharField(max_length=40, blank=True, default='', verbose_name='Listing fingerprint')
+    # Set whenever the book's favorites change, cleared by refresh_book_neighbors
+    neighbors_stale_since = models.DateTimeField(blank=True, null=True, editable=False)
+    # Filled in by a database trigger from title, description and genre name
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -87,6 +100,24 @@ class Book(models.Model):
             models.Index(fields=['title']),
             models.Index(fields=['genre']),
             models.Index(fields=['rating']),
+            models.Index(fields=['created_at', 'id']),
+            # Finished cover derivatives are matched back to books by hash
+            models.Index(fields=['image_hash']),
+            GinIndex(fields=['search_vector'], name='book_search_vector_gin'),
+            GinIndex(fields=['title'], name='book_title_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(
+                fields=['neighbors_stale_since'],
+                condition=models.Q(neighbors_stale_since__isnull=False),
+                name='book_neighbors_stale_idx'
+            ),
+        ]
+        constraints = [
+            # UPC from the product page; books added by hand may have none
+            models.UniqueConstraint(
+                fields=['isbn'],
+                condition=models.Q(isbn__isnull=False) & ~models.Q(isbn=''),
+                name='unique_book_isbn'
+            ),
         ]
     
     def __str__(self):
@@ -99,6 +130,52 @@ class Book(models.Model):
     def rating_display(self):
         return '★' * self.rating + '☆' * (5 - self.rating)
 
+class BookHistory(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='history', verbose_name='Book')
+    recorded_at = models.DateTimeField(verbose_name='Recorded')
+    # Only the values that changed are stored, unchanged ones stay null
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Price')
+    rating = models.IntegerField(blank=True, null=True, verbose_name='Rating')
+    in_stock = models.BooleanField(blank=True, null=True, verbose_name='In stock')
+    
+    class Meta:
+        ordering = ['book', 'recorded_at']
+        verbose_name = 'Book history entry'
+        verbose_name_plural = 'Book history'
+        
+        indexes = [
+            models.Index(fields=['book', 'recorded_at']),
+            models.Index(fields=['recorded_at']),
+            models.Index(fields=['recorded_at'], condition=models.Q(in_stock=False), name='bookhistory_stock_out_idx'),
+            # Last price of a book up to a point in time, for the per-period averages
+            models.Index(
+                fields=['book', 'recorded_at'],
+                condition=models.Q(price__isnull=False),
+                name='bookhistory_price_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.book_id} at {self.recorded_at}"
+
+class BookNeighbor(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbors', verbose_name='Book')
+    neighbor = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbor_of', verbose_name='Similar book')
+    score = models.FloatField(verbose_name='Cosine similarity')
+    
+    class Meta:
+        ordering = ['book', '-score']
+        verbose_name = 'Similar book'
+        verbose_name_plural = 'Similar books'
+        unique_together = ('book', 'neighbor')
+        
+        indexes = [
+            models.Index(fields=['book', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbor_id} ({self.score:.3f})"
+
 class ScrapingLog(models.Model):
     started_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(blank=True, null=True)
@@ -106,6 +183,9 @@ class ScrapingLog(models.Model):
     books_created = models.IntegerField(default=0)
     books_updated = models.IntegerField(default=0)
     errors_count = models.IntegerField(default=0)
+    pages_done = models.IntegerField(default=0)
+    books_processed = models.IntegerField(default=0)
+    bytes_fetched = models.BigIntegerField(default=0)
     status = models.CharField(
         max_length=20,
         choices=[
@@ -117,6 +197,7 @@ class ScrapingLog(models.Model):
         default='running'
     )
     error_message = models.TextField(blank=True, null=True)
+    shard_stats = models.JSONField(default=list, blank=True)
     
     class Meta:
         ordering = ['-started_at']
@@ -124,4 +205,37 @@ class ScrapingLog(models.Model):
         verbose_name_plural = 'Scraping logs'
     
     def __str__(self):
-        return f"Scraping {self.started_at.strftime('%Y-%m-%d %H:%M')} - {self.status}"
\ No newline at end of file
+        return f"Scraping {self.started_at.strftime('%Y-%m-%d %H:%M')} - {self.status}"
+
+
+class CrawlUrl(models.Model):
+    KIND_CHOICES = [
+        ('listing', 'Listing page'),
+        ('detail', 'Book page'),
+        ('image', 'Cover image'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+    ]
+    
+    scraping_log = models.ForeignKey(ScrapingLog, on_delete=models.CASCADE, related_name='crawl_urls')
+    url = models.URLField(max_length=500)
+    url_hash = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    parent_url = models.URLField(max_length=500, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Crawl URL'
+        verbose_name_plural = 'Crawl URLs'
+        constraints = [
+            models.UniqueConstraint(fields=['scraping_log', 'url_hash'], name='unique_crawl_url_per_log'),
+        ]
+        indexes = [
+            models.Index(fields=['scraping_log', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.url} - {self.status}"
\ No newline at end of file
@@ -0,0 +1,268 @@
+import hashlib
+import re
+import threading
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from lxml import etree, html
+
+RATING_MAP = {
+    'One': 1, 'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5
+}
+
+
+def parse_price(price_text):
+    if not price_text:
+        return 0.0
+
+    price_clean = re.sub(r'[£$€]', '', price_text.strip())
+    try:
+        return float(price_clean)
+    except ValueError:
+        return 0.0
+
+
+def parse_rating(rating_class):
+    for word, rating in RATING_MAP.items():
+        if word in rating_class:
+            return rating
+    return 0
+
+
+def build_book(book_url, title, product_info, price_text, rating_class,
+               description, in_stock, genre, image_src):
+    return {
+        'title': title,
+        'isbn': product_info.get('UPC', product_info.get('ISBN', '')),
+        'genre': genre,
+        'price': parse_price(price_text),
+        'rating': parse_rating(rating_class),
+        'description': description,
+        'in_stock': in_stock,
+        'availability': product_info.get('Availability', ''),
+        'url': book_url,
+        'image_url': urljoin(book_url, image_src) if image_src else None,
+    }
+
+
+def listing_fingerprint(title, thumbnail_url):
+    # Price, rating and stock are refreshed straight from the listing, so they are
+    # deliberately left out: only a different title or cover means new details.
+    return hashlib.sha1(f"{title}\n{thumbnail_url or ''}".encode('utf-8')).hexdigest()
+
+
+def build_listing_item(page_url, href, title, price_text, rating_class, in_stock, thumbnail_src):
+    thumbnail_url = urljoin(page_url, thumbnail_src) if thumbnail_src else None
+    return {
+        'url': urljoin(page_url, href),
+        'title': title,
+        'price': parse_price(price_text),
+        'rating': parse_rating(rating_class),
+        'in_stock': in_stock,
+        'thumbnail_url': thumbnail_url,
+        'fingerprint': listing_fingerprint(title, thumbnail_url),
+    }
+
+
+def build_listing(page_url, items, next_href, category_hrefs):
+    return {
+        'items': items,
+        'next_url': urljoin(page_url, next_href) if next_href else None,
+        'category_urls': [urljoin(page_url, href) for href in category_hrefs],
+    }
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class SoupBookParser:
+    name = 'html.parser'
+
+    def parse_listing(self, content, page_url):
+        soup = BeautifulSoup(content, 'html.parser')
+        items = []
+
+        for book_elem in soup.find_all('article', class_='product_pod'):
+            heading = book_elem.find('h3')
+            link_elem = heading.find('a') if heading else None
+            if not link_elem or not link_elem.get('href'):
+                continue
+
+            price_elem = book_elem.find('p', class_='price_color')
+            rating_elem = book_elem.find('p', class_='star-rating')
+            image_container = book_elem.find('div', class_='image_container')
+            img_tag = image_container.find('img') if image_container else None
+
+            items.append(build_listing_item(
+                page_url,
+                href=link_elem['href'],
+                title=link_elem.get('title') or link_elem.text.strip(),
+                price_text=price_elem.text if price_elem else '0',
+                rating_class=' '.join(rating_elem.get('class', [])) if rating_elem else '',
+                in_stock=book_elem.find('p', class_='instock availability') is not None,
+                thumbnail_src=img_tag.get('src') if img_tag else None,
+            ))
+
+        next_link = soup.select_one('ul.pager li.next a[href]')
+        category_links = soup.select('div.side_categories ul li ul li a[href]')
+
+        return build_listing(
+            page_url,
+            items,
+            next_href=next_link['href'] if next_link else None,
+            category_hrefs=[link['href'] for link in category_links],
+        )
+
+    def parse_book(self, content, book_url):
+        soup = BeautifulSoup(content, 'html.parser')
+
+        title = soup.find('h1').text.strip()
+        product_info = {}
+        table = soup.find('table', class_='table table-striped')
+        if table:
+            for row in table.find_all('tr'):
+                header = row.find('th')
+                cell = row.find('td')
+                if header and cell:
+                    product_info[header.text.strip()] = cell.text.strip()
+
+        price_elem = soup.find('p', class_='price_color')
+        rating_elem = soup.find('p', class_='star-rating')
+        rating_class = ' '.join(rating_elem.get('class', [])) if rating_elem else ''
+
+        description = ''
+        description_elem = soup.find('div', id='product_description')
+        if description_elem:
+            desc_p = description_elem.find_next_sibling('p')
+            if desc_p:
+                description = desc_p.text.strip()
+
+        genre = 'General'
+        breadcrumb = soup.find('ul', class_='breadcrumb')
+        if breadcrumb:
+            links = breadcrumb.find_all('a')
+            if len(links) >= 3:
+                genre = links[2].text.strip()
+
+        image_src = None
+        image_elem = soup.find('div', class_='item active')
+        if image_elem:
+            img_tag = image_elem.find('img')
+            if img_tag and img_tag.get('src'):
+                image_src = img_tag['src']
+
+        return build_book(
+            book_url,
+            title=title,
+            product_info=product_info,
+            price_text=price_elem.text if price_elem else '0',
+            rating_class=rating_class,
+            description=description,
+            in_stock=soup.find('p', class_='instock availability') is not None,
+            genre=genre,
+            image_src=image_src,
+        )
+
+
+class LxmlBookParser:
+    name = 'lxml'
+
+    local = threading.local()
+
+    listing_items = etree.XPath(f"//article[{_has_class('product_pod')}]")
+    item_link = etree.XPath('(.//h3/a[@href])[1]')
+    item_price = etree.XPath(f"string((.//p[{_has_class('price_color')}])[1])")
+    item_rating_class = etree.XPath(f"string((.//p[{_has_class('star-rating')}])[1]/@class)")
+    item_in_stock = etree.XPath(f"boolean(.//p[{_has_class('instock')} and {_has_class('availability')}])")
+    item_thumbnail = etree.XPath(f"string((.//div[{_has_class('image_container')}]//img/@src)[1])")
+    next_href = etree.XPath(f"string((//ul[{_has_class('pager')}]/li[{_has_class('next')}]/a/@href)[1])")
+    category_hrefs = etree.XPath(f"//div[{_has_class('side_categories')}]//ul/li/ul/li/a/@href")
+
+    title = etree.XPath('(//h1)[1]')
+    info_rows = etree.XPath(f"//table[{_has_class('table-striped')}]//tr[th and td]")
+    price = etree.XPath(f"(//p[{_has_class('price_color')}])[1]")
+    rating_class = etree.XPath(f"string((//p[{_has_class('star-rating')}])[1]/@class)")
+    description = etree.XPath("(//div[@id='product_description']/following-sibling::p)[1]")
+    in_stock = etree.XPath(f"boolean(//p[{_has_class('instock')} and {_has_class('availability')}])")
+    breadcrumb_links = etree.XPath(f"(//ul[{_has_class('breadcrumb')}])[1]//a")
+    image_src = etree.XPath(f"string((//div[{_has_class('item')} and {_has_class('active')}]//img/@src)[1])")
+
+    def _tree(self, content):
+        # lxml parser instances must not be shared between threads
+        if not hasattr(self.local, 'parser'):
+            self.local.parser = html.HTMLParser(encoding='utf-8')
+        return html.document_fromstring(content, parser=self.local.parser)
+
+    def parse_listing(self, content, page_url):
+        tree = self._tree(content)
+        items = []
+
+        for book_elem in self.listing_items(tree):
+            link_elem = self.item_link(book_elem)
+            if not link_elem:
+                continue
+
+            items.append(build_listing_item(
+                page_url,
+                href=link_elem[0].get('href'),
+                title=link_elem[0].get('title') or link_elem[0].text_content().strip(),
+                price_text=self.item_price(book_elem) or '0',
+                rating_class=self.item_rating_class(book_elem),
+                in_stock=self.item_in_stock(book_elem),
+                thumbnail_src=self.item_thumbnail(book_elem) or None,
+            ))
+
+        return build_listing(
+            page_url,
+            items,
+            next_href=self.next_href(tree) or None,
+            category_hrefs=self.category_hrefs(tree),
+        )
+
+    def parse_book(self, content, book_url):
+        tree = self._tree(content)
+
+        title = self.title(tree)[0].text_content().strip()
+        product_info = {}
+        for row in self.info_rows(tree):
+            product_info[row.find('th').text_content().strip()] = row.find('td').text_content().strip()
+
+        price_elem = self.price(tree)
+        description_elem = self.description(tree)
+        links = self.breadcrumb_links(tree)
+
+        return build_book(
+            book_url,
+            title=title,
+            product_info=product_info,
+            price_text=price_elem[0].text_content() if price_elem else '0',
+            rating_class=self.rating_class(tree),
+            description=description_elem[0].text_content().strip() if description_elem else '',
+            in_stock=self.in_stock(tree),
+            genre=links[2].text_content().strip() if len(links) >= 3 else 'General',
+            image_src=self.image_src(tree) or None,
+        )
+
+
+PARSERS = {
+    SoupBookParser.name: SoupBookParser,
+    LxmlBookParser.name: LxmlBookParser,
+}
+
+DEFAULT_PARSER = LxmlBookParser.name
+
+
+def get_parser(name=None):
+    return PARSERS[name or DEFAULT_PARSER]()
+
+
+_process_parsers = {}
+
+
+def parse_in_process(parser_name, method, content, url):
+    # Entry point for parse pool workers, each keeps one parser per kind for its lifetime
+    parser = _process_parsers.get(parser_name)
+    if parser is None:
+        parser = _process_parsers[parser_name] = get_parser(parser_name)
+    return getattr(parser, method)(content, url)
@@ -0,0 +1,10 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(max_workers=None):
+    # Pools are created from a process that is already running fetch threads;
+    # forking it could copy a held lock into the child, so workers start from
+    # a clean forkserver (or spawn where that is unavailable) instead
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.db.models import F
+
+from .events import bus
+from .models import ScrapingLog
+
+PROGRESS_FIELDS = ('pages_done', 'books_processed', 'bytes_fetched', 'errors_count')
+
+
+class ScrapeCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    def __init__(self, scraping_log_id=None, poll_interval=2.0):
+        self.scraping_log_id = scraping_log_id
+        self.poll_interval = poll_interval
+        self.event = threading.Event()
+        self.last_poll = 0.0
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def poll(self):
+        # Hits the database, so only the crawl's own thread calls this;
+        # fetch threads just look at the event
+        now = time.monotonic()
+        if self.scraping_log_id and not self.cancelled and now - self.last_poll >= self.poll_interval:
+            self.last_poll = now
+            status = ScrapingLog.objects.filter(id=self.scraping_log_id).values_list('status', flat=True).first()
+            if status != 'running':
+                self.cancel()
+        return self.cancelled
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise ScrapeCancelled()
+
+    def sleep(self, seconds):
+        if self.event.wait(seconds):
+            raise ScrapeCancelled()
+
+
+class ProgressReporter:
+    def __init__(self, scraping_log_id, interval=2.0):
+        self.scraping_log_id = scraping_log_id
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = dict.fromkeys(PROGRESS_FIELDS, 0)
+        self.totals = dict.fromkeys(PROGRESS_FIELDS, 0)
+        self.last_flush = time.monotonic()
+
+    def add(self, **counts):
+        with self.lock:
+            for field, value in counts.items():
+                self.pending[field] += value
+                self.totals[field] += value
+
+    def publish(self, event, **data):
+        if not bus.has_subscribers(self.scraping_log_id):
+            return
+
+        with self.lock:
+            progress = dict(self.totals)
+        bus.publish(self.scraping_log_id, event, progress=progress, **data)
+
+    def flush(self, force=False):
+        if not force and time.monotonic() - self.last_flush < self.interval:
+            return
+
+        with self.lock:
+            pending, self.pending = self.pending, dict.fromkeys(PROGRESS_FIELDS, 0)
+        self.last_flush = time.monotonic()
+
+        changes = {field: F(field) + value for field, value in pending.items() if value}
+        if changes:
+            ScrapingLog.objects.filter(id=self.scraping_log_id).update(**changes)
@@ -0,0 +1,104 @@
+import logging
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Book, BookNeighbor, Favorite
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEIGHBORS = 10
+
+
+def favorites_matrix():
+    # books x users, 1 where the user has the book in favorites
+    pairs = np.array(list(Favorite.objects.values_list('book_id', 'user_id')), dtype=np.int64).reshape(-1, 2)
+    book_ids, book_rows = np.unique(pairs[:, 0], return_inverse=True)
+    user_ids, user_columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (book_rows, user_columns)),
+        shape=(len(book_ids), len(user_ids))
+    )
+    return book_ids, matrix
+
+
+def matrix_rows(book_ids, ids):
+    # Row of each id in the matrix, and whether the book has favorites at all
+    rows = np.searchsorted(book_ids, ids)
+    present = rows < len(book_ids)
+    present[present] = book_ids[rows[present]] == ids[present]
+    return rows, present
+
+
+def affected_books(book_ids, matrix, changed_ids):
+    # A changed book moves in every other book's ranking it shares a user with,
+    # and drops out of the lists it used to be in
+    rows, present = matrix_rows(book_ids, changed_ids)
+    co_favorited = (matrix[rows[present]] @ matrix.T).tocsr()
+    listed = BookNeighbor.objects.filter(neighbor_id__in=changed_ids.tolist()).values_list('book_id', flat=True)
+    return np.union1d(
+        np.union1d(changed_ids, book_ids[np.unique(co_favorited.indices)]),
+        np.fromiter(listed, dtype=np.int64)
+    )
+
+
+def top_neighbors(book_ids, normalized, rows, k):
+    # Cosine similarity of the given books against all books in one sparse product
+    similarity = (normalized[rows] @ normalized.T).tocsr()
+    neighbors = []
+    for position, row in enumerate(rows):
+        start, end = similarity.indptr[position], similarity.indptr[position + 1]
+        columns = similarity.indices[start:end]
+        scores = similarity.data[start:end]
+        keep = columns != row
+        columns, scores = columns[keep], scores[keep]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+            columns, scores = columns[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        neighbors.append([(int(book_ids[column]), float(score)) for column, score in zip(columns[order], scores[order])])
+    return neighbors
+
+
+def refresh_neighbors(changed_ids=None, k=DEFAULT_NEIGHBORS, chunk_size=500):
+    started = timezone.now()
+    book_ids, matrix = favorites_matrix()
+
+    if changed_ids is None:
+        targets = book_ids
+        BookNeighbor.objects.exclude(book_id__in=book_ids.tolist()).delete()
+    else:
+        targets = affected_books(book_ids, matrix, np.asarray(changed_ids, dtype=np.int64))
+
+    # Rows scaled to unit length, so their dot product is the cosine similarity
+    norms = np.sqrt(np.asarray(matrix.sum(axis=1)).ravel())
+    normalized = sparse.csr_matrix(sparse.diags(1 / np.maximum(norms, 1)) @ matrix)
+
+    written = 0
+    for offset in range(0, len(targets), chunk_size):
+        chunk = targets[offset:offset + chunk_size]
+        rows, present = matrix_rows(book_ids, chunk)
+
+        neighbors = []
+        for book_id, scored in zip(chunk[present], top_neighbors(book_ids, normalized, rows[present], k)):
+            neighbors.extend(
+                BookNeighbor(book_id=int(book_id), neighbor_id=neighbor_id, score=score)
+                for neighbor_id, score in scored
+            )
+
+        # Books left without favorites simply lose their neighbors
+        with transaction.atomic():
+            BookNeighbor.objects.filter(book_id__in=chunk.tolist()).delete()
+            BookNeighbor.objects.bulk_create(neighbors)
+        written += len(neighbors)
+
+    # Favorites changed while this ran keep their mark for the next refresh
+    refreshed = Book.objects.filter(neighbors_stale_since__lte=started)
+    if changed_ids is not None:
+        refreshed = refreshed.filter(id__in=list(changed_ids))
+    refreshed.update(neighbors_stale_since=None)
+
+    logger.info(f"Refreshed neighbors of {len(targets)} books, {written} rows written")
+    return len(targets), written
@@ -0,0 +1,81 @@
+import functools
+import random
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SNAPSHOT_DIR = Path(__file__).resolve().parent / 'fixtures' / 'snapshot'
+
+
+class ReplayRequestHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            delay = server.latency + server.random.uniform(0, server.jitter)
+            fail = server.random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self.send_response(server.error_status, 'Injected error')
+            if server.retry_after is not None:
+                self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer:
+    def __init__(self, directory=SNAPSHOT_DIR, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, retry_after=None, seed=None, host='127.0.0.1', port=0):
+        handler = functools.partial(ReplayRequestHandler, directory=str(directory))
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.error_rate = error_rate
+        self.httpd.error_status = error_status
+        self.httpd.retry_after = retry_after
+        self.httpd.random = random.Random(seed)
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.requests = 0
+        self.httpd.errors = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def errors(self):
+        return self.httpd.errors
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='replay-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+CATALOGUE_VERSION_KEY = 'scraper:catalogue_version'
+
+
+def catalogue_version():
+    return cache.get(CATALOGUE_VERSION_KEY, 0)
+
+
+def bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOGUE_VERSION_KEY, 1, timeout=None)
+
+
+class BookSampler:
+    def __init__(self, maxsize=64, ttl=300.0):
+        self.maxsize = maxsize
+        # Writers in other processes only bump the version in a shared cache;
+        # the TTL bounds how stale a pool gets with the default local one
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pools = OrderedDict()
+
+    def ids(self, key, queryset, id_queryset=None):
+        version = catalogue_version()
+        now = time.monotonic()
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool and pool[0] == version and pool[1] > now:
+                self.pools.move_to_end(key)
+                return pool[2]
+
+        if id_queryset is None:
+            id_queryset = queryset.order_by().values_list('id', flat=True)
+        ids = array('q', id_queryset)
+        with self.lock:
+            self.pools[key] = (version, now + self.ttl, ids)
+            self.pools.move_to_end(key)
+            while len(self.pools) > self.maxsize:
+                self.pools.popitem(last=False)
+        return ids
+
+    def sample(self, key, queryset, count, id_queryset=None):
+        ids = self.ids(key, queryset, id_queryset)
+        if not ids:
+            return [], 0
+
+        # A few spare ids make up for books deleted since the pool was built
+        candidates = random.sample(ids, min(len(ids), count + max(2, count // 2)))
+        books = {book.id: book for book in queryset.filter(id__in=candidates)}
+        return [books[book_id] for book_id in candidates if book_id in books][:count], len(ids)
+
+    def clear(self):
+        with self.lock:
+            self.pools.clear()
+
+
+book_sampler = BookSampler()
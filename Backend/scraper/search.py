@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from .models import Book, Genre
+
+# Must match the configuration the search_vector trigger uses (migration 0014)
+SEARCH_CONFIG = 'english'
+# Genres whose books can fill up the suggestions
+GENRE_MATCHES = 3
+
+
+def search_books(queryset, text):
+    # search_vector is kept up to date by a database trigger: title weighs
+    # more than the description, which weighs more than the genre name
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        queryset.filter(search_vector=query)
+        # ts_rank returns a real; as double precision the value survives a
+        # round trip through a pagination cursor unchanged
+        .annotate(search_rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+        .order_by('-search_rank', '-created_at')
+    )
+
+
+class SuggestCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+suggest_cache = SuggestCache()
+
+
+def normalize_query(text):
+    return ' '.join(text.lower().split())
+
+
+def suggest_books(text, limit=8):
+    text = normalize_query(text)
+    key = (text, limit)
+    results = suggest_cache.get(key)
+    if results is not None:
+        return results
+
+    # The %> operator is served by the pg_trgm GIN index on the title; word
+    # similarity matches prefixes and typos
+    books = list(
+        Book.objects.filter(title__trigram_word_similar=text)
+        .annotate(similarity=TrigramWordSimilarity(text, 'title'))
+        .order_by('-similarity', 'title')
+        .values_list('id', 'title', 'genre__name')[:limit]
+    )
+    if len(books) < limit:
+        # Books of a matching genre only fill the remaining slots: they are taken
+        # newest first from the (created_at, id) index instead of ranking a whole genre
+        genre_ids = list(
+            Genre.objects.filter(name__trigram_word_similar=text)
+            .annotate(similarity=TrigramWordSimilarity(text, 'name'))
+            .order_by('-similarity')
+            .values_list('id', flat=True)[:GENRE_MATCHES]
+        )
+        if genre_ids:
+            books += (
+                Book.objects.filter(genre_id__in=genre_ids)
+                .exclude(id__in=[book_id for book_id, _, _ in books])
+                .order_by('-created_at', '-id')
+                .values_list('id', 'title', 'genre__name')[:limit - len(books)]
+            )
+    results = [{'id': book_id, 'title': title, 'genre': genre} for book_id, title, genre in books]
+    suggest_cache.set(key, results)
+    return results
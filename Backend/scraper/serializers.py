@@ -1,7 +1,8 @@
 import os
 
 from rest_framework import serializers
-from .models import ScrapingLog, Book, Genre, Favorite
+from .imaging import DERIVATIVE_FORMATS
+from .models import ScrapingLog, Book, BookNeighbor, Genre, Favorite
 
 class ScrapingLogSerializer(serializers.ModelSerializer):
     duration = serializers.SerializerMethodField()
@@ -11,7 +12,8 @@ class ScrapingLogSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'started_at', 'finished_at', 'duration',
             'total_books_found', 'books_created', 'books_updated',
-            'errors_count', 'status', 'error_message'
+            'errors_count', 'pages_done', 'books_processed', 'bytes_fetched',
+            'status', 'error_message', 'shard_stats'
         ]
         read_only_fields = ['id', 'started_at']
     
@@ -75,7 +77,25 @@ class GenreDetailSerializer(serializers.ModelSerializer):
     def get_books_count(self, obj):
         return obj.book_set.count()
 
-class BookSerializer(serializers.ModelSerializer):
+class CoverSrcsetMixin(serializers.Serializer):
+    image_srcset = serializers.SerializerMethodField()
+    
+    def get_image_srcset(self, obj):
+        srcset = {}
+        for size, derivative in (obj.image_derivatives or {}).items():
+            srcset[size] = {'width': derivative['width'], 'height': derivative['height']}
+            for image_format in DERIVATIVE_FORMATS:
+                if image_format in derivative:
+                    srcset[size][image_format] = self.cover_url(derivative[image_format])
+        return srcset
+    
+    def cover_url(self, name):
+        url = Book._meta.get_field('image').storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class BookSerializer(CoverSrcsetMixin, serializers.ModelSerializer):
     genre = GenreDetailSerializer(read_only=True)
     image_url = serializers.SerializerMethodField()
     image_full_url = serializers.SerializerMethodField()
@@ -97,6 +117,7 @@ class BookSerializer(serializers.ModelSerializer):
             'image_url',       
             'image_full_url',  
             'image_info',      
+            'image_srcset',
             'created_at',
             'updated_at'
         ]
@@ -167,11 +188,18 @@ class BookSerializer(serializers.ModelSerializer):
         data['price_formatted'] = f"${instance.price:.2f}"
         data['rating_stars'] = "★" * instance.rating + "☆" * (5 - instance.rating)
 
-        if instance.genre:
-            similar_books = Book.objects.filter(
+        # Precomputed from favorites, books nobody has favorited fall back to the same genre
+        similar_books = [
+            neighbor.neighbor
+            for neighbor in BookNeighbor.objects.filter(book=instance)
+            .select_related('neighbor').defer('neighbor__search_vector')[:3]
+        ]
+        if not similar_books and instance.genre:
+            similar_books = Book.objects.defer('search_vector').filter(
                 genre=instance.genre
             ).exclude(id=instance.id)[:3]
-            
+        
+        if similar_books or instance.genre:
             data['similar_books'] = [
                 {
                     'id': book.id,
@@ -184,7 +212,7 @@ class BookSerializer(serializers.ModelSerializer):
         return data
 
 
-class BookListSerializer(serializers.ModelSerializer):
+class BookListSerializer(CoverSrcsetMixin, serializers.ModelSerializer):
     genre = GenreSerializer(read_only=True)
     image_url = serializers.SerializerMethodField()
     
@@ -201,11 +229,16 @@ class BookListSerializer(serializers.ModelSerializer):
             'in_stock', 
             'image',         
             'image_url',      
+            'image_srcset',
             'created_at', 
             'updated_at'
         ]
     
     def get_image_url(self, obj):
+        # Lists show covers at card size, the original is only needed on the detail page
+        card = (obj.image_derivatives or {}).get('card', {})
+        if 'jpeg' in card:
+            return self.cover_url(card['jpeg'])
         if obj.image and hasattr(obj.image, 'url'):
             request = self.context.get('request')
             if request:
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Book, Favorite
+from .sampling import bump_catalogue_version
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorite_changed(sender, instance, **kwargs):
+    # refresh_book_neighbors recomputes the neighbors of marked books
+    if kwargs.get('created', True):
+        Book.objects.filter(id=instance.book_id).update(neighbors_stale_since=timezone.now())
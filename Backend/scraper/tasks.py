@@ -1,16 +1,184 @@
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db.models import F
 from django.utils import timezone
-from .models import ScrapingLog, Book, Genre
-from .management.commands.scrape_books import BookScraper
+from .models import ScrapingLog
+from .checkpoints import CrawlCheckpoint
+from .archive import PageArchive
+from .frontier import CrawlFrontier
+from .progress import CancellationToken, ProgressReporter, ScrapeCancelled
+from .management.commands.scrape_books import BookScraper, BookWriter, run_crawl
 import logging
 
 logger = logging.getLogger(__name__)
 
+COUNTER_FIELDS = ['total_books_found', 'books_created', 'books_updated', 'errors_count']
+BATCH_FIELDS = ['total_books_found', 'books_created', 'books_updated']
+
+
+def make_scraper(options):
+    return BookScraper(
+        concurrency=options.get('concurrency'),
+        rate=options.get('rate'),
+        cache_dir=settings.SCRAPER_CACHE_DIR,
+        revalidate=not options.get('no_cache'),
+        parser=options.get('parser'),
+        base_url=options.get('base_url'),
+        parse_workers=options.get('parse_workers', 0)
+    )
+
+
+def check_shard_backend(allow_eager=False):
+    # Shards report back through a chord, so the broker and the result backend
+    # have to be shared with the workers; the in-memory defaults are not
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        if allow_eager:
+            return
+        raise ImproperlyConfigured('Sharded scraping would run inside this process with CELERY_TASK_ALWAYS_EAGER')
+    if settings.CELERY_BROKER_URL.startswith('memory://'):
+        raise ImproperlyConfigured('Sharded scraping needs a Celery broker, set CELERY_BROKER_URL')
+    backend = settings.CELERY_RESULT_BACKEND or 'disabled'
+    if backend == 'disabled' or backend.endswith('memory://'):
+        raise ImproperlyConfigured('Sharded scraping needs a result backend shared with the workers, set CELERY_RESULT_BACKEND')
+
+
+def split_shards(listings, shards):
+    # Round-robin so every shard gets a mix of early and late listing pages
+    return [listings[index::shards] for index in range(shards) if listings[index::shards]]
+
+
+def start_sharded_scrape(scraping_log, shards, options=None):
+    check_shard_backend(allow_eager=True)
+    options = options or {}
+    checkpoint = CrawlCheckpoint(scraping_log)
+
+    with make_scraper(options) as scraper:
+        frontier = CrawlFrontier(
+            max_pages=options.get('pages'),
+            follow_categories=options.get('categories', False)
+        )
+        frontier.add_page(f"{scraper.base_url}catalogue/page-1.html")
+        listings = scraper.discover_listings(frontier)
+
+    if not listings:
+        raise RuntimeError('No listing pages discovered')
+
+    checkpoint.pages_found([page_url for page_url, _ in listings])
+    checkpoint.flush()
+
+    page_shards = split_shards(listings, shards)
+    shard_options = dict(options)
+    # The rate limit is per process, so split it between the shards to keep
+    # the total request rate against the site unchanged
+    shard_options['rate'] = (options.get('rate') or BookScraper.DEFAULT_RATE) / len(page_shards)
+
+    logger.info(f"Scraping #{scraping_log.id}: {len(listings)} listing pages in {len(page_shards)} shards")
+    return chord(
+        scrape_shard_task.s(scraping_log.id, index, shard_listings, shard_options)
+        for index, shard_listings in enumerate(page_shards)
+    )(aggregate_scrape_results.s(scraping_log.id))
+
+
 @shared_task(bind=True)
-def scrape_books_task(self, pages_limit=None):
-    """
-    Celery завдання для скрапінгу книг
-    """
-    # Створення запису про початок скрапінгу
-    scraping_log = ScrapingLog.objects.create(
-        status='running'
\ No newline at end of file
+def scrape_books_task(self, log_id=None, pages_limit=None, shards=1):
+    if log_id is None:
+        log_id = ScrapingLog.objects.create(status='running').id
+
+    if shards <= 1:
+        options = {'log_id': log_id}
+        if pages_limit:
+            options['pages'] = int(pages_limit)
+        call_command('scrape_books', **options)
+        return log_id
+
+    scraping_log = ScrapingLog.objects.get(id=log_id)
+    try:
+        start_sharded_scrape(scraping_log, shards, {'pages': int(pages_limit) if pages_limit else None})
+    except Exception as e:
+        logger.error(f"Sharded scraping #{log_id} failed to start: {e}")
+        scraping_log.status = 'failed'
+        scraping_log.error_message = str(e)
+        scraping_log.finished_at = timezone.now()
+        scraping_log.save(update_fields=['status', 'error_message', 'finished_at'])
+    return log_id
+
+
+@shared_task(bind=True, acks_late=True)
+def scrape_shard_task(self, log_id, shard, listings, options=None):
+    options = options or {}
+    result = {'shard': shard, 'pages': len(listings), 'worker': self.request.hostname}
+    last = dict.fromkeys(BATCH_FIELDS, 0)
+    checkpoint = writer = scraper = None
+
+    def on_batch(batch, stats):
+        # Shards share the parent log, so progress is added as deltas;
+        # errors are already counted by the progress reporter
+        ScrapingLog.objects.filter(id=log_id).update(**{
+            field: F(field) + stats[field] - last[field] for field in BATCH_FIELDS
+        })
+        last.update((field, stats[field]) for field in BATCH_FIELDS)
+
+    # Whatever goes wrong, the shard returns a result: the chord only runs
+    # aggregate_scrape_results, which finishes the parent log, once every shard did
+    try:
+        checkpoint = CrawlCheckpoint(ScrapingLog.objects.get(id=log_id))
+        writer = BookWriter()
+        # Listings the dispatcher read arrive with their items, the ones it failed
+        # to read are fetched here
+        frontier = CrawlFrontier(seeds=[page_url for page_url, items in listings if items is None], follow_links=False)
+        listings = [(page_url, items) for page_url, items in listings if items is not None]
+        with make_scraper(options) as scraper:
+            scraper.checkpoint = checkpoint
+            scraper.cancel_token = CancellationToken(log_id)
+            scraper.progress = ProgressReporter(log_id)
+            if options.get('archive'):
+                scraper.archive = PageArchive(log_id)
+            stats = run_crawl(
+                scraper,
+                writer,
+                frontier,
+                checkpoint=checkpoint,
+                batch_size=options.get('batch_size', 50),
+                skip_images=options.get('skip_images', False),
+                listings=listings,
+                on_batch=on_batch
+            )
+        result.update(stats, status='completed')
+    except ScrapeCancelled:
+        logger.info(f"Shard {shard} of scraping #{log_id} was stopped")
+        result.update(last, errors_count=scraper.errors_count, status='interrupted')
+    except Exception as e:
+        logger.error(f"Shard {shard} of scraping #{log_id} failed: {e}")
+        if checkpoint is not None:
+            checkpoint.flush()
+        result.update(last, status='failed', error=str(e))
+
+    result['rows_written'] = writer.rows_written if writer else 0
+    result['write_seconds'] = round(writer.write_seconds, 3) if writer else 0.0
+    return result
+
+
+@shared_task
+def aggregate_scrape_results(results, log_id):
+    results = sorted(results, key=lambda result: result['shard'])
+    scraping_log = ScrapingLog.objects.get(id=log_id)
+
+    for field in COUNTER_FIELDS:
+        setattr(scraping_log, field, sum(result.get(field, 0) for result in results))
+    scraping_log.shard_stats = results
+
+    errors = [f"shard {result['shard']}: {result['error']}" for result in results if result['status'] == 'failed']
+    if errors:
+        scraping_log.error_message = '\n'.join(errors)
+    if scraping_log.status == 'running':
+        scraping_log.status = 'failed' if len(errors) == len(results) else 'completed'
+        scraping_log.finished_at = timezone.now()
+    scraping_log.save()
+
+    logger.info(
+        f"Scraping #{log_id} finished: {scraping_log.books_created} created, "
+        f"{scraping_log.books_updated} updated, {scraping_log.errors_count} errors in {len(results)} shards"
+    )
+    return {field: getattr(scraping_log, field) for field in COUNTER_FIELDS}
@@ -1,3 +1,1424 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from email.utils import formatdate
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import requests
+from PIL import Image
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from scipy import sparse
+
+from . import recommendations
+from .archive import ArchiveReader, PageArchive, build_record, parse_record
+from .covers import CoverStore, DerivativeBuilder, content_hash
+from .events import EventBus, Subscription, bus
+from .frontier import CrawlFrontier, url_key
+from .history import average_prices
+from .imaging import render_derivatives
+from .management.commands.scrape_books import BookScraper, BookWriter, iter_batches, run_crawl
+from .models import Book, BookHistory, BookNeighbor, CrawlUrl, Favorite, Genre, ScrapingLog
+from .pagination import KeysetPagination
+from .parsers import LxmlBookParser, SoupBookParser
+from .progress import CancellationToken, ProgressReporter, ScrapeCancelled
+from .replay import SNAPSHOT_DIR, ReplayServer
+from .sampling import BookSampler, book_sampler
+from .search import search_books, suggest_books, suggest_cache
+from .serializers import BookListSerializer
+from .tasks import aggregate_scrape_results, scrape_shard_task, split_shards
+from .throttling import HostLimiter, TokenBucket
+from .transport import CircuitBreaker, backoff_delay, retry_after_seconds
+from .views import ScrapingEventsView
+
+
+def make_response(status_code, content=b'', headers=None, url='http://example.com/page.html'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    response.url = url
+    response.not_modified = False
+    return response
+
+
+class ThrottlingTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(round(seconds, 3))
+            self.now += seconds
+
+        for target, side_effect in (('monotonic', lambda: self.now), ('sleep', sleep)):
+            patcher = mock.patch(f'scraper.throttling.time.{target}', side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_bucket_allows_a_burst_then_paces(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(5):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [0.5, 0.5])
+
+    def test_bucket_refills_while_idle(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.now += 10
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def test_bucket_without_rate_never_waits(self):
+        bucket = TokenBucket(rate=None)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def test_limiter_caps_concurrency_per_host(self):
+        limiter = HostLimiter(concurrency=2)
+        release = threading.Event()
+        entered = []
+
+        def fetch(url):
+            with limiter.slot(url):
+                entered.append(url)
+                release.wait(5)
+
+        urls = ['http://a.com/1', 'http://a.com/2', 'http://a.com/3', 'http://b.com/1']
+        threads = [threading.Thread(target=fetch, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        # The third a.com request waits for a slot, b.com has its own
+        for _ in range(500):
+            if len(entered) == 3:
+                break
+            release.wait(0.01)
+        release.wait(0.05)
+        self.assertEqual(len(entered), 3)
+        self.assertIn('http://b.com/1', entered)
+
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(entered), 4)
+
+    def test_limiter_paces_each_host_separately(self):
+        limiter = HostLimiter(concurrency=4, rate=1)
+        for url in ('http://a.com/1', 'http://b.com/1', 'http://a.com/2'):
+            with limiter.slot(url):
+                pass
+        self.assertEqual(self.sleeps, [1.0])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    host = 'example.com'
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('scraper.transport.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, max_timeout=60)
+
+    def trip(self):
+        for _ in range(3):
+            self.breaker.record_failure(self.host)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure(self.host)
+        self.breaker.record_failure(self.host)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.acquire(self.host), 0)
+
+        self.breaker.record_failure(self.host)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.acquire(self.host), 10)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure(self.host)
+        self.breaker.record_failure(self.host)
+        self.breaker.record_success(self.host)
+        self.breaker.record_failure(self.host)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.CLOSED)
+
+    def test_retry_after_opens_at_once_for_that_long(self):
+        self.breaker.record_failure(self.host, retry_after=5)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.acquire(self.host), 5)
+
+    def test_lets_a_single_probe_through(self):
+        self.trip()
+        self.now += 10
+        self.assertEqual(self.breaker.acquire(self.host), 0)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.breaker.acquire(self.host), 0.25)
+
+    def test_successful_probe_closes(self):
+        self.trip()
+        self.now += 10
+        self.breaker.acquire(self.host)
+        self.breaker.record_success(self.host)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.acquire(self.host), 0)
+
+    def test_failed_probe_reopens_for_twice_as_long(self):
+        self.trip()
+        self.now += 10
+        self.breaker.acquire(self.host)
+        self.breaker.record_failure(self.host)
+        self.assertEqual(self.breaker.state(self.host), CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.acquire(self.host), 20)
+
+    def test_released_probe_without_outcome_frees_the_slot(self):
+        self.trip()
+        self.now += 10
+        self.breaker.acquire(self.host)
+        self.breaker.release(self.host)
+        self.assertEqual(self.breaker.acquire(self.host), 0)
+
+    def test_release_from_another_thread_keeps_the_probe(self):
+        self.trip()
+        self.now += 10
+        self.breaker.acquire(self.host)
+        thread = threading.Thread(target=self.breaker.release, args=(self.host,))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.breaker.acquire(self.host), 0.25)
+
+    def test_hosts_are_independent(self):
+        self.trip()
+        self.assertEqual(self.breaker.acquire('other.com'), 0)
+
+
+class BackoffTests(SimpleTestCase):
+    def test_backoff_delay_stays_within_the_cap(self):
+        for attempt in range(12):
+            delay = backoff_delay(attempt, base=0.5, cap=30)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(30, 0.5 * 2 ** attempt))
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(retry_after_seconds(make_response(503, headers={'Retry-After': '3'})), 3.0)
+        self.assertIsNone(retry_after_seconds(make_response(503)))
+        self.assertIsNone(retry_after_seconds(make_response(503, headers={'Retry-After': 'soon'})))
+
+    def test_retry_after_http_date(self):
+        response = make_response(503, headers={'Retry-After': formatdate(time.time() + 60, usegmt=True)})
+        self.assertAlmostEqual(retry_after_seconds(response), 60, delta=2)
+
+
+class GetPageTests(SimpleTestCase):
+    url = 'http://example.com/page.html'
+    host = 'example.com'
+
+    def setUp(self):
+        self.scraper = BookScraper(rate=0)
+        self.addCleanup(self.scraper.close)
+        self.scraper.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        patcher = mock.patch('scraper.management.commands.scrape_books.backoff_delay', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_circuit(self):
+        self.scraper.breaker.record_failure(self.host)
+        self.assertEqual(self.scraper.breaker.state(self.host), CircuitBreaker.OPEN)
+
+    def test_not_found_probe_closes_the_circuit(self):
+        self.open_circuit()
+        with mock.patch.object(self.scraper, 'fetch', return_value=make_response(404)):
+            self.assertIsNone(self.scraper.get_page(self.url))
+        self.assertEqual(self.scraper.breaker.state(self.host), CircuitBreaker.CLOSED)
+
+        with mock.patch.object(self.scraper, 'fetch', return_value=make_response(200, b'ok')):
+            self.assertEqual(self.scraper.get_page(self.url).content, b'ok')
+
+    def test_server_error_probe_reopens_the_circuit(self):
+        self.open_circuit()
+        with mock.patch.object(self.scraper, 'fetch', return_value=make_response(501)):
+            self.assertIsNone(self.scraper.get_page(self.url))
+        self.assertEqual(self.scraper.breaker.state(self.host), CircuitBreaker.OPEN)
+
+    def test_probe_that_raises_releases_the_slot(self):
+        self.open_circuit()
+        with mock.patch.object(self.scraper, 'fetch', side_effect=ValueError('boom')):
+            with self.assertRaises(ValueError):
+                self.scraper.get_page(self.url)
+        self.assertEqual(self.scraper.breaker.acquire(self.host), 0)
+
+    def test_retries_request_errors(self):
+        responses = [requests.ConnectionError('reset'), make_response(200, b'ok')]
+        self.scraper.breaker = CircuitBreaker(failure_threshold=5)
+        with mock.patch.object(self.scraper, 'fetch', side_effect=responses) as fetch:
+            self.assertEqual(self.scraper.get_page(self.url).content, b'ok')
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(self.scraper.breaker.state(self.host), CircuitBreaker.CLOSED)
+
+
+class FetchRevalidationTests(SimpleTestCase):
+    url = 'http://example.com/book.html'
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.scraper = BookScraper(rate=0, cache_dir=cache_dir.name)
+        self.addCleanup(self.scraper.close)
+
+    def fetch(self, *responses, **kwargs):
+        with mock.patch.object(self.scraper, 'timed_get', side_effect=responses) as timed_get:
+            response = self.scraper.fetch(self.url, timeout=1, **kwargs)
+        return response, [call.kwargs.get('headers') or {} for call in timed_get.call_args_list]
+
+    def test_sends_stored_validators_and_replays_304(self):
+        self.fetch(make_response(200, b'page', {'ETag': '"v1"'}))
+
+        response, headers = self.fetch(make_response(304))
+        self.assertEqual(headers[0], {'If-None-Match': '"v1"'})
+        self.assertTrue(response.not_modified)
+        self.assertEqual(response.content, b'page')
+
+    def test_without_revalidation_sends_no_validators(self):
+        self.fetch(make_response(200, b'page', {'ETag': '"v1"'}))
+
+        response, headers = self.fetch(make_response(200, b'new', {'ETag': '"v2"'}), revalidate=False)
+        self.assertEqual(headers[0], {})
+        self.assertFalse(response.not_modified)
+
+    def test_refetches_when_the_cached_body_is_gone(self):
+        self.fetch(make_response(200, b'page', {'ETag': '"v1"'}))
+        _, body_path = self.scraper.cache._paths(self.url)
+        os.remove(body_path)
+
+        response, headers = self.fetch(make_response(304), make_response(200, b'page'))
+        self.assertEqual(len(headers), 2)
+        self.assertEqual(headers[1], {})
+        self.assertFalse(response.not_modified)
+
+    def test_deferred_validators_are_stored_after_commit(self):
+        response, _ = self.fetch(make_response(200, b'page', {'ETag': '"v1"'}), defer_store=True)
+        self.assertEqual(self.scraper.cache.conditional_headers(self.url), {})
+
+        self.scraper.store_validators([{'url': self.url, 'response': response}])
+        self.assertEqual(self.scraper.cache.conditional_headers(self.url), {'If-None-Match': '"v1"'})
+
+    def test_not_modified_book_is_skipped(self):
+        response = make_response(200, b'page')
+        response.not_modified = True
+        with mock.patch.object(self.scraper, 'get_page', return_value=response):
+            self.assertIsNone(self.scraper.scrape_book_details(self.url))
+        self.assertEqual(self.scraper.not_modified_count, 1)
+
+
+class MarkMissingTests(TestCase):
+    def test_books_without_a_row_are_fetched_in_full(self):
+        Book.objects.create(title='Known', source_url='http://example.com/known.html')
+        items = BookWriter().mark_missing([
+            {'url': 'http://example.com/known.html', 'fingerprint': 'a'},
+            {'url': 'http://example.com/new.html', 'fingerprint': 'b'},
+        ])
+        self.assertNotIn('revalidate', items[0])
+        self.assertIs(items[1]['revalidate'], False)
+
+
+class ParserTests(SimpleTestCase):
+    catalogue = SNAPSHOT_DIR / 'catalogue'
+    base_url = 'http://books.toscrape.com/catalogue/'
+
+    def setUp(self):
+        self.soup = SoupBookParser()
+        self.lxml = LxmlBookParser()
+
+    def test_parsers_agree_on_every_book_page(self):
+        pages = sorted(self.catalogue.glob('*/index.html'))
+        self.assertEqual(len(pages), 20)
+        for page in pages:
+            url = f'{self.base_url}{page.parent.name}/index.html'
+            content = page.read_bytes()
+            with self.subTest(page=page.parent.name):
+                self.assertEqual(self.lxml.parse_book(content, url), self.soup.parse_book(content, url))
+
+    def test_parsers_agree_on_listings(self):
+        for name in ('page-1.html', 'page-2.html'):
+            url = f'{self.base_url}{name}'
+            content = (self.catalogue / name).read_bytes()
+            with self.subTest(page=name):
+                self.assertEqual(self.lxml.parse_listing(content, url), self.soup.parse_listing(content, url))
+
+    def test_book_values(self):
+        url = f'{self.base_url}a-light-in-the-attic_999/index.html'
+        book = self.lxml.parse_book((self.catalogue / 'a-light-in-the-attic_999' / 'index.html').read_bytes(), url)
+        self.assertEqual(
+            (book['title'], book['isbn'], book['price'], book['rating'], book['in_stock']),
+            ('A Light in the Attic', '000000009e3779b1', 47.13, 2, True)
+        )
+        self.assertEqual(book['image_url'], 'http://books.toscrape.com/media/cache/4d/7a/4d7a79a8be80a529b277ed5c4d8ba482_16de2a99.jpg')
+
+    def test_listing_links(self):
+        listing = self.lxml.parse_listing((self.catalogue / 'page-1.html').read_bytes(), f'{self.base_url}page-1.html')
+        self.assertEqual(listing['next_url'], f'{self.base_url}page-2.html')
+        self.assertEqual(len(listing['items']), 10)
+        self.assertTrue(all(item['url'].startswith(self.base_url) for item in listing['items']))
+
+    def test_missing_fields_fall_back_the_same_way(self):
+        content = b'<html><body><div class="product_main"><h1>Only</h1></div></body></html>'
+        url = f'{self.base_url}only_1/index.html'
+        book = self.lxml.parse_book(content, url)
+        self.assertEqual(book, self.soup.parse_book(content, url))
+        self.assertEqual((book['genre'], book['price'], book['rating'], book['image_url']), ('General', 0.0, 0, None))
+
+
+def book_data(url, **values):
+    return dict({
+        'url': url,
+        'title': 'A Light in the Attic',
+        'isbn': 'a897fe39b1053632',
+        'genre': 'Poetry',
+        'price': 51.77,
+        'rating': 3,
+        'description': 'Poems',
+        'in_stock': True,
+        'availability': 'In stock (22 available)',
+    }, **values)
+
+
+class BookWriterTests(TestCase):
+    url = 'http://example.com/a-light-in-the-attic_1000/index.html'
+
+    def setUp(self):
+        self.writer = BookWriter()
+
+    def test_upsert_updates_the_existing_row(self):
+        self.assertEqual(self.writer.save([book_data(self.url)], skip_images=True), (1, 0))
+        self.assertEqual(self.writer.save([book_data(self.url, price=45.0)], skip_images=True), (0, 1))
+
+        book = Book.objects.get()
+        self.assertEqual(book.price, Decimal('45.00'))
+        self.assertEqual(book.genre.name, 'Poetry')
+
+    def test_repeated_upc_in_a_batch_keeps_one_row(self):
+        other_url = 'http://example.com/a-light-in-the-attic_1001/index.html'
+        self.writer.save([book_data(self.url), book_data(other_url)], skip_images=True)
+
+        self.assertEqual(list(Book.objects.values_list('source_url', flat=True)), [other_url])
+
+    def test_moved_book_follows_its_new_url(self):
+        self.writer.save([book_data(self.url)], skip_images=True)
+        book_id = Book.objects.get().id
+        new_url = 'http://example.com/a-light-in-the-attic_2000/index.html'
+
+        self.assertEqual(self.writer.save([book_data(new_url)], skip_images=True), (0, 1))
+        self.assertEqual(Book.objects.get().id, book_id)
+        self.assertEqual(Book.objects.get().source_url, new_url)
+
+    def test_upc_moves_to_a_url_that_already_has_a_row(self):
+        new_url = 'http://example.com/a-light-in-the-attic_2000/index.html'
+        self.writer.save([book_data(self.url), book_data(new_url, isbn='other')], skip_images=True)
+
+        self.assertEqual(self.writer.save([book_data(new_url)], skip_images=True), (0, 1))
+        self.assertEqual(
+            sorted(Book.objects.values_list('source_url', 'isbn')), [(self.url, None), (new_url, 'a897fe39b1053632')]
+        )
+
+    def test_records_only_changed_values(self):
+        self.writer.save([book_data(self.url)], skip_images=True)
+        self.writer.save([book_data(self.url, in_stock=False)], skip_images=True)
+        self.writer.save([book_data(self.url, in_stock=False)], skip_images=True)
+
+        first, second = BookHistory.objects.order_by('id')
+        self.assertEqual((first.price, first.rating, first.in_stock), (Decimal('51.77'), 3, True))
+        self.assertEqual((second.price, second.rating, second.in_stock), (None, None, False))
+        self.assertEqual(self.writer.history_recorded, 2)
+
+    def test_reparse_keeps_price_rating_and_stock(self):
+        self.writer.save([book_data(self.url)], skip_images=True)
+        self.writer.save(
+            [book_data(self.url, title='Reparsed', price=10.0, rating=1, in_stock=False)], skip_images=True, reparse=True
+        )
+
+        book = Book.objects.get()
+        self.assertEqual(book.title, 'Reparsed')
+        self.assertEqual((book.price, book.rating, book.in_stock), (Decimal('51.77'), 3, True))
+        self.assertEqual(BookHistory.objects.count(), 1)
+
+    def test_refresh_from_listing(self):
+        self.writer.save([book_data(self.url, listing_fingerprint='v1')], skip_images=True)
+        other_url = 'http://example.com/tipping-the-velvet_999/index.html'
+
+        needs_details = self.writer.refresh_from_listing([
+            {'url': self.url, 'fingerprint': 'v1', 'price': 40.0, 'rating': 3, 'in_stock': True},
+            {'url': other_url, 'fingerprint': 'v1', 'price': 53.74, 'rating': 1, 'in_stock': True},
+        ])
+
+        self.assertEqual([(item['url'], item['revalidate']) for item in needs_details], [(other_url, False)])
+        self.assertEqual(Book.objects.get().price, Decimal('40.00'))
+        self.assertEqual(self.writer.listing_refreshed, 1)
+        self.assertEqual(BookHistory.objects.order_by('id').last().price, Decimal('40.00'))
+
+
+def make_image(width, height, color='red', image_format='JPEG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class CoverStoreTests(TestCase):
+    url = 'http://example.com/a-light-in-the-attic_1000/index.html'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        self.store = CoverStore()
+
+        self.writer = BookWriter()
+        patcher = mock.patch.object(self.writer.derivatives, 'submit')
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def save(self, content):
+        self.writer.save([book_data(self.url, image_content=content, image_filename='cover.JPG')])
+        return Book.objects.get()
+
+    def test_names_come_from_the_content(self):
+        content = make_image(10, 10)
+        digest = content_hash(content)
+        name, saved_digest = self.store.save(content, 'cover.JPG')
+        self.assertEqual(saved_digest, digest)
+        self.assertEqual(name, f'book_covers/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+
+        self.assertEqual(self.store.save(content, 'other.jpg')[0], name)
+        self.assertEqual(list(self.store.iter_files()), [name])
+
+    def test_unchanged_cover_is_not_stored_again(self):
+        content = make_image(10, 10)
+        book = self.save(content)
+        self.assertEqual(book.image_hash, content_hash(content))
+        self.assertEqual(self.writer.images_stored, 1)
+
+        self.save(content)
+        self.assertEqual((self.writer.images_stored, self.writer.images_unchanged), (1, 1))
+        self.assertEqual(self.submit.call_count, 1)
+
+        book = self.save(make_image(10, 10, 'blue'))
+        self.assertEqual(book.image_hash, content_hash(make_image(10, 10, 'blue')))
+        self.assertEqual(len(list(self.store.iter_files())), 2)
+
+    def test_gc_deletes_old_orphans_only(self):
+        kept = self.save(make_image(10, 10)).image.name
+        Book.objects.update(image_derivatives={'card': {'width': 10, 'height': 10, 'webp': 'book_covers/aa/aa/kept_card.webp'}})
+        names = ['book_covers/aa/aa/kept_card.webp', 'book_covers/bb/bb/old.jpg', 'book_covers/cc/cc/new.jpg']
+        for name in names:
+            self.store.storage.save(name, ContentFile(b'cover'))
+        hour_ago = time.time() - 3600
+        for name in [kept] + names[:2]:
+            os.utime(self.store.storage.path(name), (hour_ago, hour_ago))
+
+        output = io.StringIO()
+        call_command('gc_covers', '--dry-run', '--min-age', '30', stdout=output)
+        self.assertIn('book_covers/bb/bb/old.jpg', output.getvalue())
+        self.assertEqual(len(list(self.store.iter_files())), 4)
+
+        call_command('gc_covers', '--min-age', '30', stdout=io.StringIO())
+        self.assertEqual(sorted(self.store.iter_files()), sorted([kept, names[0], names[2]]))
+
+
+class UpcMergeMigrationTests(TransactionTestCase):
+    def setUp(self):
+        # Rows the constraint now forbids are what the migration cleans up
+        constraint = next(constraint for constraint in Book._meta.constraints if constraint.name == 'unique_book_isbn')
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Book, constraint)
+        self.addCleanup(self.restore_constraint, constraint)
+
+    def restore_constraint(self, constraint):
+        Book.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(Book, constraint)
+
+    def test_duplicates_merge_into_the_latest_row(self):
+        older, newer, other = Book.objects.bulk_create([
+            Book(title='Older', isbn='upc1', source_url='http://example.com/older/index.html'),
+            Book(title='Newer', isbn='upc1', source_url='http://example.com/newer/index.html'),
+            Book(title='Other', isbn='', source_url='http://example.com/other/index.html'),
+        ])
+        Book.objects.filter(id=older.id).update(updated_at=timezone.now() - timedelta(days=1))
+        ann, bob = (
+            get_user_model().objects.create_user(username=name, email=f'{name}@example.com') for name in ('ann', 'bob')
+        )
+        Favorite.objects.bulk_create([
+            Favorite(user=ann, book=older), Favorite(user=bob, book=older), Favorite(user=bob, book=newer),
+        ])
+
+        import_module('scraper.migrations.0012_book_unique_isbn').deduplicate_isbns(apps, None)
+
+        self.assertEqual(sorted(Book.objects.values_list('title', 'isbn')), [('Newer', 'upc1'), ('Other', None)])
+        self.assertEqual(
+            sorted(Favorite.objects.values_list('user__username', 'book__title')), [('ann', 'Newer'), ('bob', 'Newer')]
+        )
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        self.scraper = BookScraper(rate=0)
+        self.addCleanup(self.scraper.close)
+        self.writer = BookWriter()
+
+    def books(self, count):
+        return [
+            book_data(f'http://example.com/book_{number}/index.html', isbn=f'upc{number}', title=f'Book {number}')
+            for number in range(count)
+        ]
+
+    def test_batches_keep_their_size(self):
+        self.assertEqual([len(batch) for batch in iter_batches(range(7), 3)], [3, 3, 1])
+
+    def test_fetched_books_are_handed_out_when_cancelled(self):
+        def books():
+            yield from range(4)
+            raise ScrapeCancelled()
+
+        batches = iter_batches(books(), 3)
+        self.assertEqual(next(batches), [0, 1, 2])
+        self.assertEqual(next(batches), [3])
+        with self.assertRaises(ScrapeCancelled):
+            next(batches)
+
+    def test_each_batch_is_written_in_its_own_transaction(self):
+        record_history = self.writer.record_history
+        calls = []
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('history is down')
+            record_history(*args, **kwargs)
+
+        batches = []
+        with mock.patch.object(self.scraper, 'iter_books', return_value=iter(self.books(5))), \
+                mock.patch.object(self.writer, 'record_history', side_effect=fail_second_batch):
+            stats = run_crawl(
+                self.scraper, self.writer, CrawlFrontier(), batch_size=2, skip_images=True,
+                on_batch=lambda batch, stats: batches.append(len(batch))
+            )
+
+        # The failed batch left no rows behind, the ones around it were committed
+        self.assertEqual(
+            list(Book.objects.order_by('title').values_list('title', flat=True)), ['Book 0', 'Book 1', 'Book 4']
+        )
+        self.assertEqual(batches, [2, 1])
+        self.assertEqual((stats['books_created'], stats['errors_count']), (3, 2))
+        self.assertEqual(self.writer.rows_written, 3)
+
+
+class ReplayScrapeTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ReplayServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(
+            MEDIA_ROOT=os.path.join(directory.name, 'media'),
+            SCRAPER_CACHE_DIR=os.path.join(directory.name, 'cache'),
+            SCRAPER_ARCHIVE_DIR=os.path.join(directory.name, 'archive')
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def scrape(self, *args):
+        requests_before = self.server.requests
+        output = io.StringIO()
+        call_command(
+            'scrape_books', '--base-url', self.server.base_url, '--rate', '0', '--no-cache', '--skip-images',
+            *args, stdout=output
+        )
+        return output.getvalue(), self.server.requests - requests_before
+
+
+class ReplayServerTests(SimpleTestCase):
+    def test_serves_the_snapshot(self):
+        with ReplayServer() as server:
+            response = requests.get(f'{server.base_url}catalogue/page-1.html', timeout=5)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, (SNAPSHOT_DIR / 'catalogue' / 'page-1.html').read_bytes())
+            self.assertEqual(requests.get(f'{server.base_url}missing.html', timeout=5).status_code, 404)
+            self.assertEqual((server.requests, server.errors), (2, 0))
+
+    def test_injects_errors(self):
+        with ReplayServer(error_rate=1, error_status=429, retry_after=3) as server:
+            response = requests.get(f'{server.base_url}catalogue/page-1.html', timeout=5)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '3')
+            self.assertEqual(server.errors, 1)
+
+    def test_seeded_errors_repeat(self):
+        def statuses():
+            with ReplayServer(error_rate=0.5, seed=7) as server:
+                return [requests.get(f'{server.base_url}catalogue/page-1.html', timeout=5).status_code for _ in range(10)]
+
+        first = statuses()
+        self.assertEqual(first, statuses())
+        self.assertEqual(set(first), {200, 503})
+
+
+class FastRefreshTests(ReplayScrapeTestCase):
+    def test_fast_refresh_fetches_only_changed_details(self):
+        self.scrape()
+        self.assertEqual(Book.objects.count(), 20)
+
+        Book.objects.update(price=1)
+        Book.objects.filter(title='Olio').update(listing_fingerprint='stale')
+
+        output, fetched = self.scrape('--fast-refresh')
+        # Two listings, then the detail page and cover of the one book whose listing entry changed
+        self.assertEqual(fetched, 4)
+        self.assertIn('Refreshed from listings: 19', output)
+        self.assertFalse(Book.objects.filter(price=1).exists())
+        self.assertNotEqual(Book.objects.get(title='Olio').listing_fingerprint, 'stale')
+
+
+class FrontierTests(SimpleTestCase):
+    def test_pages_are_queued_once(self):
+        frontier = CrawlFrontier(['http://example.com/page-1.html'])
+        self.assertFalse(frontier.add_page('http://example.com/page-1.html#top'))
+        self.assertTrue(frontier.add_page('http://example.com/page-2.html'))
+        self.assertEqual(len(frontier), 2)
+        self.assertEqual(frontier.pop_page(), 'http://example.com/page-1.html')
+
+    def test_max_pages(self):
+        frontier = CrawlFrontier(max_pages=2)
+        added = [frontier.add_page(f'http://example.com/page-{number}.html') for number in range(1, 4)]
+        self.assertEqual(added, [True, True, False])
+        self.assertEqual(frontier.state['pages_added'], 2)
+
+    def test_links_followed(self):
+        categories = ['http://example.com/travel/index.html', 'http://example.com/page-2.html']
+        frontier = CrawlFrontier(['http://example.com/page-1.html'])
+        self.assertEqual(frontier.add_links('http://example.com/page-2.html', categories), ['http://example.com/page-2.html'])
+
+        frontier = CrawlFrontier(['http://example.com/page-1.html'], follow_categories=True)
+        self.assertEqual(frontier.add_links('http://example.com/page-2.html', categories), [
+            'http://example.com/page-2.html', 'http://example.com/travel/index.html'
+        ])
+
+        frontier = CrawlFrontier(follow_links=False)
+        self.assertEqual(frontier.add_links('http://example.com/page-2.html'), [])
+
+    def test_book_claimed_by_one_listing_only(self):
+        frontier = CrawlFrontier()
+        self.assertTrue(frontier.claim('http://example.com/book_1/index.html'))
+        self.assertFalse(frontier.claim('http://example.com/book_1/index.html'))
+        self.assertEqual(frontier.state['urls_seen'], 1)
+
+
+class DiscoveryTests(ReplayScrapeTestCase):
+    def test_follows_next_links_through_the_catalogue(self):
+        self.scrape()
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(ScrapingLog.objects.get().pages_done, 2)
+
+    def test_pages_limit(self):
+        self.scrape('--pages', '1')
+        self.assertEqual(Book.objects.count(), 10)
+
+
+class ResumeTests(ReplayScrapeTestCase):
+    def test_resume_fetches_only_what_was_left(self):
+        self.scrape('--pages', '1')
+        scraping_log = ScrapingLog.objects.get()
+        self.assertEqual(scraping_log.crawl_urls.filter(status='done').count(), 11)
+
+        # Interrupted after a book was fetched but before its batch was written,
+        # with the next listing page found but not read yet
+        unfinished = scraping_log.crawl_urls.filter(kind='detail').order_by('id').first()
+        unfinished.status = 'pending'
+        unfinished.save()
+        Book.objects.filter(source_url=unfinished.url).delete()
+        page_url = f'{self.server.base_url}catalogue/page-2.html'
+        CrawlUrl.objects.create(scraping_log=scraping_log, url=page_url, url_hash=url_key(page_url), kind='listing')
+        ScrapingLog.objects.filter(id=scraping_log.id).update(status='failed')
+
+        output, fetched = self.scrape('--resume', str(scraping_log.id))
+        self.assertIn(f'Resuming scraping #{scraping_log.id}', output)
+        # Page 2 with its books and covers, then the unfinished book and its cover
+        self.assertEqual(fetched, 1 + 10 * 2 + 2)
+        self.assertEqual(Book.objects.count(), 20)
+        scraping_log.refresh_from_db()
+        self.assertEqual(scraping_log.status, 'completed')
+        self.assertFalse(scraping_log.crawl_urls.exclude(status='done').exists())
+
+    def test_completed_run_cannot_be_resumed(self):
+        scraping_log = ScrapingLog.objects.create(status='completed')
+        with self.assertRaisesMessage(CommandError, 'has already completed'):
+            self.scrape('--resume', str(scraping_log.id))
+
+
+class CancellationTests(TestCase):
+    def setUp(self):
+        self.scraping_log = ScrapingLog.objects.create(status='running')
+
+    def test_token_follows_the_log_status(self):
+        token = CancellationToken(self.scraping_log.id, poll_interval=0)
+        self.assertFalse(token.poll())
+
+        ScrapingLog.objects.filter(id=self.scraping_log.id).update(status='interrupted')
+        self.assertTrue(token.poll())
+        with self.assertRaises(ScrapeCancelled):
+            token.raise_if_cancelled()
+
+    def test_stop_view_interrupts_running_logs(self):
+        ScrapingLog.objects.filter(id=self.scraping_log.id).update(pages_done=3)
+        admin = get_user_model().objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_login(admin)
+
+        response = self.client.post(reverse('stop-scraping'), HTTP_HOST='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.scraping_log.refresh_from_db()
+        self.assertEqual((self.scraping_log.status, self.scraping_log.pages_done), ('interrupted', 3))
+        self.assertIsNotNone(self.scraping_log.finished_at)
+
+        self.assertEqual(self.client.post(reverse('stop-scraping'), HTTP_HOST='127.0.0.1').status_code, 404)
+
+    def test_fetched_books_are_saved_before_stopping(self):
+        scraper = BookScraper(rate=0)
+        self.addCleanup(scraper.close)
+        books = [book_data(f'http://example.com/book_{number}/index.html', isbn=f'upc{number}') for number in range(5)]
+
+        with mock.patch.object(scraper, 'iter_books', return_value=iter(books)):
+            with self.assertRaises(ScrapeCancelled):
+                run_crawl(
+                    scraper, BookWriter(), CrawlFrontier(), batch_size=2, skip_images=True,
+                    on_batch=lambda batch, stats: scraper.cancel_token.cancel()
+                )
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_progress_is_added_to_the_log(self):
+        progress = ProgressReporter(self.scraping_log.id)
+        progress.add(pages_done=1, books_processed=10)
+        progress.flush(force=True)
+        progress.add(books_processed=5, errors_count=1)
+        # Not due yet
+        progress.flush()
+        self.scraping_log.refresh_from_db()
+        self.assertEqual((self.scraping_log.books_processed, self.scraping_log.errors_count), (10, 0))
+
+        progress.flush(force=True)
+        self.scraping_log.refresh_from_db()
+        self.assertEqual(
+            (self.scraping_log.pages_done, self.scraping_log.books_processed, self.scraping_log.errors_count), (1, 15, 1)
+        )
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.scraping_log = ScrapingLog.objects.create(status='running')
+        admin = get_user_model().objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_login(admin)
+        self.url = reverse('scraping-events', args=[self.scraping_log.id])
+
+    def events(self, response):
+        for chunk in response.streaming_content:
+            chunk = chunk.decode('utf-8')
+            if chunk.startswith(':'):
+                yield 'keep-alive', None
+                continue
+            event, data = chunk.strip().split('\n')
+            yield event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    def test_bus_delivers_to_subscribers_of_the_run(self):
+        bus = EventBus()
+        bus.publish(1, 'page')
+        subscription = bus.subscribe(1)
+        bus.publish(1, 'page', url='http://example.com/page-1.html')
+        bus.publish(2, 'page')
+
+        message = subscription.get(timeout=0)
+        self.assertEqual((message['event'], message['url']), ('page', 'http://example.com/page-1.html'))
+        self.assertIsNone(subscription.get(timeout=0))
+
+        subscription.close()
+        self.assertFalse(bus.has_subscribers(1))
+
+    def test_slow_subscriber_loses_the_oldest_events(self):
+        subscription = Subscription(EventBus(), 1, max_events=2)
+        for number in range(3):
+            subscription.put({'event': 'book', 'number': number})
+        self.assertEqual([subscription.get(timeout=0)['number'] for _ in range(2)], [1, 2])
+
+    def test_stream_relays_events_until_finished(self):
+        response = self.client.get(self.url, HTTP_HOST='127.0.0.1')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.events(response)
+        event, data = next(events)
+        self.assertEqual((event, data['status']), ('status', 'running'))
+
+        bus.publish(self.scraping_log.id, 'page', url='http://example.com/page-1.html', books=20)
+        bus.publish(self.scraping_log.id, 'finished', status='completed')
+        self.assertEqual([(event, data['status'] if event == 'finished' else data['books']) for event, data in events], [
+            ('page', 20), ('finished', 'completed')
+        ])
+        self.assertFalse(bus.has_subscribers(self.scraping_log.id))
+
+    def test_idle_stream_notices_a_run_finished_elsewhere(self):
+        with mock.patch.object(ScrapingEventsView, 'heartbeat_interval', 0.01):
+            events = self.events(self.client.get(self.url, HTTP_HOST='127.0.0.1'))
+            next(events)
+            self.assertEqual(next(events), ('keep-alive', None))
+
+            ScrapingLog.objects.filter(id=self.scraping_log.id).update(status='interrupted')
+            self.assertEqual([(event, data['status']) for event, data in events], [('finished', 'interrupted')])
+
+    def test_finished_run_sends_only_its_status(self):
+        ScrapingLog.objects.filter(id=self.scraping_log.id).update(status='completed')
+        events = list(self.events(self.client.get(self.url, HTTP_HOST='127.0.0.1')))
+        self.assertEqual([(event, data['status']) for event, data in events], [('status', 'completed')])
+
+    def test_unknown_run(self):
+        response = self.client.get(reverse('scraping-events', args=[self.scraping_log.id + 1]), HTTP_HOST='127.0.0.1')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(bus.has_subscribers(self.scraping_log.id + 1))
+
+
+class ParsePoolTests(ReplayScrapeTestCase):
+    def books(self):
+        return sorted(Book.objects.values_list('source_url', 'title', 'isbn', 'genre__name', 'price', 'rating', 'in_stock'))
+
+    def test_pool_parses_like_the_fetch_threads(self):
+        scraper = BookScraper(rate=0, parser='html.parser', parse_workers=1)
+        self.addCleanup(scraper.close)
+        url = f'{self.server.base_url}catalogue/olio_983/index.html'
+        content = (SNAPSHOT_DIR / 'catalogue' / 'olio_983' / 'index.html').read_bytes()
+        self.assertEqual(scraper.parse('parse_book', content, url), SoupBookParser().parse_book(content, url))
+
+    def test_scrape_with_parse_workers_stores_the_same_books(self):
+        self.scrape()
+        in_threads = self.books()
+        Book.objects.all().delete()
+
+        self.scrape('--parse-workers', '2')
+        self.assertEqual(len(in_threads), 20)
+        self.assertEqual(self.books(), in_threads)
+
+
+class ArchiveTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(SCRAPER_ARCHIVE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, pages, **kwargs):
+        archive = PageArchive(1, **kwargs)
+        for url, kind, content in pages:
+            archive.write(url, kind, content)
+        archive.close()
+        return archive
+
+    def test_record_keeps_the_body_intact(self):
+        content = b'<p>one</p>\r\n\r\n<p>two</p>'
+        record = build_record('http://example.com/page.html', content, '2026-10-18T00:00:00+00:00')
+        self.assertEqual(parse_record(record), content)
+
+    def test_pages_round_trip_across_segments(self):
+        pages = [
+            (f'http://example.com/book_{number}/index.html', 'detail', f'<h1>Book {number}</h1>'.encode() * 20)
+            for number in range(5)
+        ]
+        archive = self.write(pages + [('http://example.com/page-1.html', 'listing', b'<ol></ol>')], segment_size=300)
+        self.assertEqual(archive.pages, 6)
+        self.assertGreater(len([name for name in os.listdir(archive.directory) if name.endswith('.warc.gz')]), 1)
+
+        reader = ArchiveReader(1)
+        self.assertTrue(reader.exists())
+        self.assertEqual(
+            sorted((entry['url'], content) for entry, content in reader.iter_pages('detail')),
+            [(url, content) for url, _, content in pages]
+        )
+        listing, = reader.entries('listing')
+        self.assertEqual(reader.read(listing), b'<ol></ol>')
+
+    def test_latest_copy_of_a_page_wins(self):
+        url = 'http://example.com/book_1/index.html'
+        self.write([(url, 'detail', b'old')])
+        self.write([(url, 'detail', b'new')])
+
+        reader = ArchiveReader(1)
+        self.assertEqual([content for _, content in reader.iter_pages()], [b'new'])
+
+    def test_torn_index_line_is_skipped(self):
+        archive = self.write([('http://example.com/book_1/index.html', 'detail', b'kept')])
+        with open(os.path.join(archive.directory, f'{archive.writer_id}.idx'), 'a', encoding='utf-8') as index_file:
+            index_file.write('{"url": "http://exam')
+        self.assertEqual([content for _, content in ArchiveReader(1).iter_pages()], [b'kept'])
+
+
+class ReparseTests(ReplayScrapeTestCase):
+    def test_reparse_from_the_archive_without_fetching(self):
+        self.scrape('--archive')
+        scraping_log = ScrapingLog.objects.get()
+        Book.objects.update(title='Stale', price=1)
+        requests_before = self.server.requests
+
+        output = io.StringIO()
+        call_command('reparse_books', '--from-archive', str(scraping_log.id), stdout=output)
+        self.assertIn('Reparsed 20 pages', output.getvalue())
+        self.assertEqual(self.server.requests, requests_before)
+        self.assertFalse(Book.objects.filter(title='Stale').exists())
+        # Prices may have changed since the pages were archived
+        self.assertEqual(Book.objects.filter(price=1).count(), 20)
+
+    def test_run_without_archive(self):
+        scraping_log = ScrapingLog.objects.create()
+        with self.assertRaisesMessage(CommandError, 'has no archive'):
+            call_command('reparse_books', '--from-archive', str(scraping_log.id), stdout=io.StringIO())
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(Book(title=f'Book {number}') for number in range(7))
+        # Ties on created_at are broken by the primary key
+        Book.objects.update(created_at=timezone.now())
+        cls.ids = list(Book.objects.order_by('-id').values_list('id', flat=True))
+
+    def paginate(self, url):
+        request = Request(APIRequestFactory().get(url))
+        paginator = KeysetPagination()
+        rows = paginator.paginate_queryset(Book.objects.all(), request)
+        return [book.id for book in rows], paginator.get_paginated_response([]).data
+
+    def test_walks_forward_and_back(self):
+        first, data = self.paginate('/books/?page_size=3')
+        self.assertEqual(first, self.ids[:3])
+        self.assertIsNone(data['previous'])
+
+        second, data = self.paginate(data['next'])
+        self.assertEqual(second, self.ids[3:6])
+
+        last, data = self.paginate(data['next'])
+        self.assertEqual(last, self.ids[6:])
+        self.assertIsNone(data['next'])
+
+        back, data = self.paginate(data['previous'])
+        self.assertEqual(back, self.ids[3:6])
+        back, data = self.paginate(data['previous'])
+        self.assertEqual(back, self.ids[:3])
+        self.assertIsNone(data['previous'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'eyJ2IjogWzFdLCAiciI6IDB9'):
+            with self.assertRaises(NotFound):
+                self.paginate(f'/books/?cursor={cursor}')
+
+    def test_limit_alias_and_cap(self):
+        self.assertEqual(len(self.paginate('/books/?limit=2')[0]), 2)
+        self.assertEqual(self.paginate('/books/?page_size=2&limit=5')[0], self.ids[:2])
+        self.assertEqual(len(self.paginate('/books/?page_size=1000')[0]), 7)
+
+    def test_count_is_opt_in(self):
+        self.assertNotIn('count', self.paginate('/books/')[1])
+        self.assertEqual(self.paginate('/books/?count=1')[1]['count'], 7)
+
+    def test_search_total_is_opt_in(self):
+        url = reverse('book-search')
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'title': 'book'}, HTTP_HOST='127.0.0.1').json()
+        self.assertNotIn('total_found', data)
+        self.assertEqual(len(data['books']), 7)
+
+        data = self.client.get(url, {'title': 'book', 'count': 'true'}, HTTP_HOST='127.0.0.1').json()
+        self.assertEqual(data['total_found'], 7)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.books = Book.objects.bulk_create(Book(title=f'Book {number}') for number in range(4))
+        ann, bob, cat = (
+            get_user_model().objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('ann', 'bob', 'cat')
+        )
+        # ann: 0, 1; bob: 0, 1, 2; cat: 2, 3
+        for user, numbers in ((ann, (0, 1)), (bob, (0, 1, 2)), (cat, (2, 3))):
+            for number in numbers:
+                Favorite.objects.create(user=user, book=self.books[number])
+        self.ids = [book.id for book in self.books]
+
+    def neighbors(self, number):
+        return [
+            (self.ids.index(neighbor_id), round(score, 3))
+            for neighbor_id, score in BookNeighbor.objects.filter(book=self.books[number]).values_list('neighbor_id', 'score')
+        ]
+
+    def test_top_neighbors(self):
+        book_ids, matrix = recommendations.favorites_matrix()
+        norms = np.sqrt(np.asarray(matrix.sum(axis=1)).ravel())
+        normalized = sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+        rows, present = recommendations.matrix_rows(book_ids, np.array(self.ids))
+        self.assertTrue(present.all())
+
+        first, third = recommendations.top_neighbors(book_ids, normalized, rows[[0, 2]], k=2)
+        self.assertEqual([(self.ids.index(book_id), round(score, 3)) for book_id, score in first], [(1, 1.0), (2, 0.5)])
+        # Ties come in no particular order
+        self.assertEqual([(self.ids.index(book_id), round(score, 3)) for book_id, score in third[:1]], [(3, 0.707)])
+        self.assertEqual(round(third[1][1], 3), 0.5)
+
+    def test_affected_books(self):
+        book_ids, matrix = recommendations.favorites_matrix()
+        affected = recommendations.affected_books(book_ids, matrix, np.array([self.ids[3]]))
+        self.assertEqual(sorted(affected.tolist()), [self.ids[2], self.ids[3]])
+
+        # Books that list a changed book are affected even without shared users
+        BookNeighbor.objects.create(book=self.books[0], neighbor=self.books[3], score=0.1)
+        affected = recommendations.affected_books(book_ids, matrix, np.array([self.ids[3]]))
+        self.assertEqual(sorted(affected.tolist()), [self.ids[0], self.ids[2], self.ids[3]])
+
+    def test_refresh_neighbors(self):
+        self.assertEqual(recommendations.refresh_neighbors(), (4, 8))
+        self.assertEqual(self.neighbors(0), [(1, 1.0), (2, 0.5)])
+        self.assertEqual(self.neighbors(3), [(2, 0.707)])
+        self.assertFalse(Book.objects.filter(neighbors_stale_since__isnull=False).exists())
+
+    def test_incremental_refresh(self):
+        recommendations.refresh_neighbors()
+        Favorite.objects.filter(book=self.books[3]).delete()
+        self.assertTrue(Book.objects.get(id=self.ids[3]).neighbors_stale_since)
+
+        self.assertEqual(recommendations.refresh_neighbors(changed_ids=[self.ids[3]])[0], 2)
+        self.assertEqual(self.neighbors(3), [])
+        self.assertCountEqual(self.neighbors(2), [(0, 0.5), (1, 0.5)])
+        self.assertIsNone(Book.objects.get(id=self.ids[3]).neighbors_stale_since)
+
+    def test_recommended_strategies(self):
+        recommendations.refresh_neighbors()
+        book_sampler.clear()
+        self.client.force_login(get_user_model().objects.get(username='ann'))
+        url = reverse('recommended_books')
+
+        response = self.client.get(url, {'count': 4})
+        self.assertEqual(response.data['strategy'], 'random')
+        self.assertEqual(response.data['total_count'], 4)
+
+        response = self.client.get(url, {'strategy': 'similar'})
+        self.assertEqual(response.data['strategy'], 'favorites')
+        self.assertEqual([book['id'] for book in response.data['results']], [self.ids[2]])
+
+        # Ranked once, later requests only fetch the sampled books after the session and user
+        with self.assertNumQueries(3):
+            self.client.get(url, {'strategy': 'similar'})
+
+        # Favorited since the pool was ranked
+        Favorite.objects.create(user=response.wsgi_request.user, book=self.books[2])
+        response = self.client.get(url, {'strategy': 'similar'})
+        self.assertEqual(response.data['strategy'], 'random')
+
+        self.assertEqual(self.client.get(url, {'strategy': 'nearest'}).status_code, 400)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs generate_series and LATERAL')
+class AveragePricesTests(TestCase):
+    def test_carries_prices_forward(self):
+        poetry = Genre.objects.create(name='Poetry')
+        first, second = Book.objects.bulk_create(Book(title=title, genre=poetry) for title in ('First', 'Second'))
+        now = timezone.now()
+        BookHistory.objects.bulk_create([
+            BookHistory(book=first, recorded_at=now - timedelta(days=10), price=10),
+            BookHistory(book=second, recorded_at=now - timedelta(days=1), price=20),
+            BookHistory(book=first, recorded_at=now, rating=4),
+            BookHistory(book=first, recorded_at=now, price=30),
+        ])
+
+        rows = average_prices(Book.objects.all(), now - timedelta(days=2), 'day')
+        self.assertEqual(
+            [(row['average_price'], row['books'], row['price_changes']) for row in rows],
+            [(Decimal('10.00'), 1, 0), (Decimal('15.00'), 2, 1), (Decimal('25.00'), 2, 1)]
+        )
+        self.assertEqual({row['genre'] for row in rows}, {'Poetry'})
+
+
+
+class HistoryStatsViewTests(SimpleTestCase):
+    def test_days_out_of_range(self):
+        for days in ('0', '-5', '731', str(10 ** 9)):
+            response = self.client.get(reverse('book-history-stats'), {'days': days}, HTTP_HOST='127.0.0.1')
+            self.assertEqual(response.status_code, 400, days)
+
+
+class BookSamplerTests(TestCase):
+    def setUp(self):
+        Book.objects.bulk_create(Book(title=f'Book {number}') for number in range(10))
+        self.sampler = BookSampler()
+
+    def test_pool_is_reused_until_the_catalogue_changes(self):
+        with self.assertNumQueries(1):
+            self.sampler.ids('all', Book.objects.all())
+            self.sampler.ids('all', Book.objects.all())
+
+        Book.objects.create(title='New')
+        self.assertEqual(len(self.sampler.ids('all', Book.objects.all())), 11)
+
+    def test_sample_skips_deleted_books(self):
+        self.sampler.ids('all', Book.objects.all())
+        # Deleted by a process that bumps a cache this one does not see
+        with mock.patch('scraper.signals.bump_catalogue_version'):
+            Book.objects.filter(title__in=['Book 0', 'Book 1']).delete()
+
+        books, total = self.sampler.sample('all', Book.objects.all(), 4)
+        self.assertEqual(len(books), 4)
+        self.assertEqual(len({book.id for book in books}), 4)
+        self.assertEqual(total, 10)
+
+    def test_least_recently_used_pool_is_evicted(self):
+        sampler = BookSampler(maxsize=2)
+        for key in ('a', 'b', 'a', 'c'):
+            sampler.ids(key, Book.objects.all())
+        self.assertEqual(list(sampler.pools), ['a', 'c'])
+
+
+class DerivativeTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.store = CoverStore(FileSystemStorage(location=media.name, base_url='/media/'))
+
+    def test_renders_each_size_and_format(self):
+        rendered = {
+            (size, image_format): (width, height)
+            for size, image_format, width, height, _ in render_derivatives(make_image(800, 1200))
+        }
+        self.assertEqual(rendered[('thumb', 'webp')], (120, 180))
+        self.assertEqual(rendered[('card', 'jpeg')], (320, 480))
+        self.assertEqual(rendered[('full', 'jpeg')], (800, 1200))
+
+        # Small covers are never enlarged
+        small = render_derivatives(make_image(100, 150, image_format='PNG'))
+        self.assertEqual({(width, height) for _, _, width, height, _ in small}, {(100, 150)})
+
+    def test_pending_renders_are_capped(self):
+        builder = DerivativeBuilder(self.store, workers=1, max_pending=2)
+        self.addCleanup(builder.close)
+        covers = [make_image(400, 600, color) for color in ('red', 'green', 'blue', 'white', 'black')]
+        for content in covers:
+            builder.submit(content_hash(content), content)
+            self.assertLessEqual(len(builder.pending), 2)
+
+        finished = builder.collect(wait=True)
+        self.assertEqual(finished.keys(), {content_hash(content) for content in covers})
+        digest = content_hash(covers[0])
+        self.assertEqual(finished[digest]['card']['width'], 320)
+        self.assertTrue(self.store.storage.exists(finished[digest]['card']['webp']))
+
+    def test_broken_cover_is_skipped(self):
+        builder = DerivativeBuilder(self.store, workers=1)
+        self.addCleanup(builder.close)
+        builder.submit('broken', b'not an image')
+        with self.assertLogs('scraper.covers', 'WARNING'):
+            self.assertEqual(builder.collect(wait=True), {})
+
+    def test_list_serializer_serves_the_card(self):
+        book = Book(id=1, title='Covered', image='book_covers/ab/cd/abcd.jpg', image_derivatives={
+            'card': {'width': 320, 'height': 480, 'jpeg': 'book_covers/ab/cd/abcd_card.jpg'},
+        })
+        self.assertEqual(BookListSerializer(book).data['image_url'], '/media/book_covers/ab/cd/abcd_card.jpg')
+
+        book.image_derivatives = {}
+        self.assertEqual(BookListSerializer(book).data['image_url'], '/media/book_covers/ab/cd/abcd.jpg')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs full-text search')
+class SearchTests(TestCase):
+    def setUp(self):
+        fantasy = Genre.objects.create(name='Fantasy')
+        dragons = Genre.objects.create(name='Dragons')
+        Book.objects.bulk_create([
+            Book(title='Dragon Tales', description='Stories for the road', genre=fantasy),
+            Book(title='The Long Night', description='A dragon wakes under the mountain', genre=fantasy),
+            Book(title='Scales and Wings', description='A field guide', genre=dragons),
+            Book(title='Unrelated', description='Nothing to see', genre=fantasy),
+        ])
+
+    def titles(self, text):
+        return list(search_books(Book.objects.all(), text).values_list('title', flat=True))
+
+    def test_title_outranks_description_and_genre(self):
+        self.assertEqual(self.titles('dragons'), ['Dragon Tales', 'The Long Night', 'Scales and Wings'])
+
+    def test_websearch_syntax(self):
+        self.assertCountEqual(self.titles('dragon -tales'), ['The Long Night', 'Scales and Wings'])
+        self.assertEqual(self.titles('"field guide"'), ['Scales and Wings'])
+
+    def test_vector_follows_edits(self):
+        Book.objects.filter(title='Unrelated').update(title='Wyvern Watch')
+        self.assertEqual(self.titles('wyvern'), ['Wyvern Watch'])
+
+        Genre.objects.filter(name='Fantasy').update(name='Myth')
+        self.assertEqual(len(self.titles('myth')), 3)
+        self.assertEqual(self.titles('fantasy'), [])
+
+    def test_search_view_pages_in_rank_order(self):
+        url = reverse('book-search')
+        data = self.client.get(url, {'search': 'dragon', 'page_size': 2}, HTTP_HOST='127.0.0.1').json()
+        titles = [book['title'] for book in data['results']]
+        data = self.client.get(data['next'], HTTP_HOST='127.0.0.1').json()
+        titles += [book['title'] for book in data['results']]
+
+        self.assertEqual(titles, ['Dragon Tales', 'The Long Night', 'Scales and Wings'])
+        self.assertIsNone(data['next'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs pg_trgm')
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        poetry = Genre.objects.create(name='Poetry')
+        travel = Genre.objects.create(name='Travel')
+        Book.objects.bulk_create([
+            Book(title='A Light in the Attic', genre=poetry),
+            Book(title='The Attic Poems', genre=poetry),
+            *(Book(title=f'Collected Verse {number}', genre=poetry) for number in range(10)),
+            Book(title='Atlas of Remote Islands', genre=travel),
+        ])
+
+    def setUp(self):
+        suggest_cache.clear()
+
+    def test_ranks_titles_and_tolerates_typos(self):
+        titles = [book['title'] for book in suggest_books('attic')]
+        self.assertEqual(set(titles[:2]), {'A Light in the Attic', 'The Attic Poems'})
+        self.assertIn('A Light in the Attic', [book['title'] for book in suggest_books('atic')])
+
+    def test_genre_books_only_fill_remaining_slots(self):
+        with self.assertNumQueries(3):
+            results = suggest_books('poetry', limit=4)
+        self.assertEqual(len(results), 4)
+        self.assertEqual({book['genre'] for book in results}, {'Poetry'})
+
+        suggest_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(suggest_books('collected verse', limit=4)), 4)
+
+    def test_results_are_cached(self):
+        suggest_books('Attic')
+        with self.assertNumQueries(0):
+            suggest_books('  attic ')
+
+
+class MetricsTests(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_views_record_latency_and_queries(self):
+        labels = {'view': 'BookListView', 'method': 'GET'}
+        requests_before = self.sample('api_request_seconds_count', status='200', **labels)
+        queries_before = self.sample('api_sql_queries_sum', **labels)
+
+        self.client.get(reverse('all-books'), HTTP_HOST='127.0.0.1')
+        self.assertEqual(self.sample('api_request_seconds_count', status='200', **labels), requests_before + 1)
+        self.assertGreater(self.sample('api_sql_queries_sum', **labels), queries_before)
+
+    def test_metrics_are_only_served_to_allowed_networks(self):
+        response = self.client.get(reverse('metrics'), HTTP_HOST='127.0.0.1', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'api_request_seconds', response.content)
+
+        for address in ('203.0.113.7', '::ffff:203.0.113.7', 'unknown'):
+            response = self.client.get(
+                reverse('metrics'), HTTP_HOST='127.0.0.1', REMOTE_ADDR=address, HTTP_X_FORWARDED_FOR='127.0.0.1'
+            )
+            self.assertEqual(response.status_code, 403, address)
+
+        with self.settings(METRICS_ALLOWED_NETWORKS=['203.0.113.0/24']):
+            response = self.client.get(reverse('metrics'), HTTP_HOST='127.0.0.1', REMOTE_ADDR='203.0.113.7')
+            self.assertEqual(response.status_code, 200)
+
+
+class ShardTests(TestCase):
+    listings = [
+        ('http://example.com/catalogue/page-1.html', [{'url': 'http://example.com/book_1/index.html'}]),
+        ('http://example.com/catalogue/page-2.html', None),
+    ]
+
+    def setUp(self):
+        self.scraping_log = ScrapingLog.objects.create()
+
+    def test_split_shards_round_robin(self):
+        self.assertEqual(split_shards(list(range(7)), 3), [[0, 3, 6], [1, 4], [2, 5]])
+        self.assertEqual(split_shards([0, 1], 4), [[0], [1]])
+
+    def test_shard_adds_its_progress_to_the_parent_log(self):
+        stats = {'total_books_found': 3, 'books_created': 2, 'books_updated': 1, 'errors_count': 0}
+
+        def run_crawl(scraper, writer, frontier, on_batch=None, listings=(), **kwargs):
+            self.assertEqual(frontier.pop_page(), self.listings[1][0])
+            self.assertEqual(listings, self.listings[:1])
+            on_batch([], stats)
+            return stats
+
+        with mock.patch('scraper.tasks.run_crawl', side_effect=run_crawl):
+            result = scrape_shard_task.apply(args=(self.scraping_log.id, 0, self.listings)).get()
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['pages'], 2)
+        self.scraping_log.refresh_from_db()
+        self.assertEqual((self.scraping_log.books_created, self.scraping_log.books_updated), (2, 1))
+
+    def test_shard_that_cannot_start_still_returns_a_result(self):
+        result = scrape_shard_task.apply(args=(self.scraping_log.id + 1, 1, self.listings)).get()
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['rows_written'], 0)
+
+    def test_aggregate_sums_shards_and_finishes_the_log(self):
+        results = [
+            {'shard': 1, 'status': 'failed', 'error': 'boom', 'books_created': 1, 'errors_count': 2},
+            {'shard': 0, 'status': 'completed', 'total_books_found': 5, 'books_created': 4, 'books_updated': 1},
+        ]
+        aggregate_scrape_results(results, self.scraping_log.id)
+
+        self.scraping_log.refresh_from_db()
+        self.assertEqual(self.scraping_log.status, 'completed')
+        self.assertEqual((self.scraping_log.books_created, self.scraping_log.errors_count), (5, 2))
+        self.assertEqual(self.scraping_log.error_message, 'shard 1: boom')
+        self.assertEqual([result['shard'] for result in self.scraping_log.shard_stats], [0, 1])
+        self.assertIsNotNone(self.scraping_log.finished_at)
+
+    def test_aggregate_fails_the_log_when_every_shard_failed(self):
+        aggregate_scrape_results([{'shard': 0, 'status': 'failed', 'error': 'boom'}], self.scraping_log.id)
+        self.scraping_log.refresh_from_db()
+        self.assertEqual(self.scraping_log.status, 'failed')
+
+    def test_start_refuses_shards_with_resume(self):
+        self.scraping_log.status = 'failed'
+        self.scraping_log.save()
+        admin = get_user_model().objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_login(admin)
+
+        response = self.client.post(
+            reverse('start-scraping'), {'resume': self.scraping_log.id, 'shards': 2}, HTTP_HOST='127.0.0.1'
+        )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate) if rate else 0.0
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class HostLimiter:
+    def __init__(self, concurrency, rate=None):
+        self.concurrency = max(1, int(concurrency))
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.semaphores = defaultdict(lambda: threading.BoundedSemaphore(self.concurrency))
+        self.buckets = defaultdict(lambda: TokenBucket(self.rate))
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc
+
+        with self.lock:
+            semaphore = self.semaphores[host]
+            bucket = self.buckets[host]
+
+        bucket.acquire()
+        with semaphore:
+            yield
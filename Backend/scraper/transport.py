@@ -0,0 +1,125 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    # One pool per host, big enough that no worker waits for a free connection
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # "Full jitter": spreads retries of many workers instead of synchronising them
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0, max_timeout=120.0, on_open=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.on_open = on_open
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _host(self, host):
+        return self.hosts.setdefault(host, {
+            'state': self.CLOSED,
+            'failures': 0,
+            'opened': 0,
+            'open_until': 0.0,
+            'probe': None,
+        })
+
+    def state(self, host):
+        with self.lock:
+            return self._host(host)['state']
+
+    def acquire(self, host):
+        # Returns how long the caller has to wait before sending a request to host
+        with self.lock:
+            circuit = self._host(host)
+            if circuit['state'] == self.CLOSED:
+                return 0.0
+
+            now = time.monotonic()
+            if circuit['state'] == self.OPEN:
+                if now < circuit['open_until']:
+                    return circuit['open_until'] - now
+                circuit['state'] = self.HALF_OPEN
+
+            # Let a single probe through, everybody else keeps waiting for its result
+            if circuit['probe'] is None:
+                circuit['probe'] = threading.get_ident()
+                return 0.0
+            return 0.25
+
+    def release(self, host):
+        # Called once the request is over, whatever its outcome: a probe that
+        # ended without recording one hands the slot to the next caller
+        with self.lock:
+            circuit = self._host(host)
+            if circuit['probe'] == threading.get_ident():
+                circuit['probe'] = None
+
+    def record_success(self, host):
+        with self.lock:
+            circuit = self._host(host)
+            if circuit['state'] != self.CLOSED:
+                logger.info(f"Circuit for {host} closed")
+            circuit.update(state=self.CLOSED, failures=0, opened=0, probe=None)
+
+    def record_failure(self, host, retry_after=None):
+        with self.lock:
+            circuit = self._host(host)
+            circuit['failures'] += 1
+            if circuit['probe'] == threading.get_ident():
+                circuit['probe'] = None
+            if circuit['state'] == self.OPEN:
+                return
+            if retry_after is None and circuit['state'] == self.CLOSED and circuit['failures'] < self.failure_threshold:
+                return
+
+            # Each consecutive trip doubles the pause unless the server said how long to wait
+            timeout = min(self.max_timeout, self.reset_timeout * 2 ** circuit['opened'])
+            if retry_after is not None:
+                timeout = min(self.max_timeout, retry_after)
+            circuit.update(state=self.OPEN, opened=circuit['opened'] + 1, open_until=time.monotonic() + timeout)
+
+        logger.warning(f"Circuit for {host} opened for {timeout:.1f}s after {circuit['failures']} failures")
+        if self.on_open:
+            self.on_open(host)
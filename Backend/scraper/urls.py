@@ -6,6 +6,7 @@ urlpatterns = [
     path('start/', views.StartScrapingView.as_view(), name='start-scraping'),
     path('status/', views.ScrapingStatusView.as_view(), name='scraping-status'),
     path('status/<int:scraping_id>/', views.ScrapingStatusView.as_view(), name='scraping-status-detail'),
+    path('status/<int:scraping_id>/events/', views.ScrapingEventsView.as_view(), name='scraping-events'),
     path('stop/', views.StopScrapingView.as_view(), name='stop-scraping'),
     # path('stats/', views.ScrapingStatsView.as_view(), name='scraping-stats'),
     path('book_list/', views.BookListView.as_view(), name='all-books'),
@@ -15,7 +16,10 @@ urlpatterns = [
     path('book_update/<int:pk>/', views.BookUpdateView.as_view(), name='update-books'),
     path('book_delete/<int:pk>/', views.BookDeleteView.as_view(), name='delete_books'),
     path('book_search/', views.BookSearchView.as_view(), name='book-search'),
+    path('book_suggest/', views.BookSuggestView.as_view(), name='book-suggest'),
     path('book_stats/', views.BookStatsView.as_view(), name='book-stats'),
+    path('book_history/<int:book_id>/', views.BookHistoryView.as_view(), name='book-history'),
+    path('book_history_stats/', views.BookHistoryStatsView.as_view(), name='book-history-stats'),
     path('book_favorites/', views.FavoriteListView.as_view(), name='favorite-list'),
     path('book_favorites_add/', views.FavoriteCreateView.as_view(), name='favorite-create'),
     path('book_favorites_remove/<int:book_id>/', views.FavoriteRemoveByBookView.as_view(), name='favorite-remove-by-book'),
@@ -1,13 +1,16 @@
 import io
+import json
 import threading
-import random
 from contextlib import redirect_stdout, redirect_stderr
+from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management import call_command
 from django.utils import timezone
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.db.models import Q
-from django.db.models import Count
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
 
 from rest_framework import status, filters
 from rest_framework.views import APIView
@@ -26,6 +29,7 @@ from rest_framework.mixins import (
     DestroyModelMixin
 )
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.permissions import IsAdminUser
 from rest_framework import status, permissions
 from rest_framework.permissions import IsAuthenticated
@@ -33,8 +37,15 @@ from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import rest_framework as django_filters
 
-from .models import Book, ScrapingLog, Favorite, Genre
+from .models import Book, BookHistory, BookNeighbor, ScrapingLog, Favorite, Genre
 from .serializers import BookListSerializer, BookSerializer, ScrapingLogSerializer, FavoriteListSerializer, FavoriteCreateSerializer
+from .tasks import check_shard_backend, scrape_books_task
+from .events import bus, format_event
+from .metrics import MetricsMixin
+from .history import TRACKED_FIELDS, average_prices, record_book_change, tracked_values
+from .search import search_books, suggest_books
+from .sampling import book_sampler
+from .pagination import KeysetPagination
 
 
 class BookFilter(django_filters.FilterSet):
@@ -50,6 +61,11 @@ class BookFilter(django_filters.FilterSet):
         help_text="Searching by book's name"
     )
     
+    isbn = django_filters.CharFilter(
+        field_name='isbn',
+        help_text="Exact UPC/ISBN"
+    )
+    
     search = django_filters.CharFilter(
         method='filter_search',
         help_text="General search"
@@ -57,13 +73,10 @@ class BookFilter(django_filters.FilterSet):
     
     class Meta:
         model = Book
-        fields = ['genre', 'title', 'search']
+        fields = ['genre', 'title', 'isbn', 'search']
     
     def filter_search(self, queryset, name, value):
-        return queryset.filter(
-            Q(title__icontains=value) | 
-            Q(description__icontains=value)
-        )
+        return search_books(queryset, value)
 
 
 class AdminRequiredMixin:
@@ -71,20 +84,20 @@ class AdminRequiredMixin:
 
 
 class BookQuerysetMixin:
-    queryset = Book.objects.all()
+    queryset = Book.objects.defer('search_vector')
     
+    # ?search= goes through BookFilter's full-text search
     filter_backends = [
         DjangoFilterBackend, 
-        filters.SearchFilter, 
         filters.OrderingFilter
     ]
     filterset_class = BookFilter
-    search_fields = ['title', 'description', 'genre', 'image']
     ordering_fields = ['title', 'created_at']
     ordering = ['-created_at']  
 
-class FavoriteListView(ListAPIView):
+class FavoriteListView(MetricsMixin, ListAPIView):
     serializer_class = FavoriteListSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
@@ -118,13 +131,6 @@ class FavoriteListView(ListAPIView):
     
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        page = self.paginate_queryset(queryset)
-        
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
         
         active_filters = {}
         for param in ['genre', 'title', 'rating', 'search']:
@@ -132,6 +138,15 @@ class FavoriteListView(ListAPIView):
             if value:
                 active_filters[param] = value
         
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+            response.data['active_filters'] = active_filters
+            return response
+        
+        serializer = self.get_serializer(queryset, many=True)
+        
         response_data = {
             'count': queryset.count(),
             'active_filters': active_filters,
@@ -140,7 +155,7 @@ class FavoriteListView(ListAPIView):
         
         return Response(response_data)
 
-class FavoriteCreateView(APIView):
+class FavoriteCreateView(MetricsMixin, APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, *args, **kwargs):
@@ -160,7 +175,7 @@ class FavoriteCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class FavoriteRemoveByBookView(APIView):
+class FavoriteRemoveByBookView(MetricsMixin, APIView):
     permission_classes = [IsAuthenticated]
     
     def delete(self, request, book_id, *args, **kwargs):
@@ -179,7 +194,7 @@ class FavoriteRemoveByBookView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class FavoriteToggleView(APIView):
+class FavoriteToggleView(MetricsMixin, APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, book_id, *args, **kwargs):
@@ -216,8 +231,9 @@ class FavoriteToggleView(APIView):
             )
 
 
-class BookListView(BookQuerysetMixin, ListAPIView):
+class BookListView(MetricsMixin, BookQuerysetMixin, ListAPIView):
     serializer_class = BookListSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -240,29 +256,28 @@ class BookListView(BookQuerysetMixin, ListAPIView):
                 queryset = queryset.filter(Q(image__isnull=True) | Q(image=''))
             
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) | 
-                Q(description__icontains=search)
-            )
+            queryset = search_books(queryset, search)
         
         return queryset
     
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        page = self.paginate_queryset(queryset)
-        
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
         
-        serializer = self.get_serializer(queryset, many=True)
-    
         active_filters = {}
         for param in ['genre', 'title', 'image', 'search']:
             value = request.query_params.get(param)
             if value:
                 active_filters[param] = value
         
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+            response.data['active_filters'] = active_filters
+            return response
+        
+        serializer = self.get_serializer(queryset, many=True)
+        
         response_data = {
             'count': queryset.count(),
             'active_filters': active_filters,
@@ -272,8 +287,11 @@ class BookListView(BookQuerysetMixin, ListAPIView):
         return Response(response_data)
 
 
-class BookRecommendedView(BookQuerysetMixin, ListAPIView):
+class BookRecommendedView(MetricsMixin, BookQuerysetMixin, ListAPIView):
     serializer_class = BookListSerializer
+    MAX_COUNT = 50
+    FAVORITES_POOL = 100
+    STRATEGIES = ['random', 'similar']
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -296,16 +314,50 @@ class BookRecommendedView(BookQuerysetMixin, ListAPIView):
                 queryset = queryset.filter(Q(image__isnull=True) | Q(image=''))
             
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) | 
-                Q(description__icontains=search)
-            )
+            queryset = search_books(queryset, search)
         
         return queryset
     
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        count = queryset.count()
+        try:
+            random_count = min(max(int(request.query_params.get('count', 4)), 1), self.MAX_COUNT)
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'count must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        requested = request.query_params.get('strategy', 'random')
+        if requested not in self.STRATEGIES:
+            return Response(
+                {'error': f"strategy must be one of: {', '.join(self.STRATEGIES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        book_id = request.query_params.get('book')
+        if book_id:
+            try:
+                book_id = int(book_id)
+            except ValueError:
+                return Response(
+                    {'error': 'book must be an integer'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            strategy = 'similar'
+            random_books = self._get_similar_books(book_id, random_count)
+            count = len(random_books)
+        elif requested == 'similar' and request.user.is_authenticated and not any(self._get_sampling_key(request)):
+            strategy = 'favorites'
+            random_books, count = self._get_favorites_neighbors(request.user, random_count)
+        else:
+            random_books = []
+        
+        if not random_books:
+            # Ids matching the filters are cached, so this is one query for the sampled rows
+            strategy = 'random'
+            random_books, count = book_sampler.sample(
+                self._get_sampling_key(request), self.get_queryset().select_related('genre'), random_count
+            )
         
         if count == 0:
             return Response({
@@ -314,21 +366,13 @@ class BookRecommendedView(BookQuerysetMixin, ListAPIView):
                 'total_count': 0
             }, status=status.HTTP_404_NOT_FOUND)
         
-        random_count = min(int(request.query_params.get('count', 4)), count)
-        
-        random_indices = random.sample(range(count), random_count)
-        
-        random_books = []
-        for index in random_indices:
-            book = queryset[index]
-            random_books.append(book)
-        
         serializer = self.get_serializer(random_books, many=True)
         
         response_data = {
-            'count': random_count,
+            'count': len(random_books),
             'total_count': count,
             'active_filters': self._get_active_filters(request),
+            'strategy': strategy,
             'results': serializer.data
         }
         
@@ -337,9 +381,38 @@ class BookRecommendedView(BookQuerysetMixin, ListAPIView):
     def get_serializer(self, *args, **kwargs):
         return self.serializer_class(*args, **kwargs)
     
+    def _get_similar_books(self, book_id, limit):
+        neighbors = BookNeighbor.objects.filter(book_id=book_id).select_related('neighbor__genre')[:limit]
+        return [neighbor.neighbor for neighbor in neighbors]
+    
+    def _get_favorites_neighbors(self, user, limit):
+        # Neighbors of everything the user favorited, scored by their summed similarity.
+        # The top ones are ranked once per cached pool and sampled from, books
+        # favorited since then are dropped when the sample is fetched
+        favorited = Favorite.objects.filter(user=user).values('book_id')
+        ranked = (
+            Book.objects.filter(neighbor_of__book__in=favorited)
+            .exclude(id__in=favorited)
+            .annotate(similarity=Sum('neighbor_of__score'))
+            .order_by('-similarity', 'id')
+            .values_list('id', flat=True)[:self.FAVORITES_POOL]
+        )
+        return book_sampler.sample(
+            ('favorites', user.id),
+            Book.objects.defer('search_vector').select_related('genre').exclude(id__in=favorited),
+            limit,
+            id_queryset=ranked
+        )
+    
+    def _get_sampling_key(self, request):
+        return tuple(
+            ' '.join(request.query_params.get(param, '').lower().split())
+            for param in ['genre', 'title', 'image', 'search']
+        )
+    
     def _get_active_filters(self, request):
         active_filters = {}
-        for param in ['genre', 'title', 'image', 'search', 'count']:
+        for param in ['genre', 'title', 'image', 'search', 'count', 'book', 'strategy']:
             value = request.query_params.get(param)
             if value:
                 active_filters[param] = value
@@ -386,10 +459,17 @@ class BookDetailView(BookQuerysetMixin, RetrieveAPIView):
 
 class BookCreateView(AdminRequiredMixin, BookQuerysetMixin, CreateAPIView):
     serializer_class = BookSerializer
+    
+    def perform_create(self, serializer):
+        record_book_change(serializer.save())
 
 
 class BookUpdateView(AdminRequiredMixin, BookQuerysetMixin, UpdateAPIView):
     serializer_class = BookSerializer
+    
+    def perform_update(self, serializer):
+        previous = tracked_values(serializer.instance)
+        record_book_change(serializer.save(), previous)
 
 
 class BookDeleteView(AdminRequiredMixin, BookQuerysetMixin, DestroyAPIView):
@@ -426,43 +506,85 @@ class StartScrapingView(AdminRequiredMixin, ScrapingValidationMixin, CreateAPIVi
                 status=status.HTTP_409_CONFLICT
             )
         
-        scraping_log = ScrapingLog.objects.create()
+        resume_id = request.data.get('resume', None)
+        try:
+            shards = int(request.data.get('shards') or 1)
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'shards must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if shards > 1 and resume_id:
+            return Response(
+                {'error': 'shards cannot be combined with resume, a run is resumed in a single process'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if shards > 1:
+            try:
+                check_shard_backend()
+            except ImproperlyConfigured as e:
+                return Response(
+                    {'error': str(e)}, 
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+        
+        if resume_id:
+            try:
+                scraping_log = ScrapingLog.objects.get(id=resume_id)
+            except (ScrapingLog.DoesNotExist, ValueError, TypeError):
+                return Response(
+                    {'error': 'Scraping log not found'}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            if scraping_log.status == 'completed':
+                return Response(
+                    {'error': 'This scraping has already completed'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            scraping_log.status = 'running'
+            scraping_log.save(update_fields=['status'])
+        else:
+            scraping_log = ScrapingLog.objects.create()
         
         pages_limit = request.data.get('pages', None)
         
-        scraping_thread = threading.Thread(
-            target=self._run_scraping, 
-            args=(scraping_log, pages_limit)
-        )
-        scraping_thread.daemon = True
-        scraping_thread.start()
+        if shards > 1:
+            scrape_books_task.delay(scraping_log.id, pages_limit, shards)
+        else:
+            scraping_thread = threading.Thread(
+                target=self._run_scraping, 
+                args=(scraping_log, pages_limit, bool(resume_id))
+            )
+            scraping_thread.daemon = True
+            scraping_thread.start()
         
         return Response({
-            'message': 'Scraping started',
+            'message': 'Scraping resumed' if resume_id else 'Scraping started',
             'scraping_id': scraping_log.id,
             'status': 'running'
         }, status=status.HTTP_202_ACCEPTED)
     
-    def _run_scraping(self, scraping_log, pages_limit=None):
+    def _run_scraping(self, scraping_log, pages_limit=None, resume=False):
         try:
+            options = {'resume': scraping_log.id} if resume else {'log_id': scraping_log.id}
+            if pages_limit:
+                options['pages'] = int(pages_limit)
+            
             stdout_capture = io.StringIO()
             stderr_capture = io.StringIO()
             
             with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                if pages_limit:
-                    call_command('scrape_books', pages=pages_limit)
-                else:
-                    call_command('scrape_books')
-            
-            scraping_log.status = 'completed'
-            scraping_log.total_books_found = Book.objects.count()
+                call_command('scrape_books', **options)
             
         except Exception as e:
             scraping_log.status = 'failed'
             scraping_log.error_message = str(e)
-        finally:
             scraping_log.finished_at = timezone.now()
-            scraping_log.save()
+            scraping_log.save(update_fields=['status', 'error_message', 'finished_at'])
 
 
 from drf_yasg.utils import swagger_auto_schema
@@ -538,6 +660,79 @@ class ScrapingStatusView(AdminRequiredMixin, ScrapingLogQuerysetMixin, APIView):
         return Response(serializer.data)
 
 
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only errors go through the renderer, the stream itself is written directly
+        return json.dumps(data).encode('utf-8')
+
+
+class ScrapingEventsView(AdminRequiredMixin, APIView):
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+    heartbeat_interval = 15
+    
+    @swagger_auto_schema(
+        operation_description="Stream progress of a scraping as Server-Sent Events: status, page, book, error and finished. "
+                              "Events come from the process that runs the scraping, so it has to be started from the same server",
+        operation_summary="Scraping events",
+        tags=['Scraping'],
+        responses={
+            200: openapi.Response(description="text/event-stream with scraping events"),
+            404: openapi.Response(description="Scraping was not found"),
+            403: openapi.Response(description="Access denied - administrator rights required"),
+        }
+    )
+    def get(self, request, scraping_id, *args, **kwargs):
+        # Subscribe before reading the status so no event falls in between
+        subscription = bus.subscribe(scraping_id)
+        try:
+            log = ScrapingLog.objects.get(id=scraping_id)
+        except ScrapingLog.DoesNotExist:
+            subscription.close()
+            return Response(
+                {'error': 'Scraping log not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        response = StreamingHttpResponse(
+            self.stream(subscription, ScrapingLogSerializer(log).data),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def stream(self, subscription, snapshot):
+        # A plain generator, so the WSGI server sends each event as it is yielded
+        scraping_id = subscription.scraping_log_id
+        try:
+            yield format_event({'event': 'status', 'scraping_id': scraping_id, **snapshot})
+            if snapshot['status'] != 'running':
+                return
+            
+            while True:
+                message = subscription.get(timeout=self.heartbeat_interval)
+                if message is None:
+                    # Runs started by another process never publish here,
+                    # so an idle stream checks once per heartbeat whether it is over
+                    current_status = ScrapingLog.objects.filter(id=scraping_id).values_list(
+                        'status', flat=True
+                    ).first()
+                    if current_status != 'running':
+                        yield format_event({'event': 'finished', 'scraping_id': scraping_id, 'status': current_status})
+                        return
+                    yield ': keep-alive\n\n'
+                    continue
+                
+                yield format_event(message)
+                if message['event'] == 'finished':
+                    return
+        finally:
+            subscription.close()
+
+
 class StopScrapingView(AdminRequiredMixin, ScrapingValidationMixin, APIView):
     
     @swagger_auto_schema(
@@ -575,16 +770,16 @@ class StopScrapingView(AdminRequiredMixin, ScrapingValidationMixin, APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        for log in running_logs:
-            log.status = 'interrupted'
-            log.finished_at = timezone.now()
-            log.save()
+        # Running crawls poll their log status and stop on their own;
+        # update() leaves their progress counters alone
+        running_logs.update(status='interrupted', finished_at=timezone.now())
         
         return Response({'message': 'Scraping was stopped'})
 
 
-class BookSearchView(BookQuerysetMixin, ListAPIView):
+class BookSearchView(MetricsMixin, BookQuerysetMixin, ListAPIView):
     serializer_class = BookListSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -603,17 +798,12 @@ class BookSearchView(BookQuerysetMixin, ListAPIView):
     
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) | 
-                Q(description__icontains=search) |
-                Q(genre__icontains=search)
-            )
+            queryset = search_books(queryset, search)
         
         return queryset
     
     def get(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
         
         search_params = {
             'genre': request.query_params.get('genre'),
@@ -623,13 +813,47 @@ class BookSearchView(BookQuerysetMixin, ListAPIView):
         
         active_search = {k: v for k, v in search_params.items() if v}
         
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+            response.data['search_parameters'] = active_search
+            # Keys of the unpaginated response, kept for existing clients;
+            # the total is only known when ?count=true asked for it
+            if self.paginator.count is not None:
+                response.data['total_found'] = self.paginator.count
+            response.data['books'] = response.data['results']
+            return response
+        
+        serializer = self.get_serializer(queryset, many=True)
+        
         return Response({
             'search_parameters': active_search,
-            'total_found': queryset.count(),
+            'total_found': len(serializer.data),
             'books': serializer.data
         })
 
 
+class BookSuggestView(MetricsMixin, APIView):
+    MIN_LENGTH = 2
+    MAX_LIMIT = 20
+    
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', 8)), self.MAX_LIMIT)
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'limit must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = suggest_books(query, max(limit, 1)) if len(query) >= self.MIN_LENGTH else []
+        response = Response({'query': query, 'results': results})
+        response['Cache-Control'] = 'public, max-age=60'
+        return response
+
+
 class BookStatsView(APIView):
     def get(self, request):
         total_books = Book.objects.count()
@@ -655,7 +879,7 @@ class BookStatsView(APIView):
     def _calculate_stats(self):
         total_books = Book.objects.count()
         recent_books = Book.objects.filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=7)
+            created_at__gte=timezone.now() - timedelta(days=7)
         ).count()
         
         last_scraping = ScrapingLog.objects.first()
@@ -675,3 +899,74 @@ class BookStatsView(APIView):
             }
         
         return stats
+
+
+class BookHistoryView(MetricsMixin, APIView):
+    def get(self, request, book_id):
+        book = get_object_or_404(Book.objects.only('id', 'title'), id=book_id)
+        
+        state = {}
+        history = []
+        for recorded_at, *values in BookHistory.objects.filter(book_id=book.id).order_by('recorded_at').values_list(
+            'recorded_at', *TRACKED_FIELDS
+        ):
+            # Entries only hold what changed, the rest is carried over from earlier ones
+            state.update((field, value) for field, value in zip(TRACKED_FIELDS, values) if value is not None)
+            history.append({'recorded_at': recorded_at, **state})
+        
+        return Response({
+            'book_id': book.id,
+            'title': book.title,
+            'history': history
+        })
+
+
+class BookHistoryStatsView(MetricsMixin, APIView):
+    PERIODS = ['day', 'week', 'month']
+    MAX_DAYS = 730
+    
+    def get(self, request):
+        try:
+            days = int(request.query_params.get('days', 30))
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'days must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not 1 <= days <= self.MAX_DAYS:
+            return Response(
+                {'error': f'days must be between 1 and {self.MAX_DAYS}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        period = request.query_params.get('period', 'day')
+        if period not in self.PERIODS:
+            return Response(
+                {'error': f"period must be one of: {', '.join(self.PERIODS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        since = timezone.now() - timedelta(days=days)
+        books = Book.objects.all()
+        entries = BookHistory.objects.filter(recorded_at__gte=since)
+        genre = request.query_params.get('genre')
+        if genre:
+            books = books.filter(genre__name__icontains=genre)
+            entries = entries.filter(book__genre__name__icontains=genre)
+        
+        # A stored in_stock=False means the book went out of stock (or was first seen that way)
+        stock_outs = (
+            entries.filter(in_stock=False)
+            .annotate(day=TruncDate('recorded_at'))
+            .values('day')
+            .annotate(stock_outs=Count('id'))
+            .order_by('day')
+        )
+        
+        return Response({
+            'days': days,
+            'period': period,
+            'average_price_by_genre': average_prices(books, since, period),
+            'stock_outs_by_day': list(stock_outs)
+        })
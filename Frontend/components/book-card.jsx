@@ -7,6 +7,9 @@ import { useAddToFavoritesMutation, useRemoveFromFavoritesMutation } from "@/lib
 import { addToFavorites, removeFromFavorites } from "@/lib/slices/favoritesSlice"
 import { toast } from "react-hot-toast"
 
+// Width of a card in the grid: one, two or four columns
+const COVER_SIZES = "(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+
 export default function BookCard({ book }) {
   const dispatch = useAppDispatch()
   const { favoriteIds } = useAppSelector((state) => state.favorites)
@@ -17,6 +20,14 @@ export default function BookCard({ book }) {
   const isFavorite = favoriteIds.includes(book.id)
   const isUpdatingFavorites = isAddingToFavorites || isRemovingFromFavorites
 
+  // Resized covers from the API, so the grid never downloads the originals
+  const coverSrcSet = (format) =>
+    ["thumb", "card"]
+      .map((size) => book.image_srcset?.[size])
+      .filter((derivative) => derivative?.[format])
+      .map((derivative) => `${derivative[format]} ${derivative.width}w`)
+      .join(", ")
+
   const handleFavoriteClick = async (e) => {
     e.preventDefault()
     e.stopPropagation()
@@ -68,11 +79,17 @@ export default function BookCard({ book }) {
       <div className="relative overflow-hidden">
         <Link href={`/books/${book.id}`}>
           <div className="aspect-[3/4] overflow-hidden">
-            <img
-              src={book.image || "/placeholder.svg?height=400&width=300"}
-              alt={book.title}
-              className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
-            />
+            <picture>
+              {coverSrcSet("webp") && <source type="image/webp" srcSet={coverSrcSet("webp")} sizes={COVER_SIZES} />}
+              <img
+                src={book.image_url || book.image || "/placeholder.svg?height=400&width=300"}
+                srcSet={coverSrcSet("jpeg") || undefined}
+                sizes={COVER_SIZES}
+                alt={book.title}
+                loading="lazy"
+                className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
+              />
+            </picture>
           </div>
         </Link>
 
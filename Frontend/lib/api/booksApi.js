@@ -1,6 +1,11 @@
 import { createApi, fetchBaseQuery } from "@reduxjs/toolkit/query/react"
 import { getAuthToken } from "../utils/cookies"
 
+const pageCursors = new Map()
+const pageTotals = new Map()
+
+const cursorFromLink = (link) => (link ? new URL(link).searchParams.get("cursor") : null)
+
 export const booksApi = createApi({
   reducerPath: "booksApi",
   baseQuery: fetchBaseQuery({
@@ -29,57 +34,90 @@ export const booksApi = createApi({
   tagTypes: ["Book", "Favorites"],
   endpoints: (builder) => ({
     getBooks: builder.query({
-      query: (params) => {
-        const requestConfig = {
-          url: "/scraping/book_list/",
-          params: {
-            ...params,
-            limit: Math.min(params?.limit || 20, 20), // Максимум 20 книжок на сторінку
-            ...(params?.title && { title: params.title }),
-            ...(params?.genre && { genre: params.genre }),
-            ...(params?.fromYear && { fromYear: params.fromYear }),
-            ...(params?.toYear && { toYear: params.toYear }),
-          },
+      // The list is paginated with keyset cursors: page N is reached through the
+      // "next" link of page N - 1, so the cursors already seen are remembered.
+      // Jumping to a page without a cursor walks the pages before it one by one
+      async queryFn(params, api, extraOptions, baseQuery) {
+        const pageSize = Math.min(params?.limit || 20, 20) // Максимум 20 книжок на сторінку
+        const page = params?.page || 1
+        const query = {
+          page_size: pageSize,
+          ...(params?.title && { title: params.title }),
+          ...(params?.genre && { genre: params.genre }),
+          ...(params?.fromYear && { fromYear: params.fromYear }),
+          ...(params?.toYear && { toYear: params.toYear }),
         }
+        const key = JSON.stringify(query)
 
-        if (process.env.NODE_ENV === "development") {
-          console.log("📚 Books API Request:", requestConfig)
-          console.log("🌐 Full URL:", `${process.env.NEXT_PUBLIC_API_URL}/scraping/book_list/`)
+        let current = page
+        while (current > 1 && !pageCursors.has(`${key}:${current}`)) {
+          current -= 1
         }
 
-        return requestConfig
-      },
-      transformResponse: (response, meta, arg) => {
-        console.log("📚 Books API Response:", response)
+        let result
+        while (true) {
+          const cursor = pageCursors.get(`${key}:${current}`)
+          // Counting scans every match, so the total is only asked for with the
+          // first page of each set of filters
+          const withCount = !cursor || !pageTotals.has(key)
+          const requestConfig = {
+            url: "/scraping/book_list/",
+            params: { ...query, ...(cursor && { cursor }), ...(withCount && { count: 1 }) },
+          }
+          if (process.env.NODE_ENV === "development") {
+            console.log("📚 Books API Request:", requestConfig)
+          }
 
-        if (response && typeof response === "object" && response.results) {
-          return {
-            books: response.results || [],
-            total: response.count || 0,
-            page: arg?.page || 1,
-            limit: Math.min(arg?.limit || 20, 20),
+          result = await baseQuery(requestConfig)
+          if (result.error) {
+            console.error("🚨 Books API Error:", result.error)
+            return { error: result.error }
           }
-        }
 
-        if (Array.isArray(response)) {
-          return {
-            books: response,
-            total: response.length,
-            page: arg?.page || 1,
-            limit: Math.min(arg?.limit || 20, 20),
+          if (result.data?.count !== undefined) {
+            pageTotals.set(key, result.data.count)
           }
+          const nextCursor = cursorFromLink(result.data?.next)
+          if (nextCursor) {
+            pageCursors.set(`${key}:${current + 1}`, nextCursor)
+          }
+          if (current >= page || !nextCursor) {
+            break
+          }
+          current += 1
         }
 
+        console.log("📚 Books API Response:", result.data)
         return {
-          books: response?.books || response || [],
-          total: response?.total || response?.count || 0,
-          page: arg?.page || 1,
-          limit: Math.min(arg?.limit || 20, 20),
+          data: {
+            books: result.data?.results || [],
+            total: pageTotals.get(key) || 0,
+            page: current,
+            limit: pageSize,
+          },
         }
       },
-      transformErrorResponse: (response, meta, arg) => {
-        console.error("🚨 Books API Error:", response)
-        return response
+      providesTags: ["Book"],
+    }),
+    getAllBooks: builder.query({
+      // Follows the "next" links until the whole catalogue is loaded
+      async queryFn(arg, api, extraOptions, baseQuery) {
+        const books = []
+        let cursor = null
+        do {
+          const result = await baseQuery({
+            url: "/scraping/book_list/",
+            params: { page_size: 100, ...(cursor && { cursor }) },
+          })
+          if (result.error) {
+            console.error("🚨 Books API Error:", result.error)
+            return { error: result.error }
+          }
+          books.push(...(result.data?.results || []))
+          cursor = cursorFromLink(result.data?.next)
+        } while (cursor)
+
+        return { data: { books, total: books.length } }
       },
       providesTags: ["Book"],
     }),
@@ -117,28 +155,26 @@ export const booksApi = createApi({
     }),
     // Favorites endpoints
     getFavorites: builder.query({
-      query: () => "/scraping/book_favorites/",
-      providesTags: ["Favorites"],
-      transformResponse: (response) => {
-        console.log("❤️ Favorites API Response:", response)
-        // Якщо response це масив книжок
-        if (Array.isArray(response)) {
-          return response
-        }
-        // Якщо response це об'єкт з results
-        if (response && response.results) {
-          return response.results
-        }
-        // Якщо response це об'єкт з books
-        if (response && response.books) {
-          return response.books
-        }
-        return []
-      },
-      transformErrorResponse: (response) => {
-        console.error("❌ Get Favorites API Error:", response)
-        return response
+      // Favorites are paginated too: follow the "next" links so every favorite is known
+      async queryFn(arg, api, extraOptions, baseQuery) {
+        const favorites = []
+        let cursor = null
+        do {
+          const result = await baseQuery({
+            url: "/scraping/book_favorites/",
+            params: { page_size: 100, ...(cursor && { cursor }) },
+          })
+          if (result.error) {
+            console.error("❌ Get Favorites API Error:", result.error)
+            return { error: result.error }
+          }
+          favorites.push(...(result.data?.results || []))
+          cursor = cursorFromLink(result.data?.next)
+        } while (cursor)
+
+        return { data: favorites }
       },
+      providesTags: ["Favorites"],
     }),
     addToFavorites: builder.mutation({
       query: (bookId) => {
@@ -179,6 +215,7 @@ export const booksApi = createApi({
 
 export const {
   useGetBooksQuery,
+  useGetAllBooksQuery,
   useGetBookByIdQuery,
   useGetRecommendedBooksQuery,
   useCreateBookMutation,